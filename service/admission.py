@@ -0,0 +1,153 @@
+import os
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict
+
+from metrics import register_admission_controller
+
+logger = logging.getLogger(__name__)
+
+# --- 准入控制配置 ---
+# ADMISSION_MAX_CONCURRENT: 同时运行的团队 (写作 / 修改任务) 上限，0 表示不限
+# ADMISSION_MAX_QUEUE: 排队请求的上限，超过后直接拒绝
+# ADMISSION_TENANT_HEADER: 标识租户 / 班级的请求头，同一租户的请求共用一个队列，不同租户之间轮流调度
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "8"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "200"))
+ADMISSION_TENANT_HEADER = os.getenv("ADMISSION_TENANT_HEADER", "X-Tenant-ID")
+DEFAULT_TENANT = "default"
+
+
+class AdmissionRejectedError(RuntimeError):
+    """排队请求已达上限，请求被拒绝。"""
+
+
+class _Waiter:
+    def __init__(self, tenant: str):
+        self.tenant = tenant
+        self.admitted = False
+        self.changed = asyncio.Event()  # 被放行或排队位置可能变化时置位
+
+
+class AdmissionController:
+    """
+    全局并发上限 + 按租户公平排队。
+
+    运行中的任务达到上限后，新请求进入所属租户的队列；有名额空出时按租户轮流放行，
+    一个班级的突发请求不会饿死其他班级。排队期间通过回调报告当前位置 (从 1 开始)。
+    """
+
+    def __init__(self, max_concurrent: int = ADMISSION_MAX_CONCURRENT, max_queue: int = ADMISSION_MAX_QUEUE):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.running = 0
+        self._queues: Dict[str, Deque[_Waiter]] = {}
+        self._tenants: Deque[str] = deque()  # 轮转顺序，队首的租户下一个被放行
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _has_capacity(self) -> bool:
+        return self.max_concurrent <= 0 or self.running < self.max_concurrent
+
+    def position(self, waiter: _Waiter) -> int:
+        """按轮转调度推算 waiter 被放行前还有多少请求，返回从 1 开始的位置。"""
+        index = self._queues[waiter.tenant].index(waiter)
+        ahead = 0
+        for tenant in self._tenants:
+            length = len(self._queues[tenant])
+            if tenant == waiter.tenant:
+                ahead += index
+            else:
+                # 之前的轮次各放行一个；本轮中排在前面的租户还会再放行一个
+                ahead += min(length, index + (1 if self._tenants.index(tenant) < self._tenants.index(waiter.tenant) else 0))
+        return ahead + 1
+
+    def _notify_all(self) -> None:
+        for queue in self._queues.values():
+            for waiter in queue:
+                waiter.changed.set()
+
+    def _dispatch(self) -> None:
+        while self._tenants and self._has_capacity():
+            tenant = self._tenants.popleft()
+            queue = self._queues[tenant]
+            waiter = queue.popleft()
+            if queue:
+                self._tenants.append(tenant)  # 还有请求的租户排到轮转末尾
+            else:
+                del self._queues[tenant]
+            waiter.admitted = True
+            waiter.changed.set()
+            self.running += 1
+        self._notify_all()
+
+    def _remove(self, waiter: _Waiter) -> None:
+        queue = self._queues.get(waiter.tenant)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        if not queue:
+            del self._queues[waiter.tenant]
+            self._tenants.remove(waiter.tenant)
+        self._notify_all()
+
+    @asynccontextmanager
+    async def admit(
+        self,
+        tenant: str = DEFAULT_TENANT,
+        on_position: Callable[[int], Awaitable[None]] | None = None,
+    ) -> AsyncIterator[None]:
+        """
+        获取运行名额，退出上下文时归还。
+        Args:
+            tenant: 租户 / 班级标识
+            on_position: 排队位置变化时调用的回调 (直接获得名额时不会调用)
+        """
+        if self._has_capacity() and not self._tenants:
+            self.running += 1
+        else:
+            if self.queued >= self.max_queue:
+                raise AdmissionRejectedError(f"排队请求已达上限 ({self.max_queue})，请稍后重试。")
+            waiter = _Waiter(tenant)
+            if tenant not in self._queues:
+                self._queues[tenant] = deque()
+                self._tenants.append(tenant)
+            self._queues[tenant].append(waiter)
+            self._notify_all()
+            last_position = None
+            try:
+                while not waiter.admitted:
+                    waiter.changed.clear()
+                    position = self.position(waiter)
+                    if position != last_position and on_position is not None:
+                        last_position = position
+                        await on_position(position)
+                    if not waiter.admitted:
+                        await waiter.changed.wait()
+            except BaseException:
+                if waiter.admitted:
+                    self.running -= 1
+                    self._dispatch()
+                else:
+                    self._remove(waiter)
+                raise
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "running": self.running,
+            "queued": self.queued,
+            "tenants": {tenant: len(queue) for tenant, queue in self._queues.items()},
+        }
+
+
+admission_controller = AdmissionController()
+register_admission_controller(admission_controller)
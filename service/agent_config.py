@@ -0,0 +1,320 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import tomllib
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Tuple
+
+from context_policy import ContextPolicy
+from dag import DagNode, _validate as validate_dag
+from state_machine import Transition, USER_KEY, END
+
+try:
+    import yaml  # 可选依赖，仅在使用 .yaml / .yml 配置文件时需要
+except ImportError:
+    yaml = None
+
+logger = logging.getLogger(__name__)
+
+# --- 智能体 / 团队配置文件 ---
+# AGENT_CONFIG_PATH: 声明式配置文件 (TOML，安装 PyYAML 后也支持 YAML)
+# AGENT_CONFIG_RELOAD_INTERVAL: 检查配置文件是否修改的间隔 (秒)，修改后自动热加载；0 表示只能通过 POST /config/reload 加载
+AGENT_CONFIG_PATH = os.getenv("AGENT_CONFIG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent_config.toml"))
+AGENT_CONFIG_RELOAD_INTERVAL = float(os.getenv("AGENT_CONFIG_RELOAD_INTERVAL", "0"))
+
+PROVIDERS = ("openai", "deepseek", "grok", "gemini", "ollama")
+TIERS = ("local", "remote")
+TEAM_MODES = ("pipeline", "selector", "dag")
+
+_AGENT_FIELDS = {"name", "provider", "model", "system_message", "description", "fallbacks", "final_result", "context_policy", "tier"}
+_TEAM_FIELDS = {"mode", "pipeline", "dag", "final", "scorers", "selector", "speculation"}
+_SELECTOR_FIELDS = {"allow_repeated_speaker", "transitions", "max_iterations"}
+_TRANSITION_FIELDS = {"next", "score_at_least", "otherwise"}
+_SPECULATION_FIELDS = {"writer", "reconciler"}
+
+
+class AgentConfigError(ValueError):
+    """配置文件无法解析或校验失败。"""
+
+
+@dataclass(frozen=True)
+class AgentSpec:
+    """编译后的智能体定义 (不可变)。"""
+    key: str
+    name: str
+    provider: str
+    model: str
+    system_message: str
+    description: str | None = None
+    fallbacks: Tuple[Tuple[str, str], ...] = ()
+    final_result: bool = False
+    context_policy: ContextPolicy | None = None
+    tier: str = "remote"  # 分层执行时使用的层级 (见 tiering.py)
+
+    @property
+    def routes(self) -> Tuple[Tuple[str, str], ...]:
+        """候选 (provider, model)，第一个为首选。"""
+        return ((self.provider, self.model), *self.fallbacks)
+
+
+@dataclass(frozen=True)
+class TeamSpec:
+    """编译后的团队定义 (不可变)。"""
+    name: str
+    pipeline: Tuple[str, ...]                    # 流水线 / 选择器团队的代理顺序 (智能体键)
+    dag: Tuple[DagNode, ...] = ()                # DAG 团队的节点，为空表示不支持 DAG 模式
+    mode: str | None = None                      # 覆盖全局 TEAM_MODE
+    final: Tuple[str, ...] = ()                  # 输出最终作文的智能体键 (取其中最新的一条)，默认为流程的最后一个
+    scorers: Tuple[str, ...] = ()                # 评分代理的智能体键，请求的 score_threshold 按其评分提前结束 (见 termination.py)
+    allow_repeated_speaker: bool = False
+    transitions: Mapping[str, Transition] = field(default_factory=lambda: MappingProxyType({}))  # 选择器转移表：发言者名称 -> Transition
+    max_iterations: int = 1                      # 选择器模式下每个代理最多发言的次数 (限制转移表中的循环)
+    speculative_writer: str | None = None        # 推测式起草的写作代理键 (见 speculation.py)
+    reconciler: str | None = None                # 核对推测草稿的智能体键
+
+
+@dataclass(frozen=True)
+class AgentConfig:
+    agents: Mapping[str, AgentSpec]
+    teams: Mapping[str, TeamSpec]
+    path: str
+    digest: str  # 配置内容的摘要，用于判断热加载时是否真的有变化
+
+
+def _require(table: Dict[str, Any], field: str, where: str) -> Any:
+    if field not in table:
+        raise AgentConfigError(f"{where} 缺少字段 {field}")
+    return table[field]
+
+
+def _check_fields(table: Dict[str, Any], allowed: set, where: str) -> None:
+    unknown = set(table) - allowed
+    if unknown:
+        raise AgentConfigError(f"{where} 包含未知字段: {sorted(unknown)}")
+
+
+def _compile_agent(key: str, table: Dict[str, Any]) -> AgentSpec:
+    where = f"agents.{key}"
+    _check_fields(table, _AGENT_FIELDS, where)
+    provider = str(_require(table, "provider", where)).lower()
+    for route in table.get("fallbacks", ()):
+        if not isinstance(route, (list, tuple)) or len(route) != 2:
+            raise AgentConfigError(f"{where}.fallbacks 的每一项必须是 [provider, model]: {route!r}")
+    fallbacks = tuple((str(p).lower(), str(m)) for p, m in table.get("fallbacks", ()))
+    for candidate, _ in ((provider, None), *fallbacks):
+        if candidate not in PROVIDERS:
+            raise AgentConfigError(f"{where} 使用了不支持的提供商: {candidate}")
+    policy = table.get("context_policy")
+    if policy is not None:
+        if not isinstance(policy, dict):
+            raise AgentConfigError(f"{where}.context_policy 必须是表")
+        try:
+            policy = ContextPolicy(**{**policy, "sources": tuple(policy["sources"]) if policy.get("sources") is not None else None})
+        except (TypeError, ValueError) as e:
+            raise AgentConfigError(f"{where}.context_policy 无效: {e}")
+    tier = table.get("tier", "remote")
+    if tier not in TIERS:
+        raise AgentConfigError(f"{where} 使用了不支持的层级: {tier}")
+    return AgentSpec(
+        key=key,
+        name=str(_require(table, "name", where)),
+        provider=provider,
+        model=str(_require(table, "model", where)),
+        system_message=str(_require(table, "system_message", where)),
+        description=table.get("description"),
+        fallbacks=fallbacks,
+        final_result=bool(table.get("final_result", False)),
+        context_policy=policy,
+        tier=tier,
+    )
+
+
+def _compile_team(name: str, table: Dict[str, Any], agents: Mapping[str, AgentSpec]) -> TeamSpec:
+    where = f"teams.{name}"
+    _check_fields(table, _TEAM_FIELDS, where)
+    pipeline = tuple(_require(table, "pipeline", where))
+    for node in table.get("dag", ()):
+        if not isinstance(node, dict) or "key" not in node:
+            raise AgentConfigError(f"{where}.dag 的每个节点必须是包含 key 的表: {node!r}")
+    dag = tuple(DagNode(node["key"], tuple(node.get("depends_on", ()))) for node in table.get("dag", ()))
+    referenced = set(pipeline) | {node.key for node in dag}
+    final = table.get("final", ())
+    final = (final,) if isinstance(final, str) else tuple(final)
+    referenced.update(final)
+    scorers = tuple(table.get("scorers", ()))
+    referenced.update(scorers)
+    missing = sorted(key for key in referenced if key not in agents)
+    if missing:
+        raise AgentConfigError(f"{where} 引用了未定义的智能体: {missing}")
+    if len(set(agents[key].name for key in pipeline)) != len(pipeline):
+        raise AgentConfigError(f"{where}.pipeline 中的代理名称重复")
+    if dag:
+        try:
+            validate_dag(dag)
+        except ValueError as e:
+            raise AgentConfigError(f"{where}.dag 无效: {e}")
+    mode = table.get("mode")
+    if mode is not None and mode not in TEAM_MODES:
+        raise AgentConfigError(f"{where} 使用了不支持的团队模式: {mode}")
+    if mode == "dag" and not dag:
+        raise AgentConfigError(f"{where} 使用 dag 模式但没有声明 dag 节点")
+
+    selector = table.get("selector", {})
+    _check_fields(selector, _SELECTOR_FIELDS, f"{where}.selector")
+    # 转移表以智能体键声明，编译时换算为代理名称，选择发言者时直接按名称查表
+    names = {USER_KEY: USER_KEY, **{key: agents[key].name for key in pipeline}}
+
+    def target_name(source: str, target: str) -> str:
+        if target and target not in names:
+            raise AgentConfigError(f"{where}.selector.transitions 引用了不在团队中的智能体: {source} -> {target}")
+        return names[target] if target else END
+
+    transitions: Dict[str, Transition] = {}
+    for source, target in selector.get("transitions", {}).items():
+        if source not in names:
+            raise AgentConfigError(f"{where}.selector.transitions 引用了不在团队中的智能体: {source}")
+        if isinstance(target, str):
+            transitions[names[source]] = Transition(target_name(source, target))
+            continue
+        _check_fields(target, _TRANSITION_FIELDS, f"{where}.selector.transitions.{source}")
+        transitions[names[source]] = Transition(
+            target_name(source, _require(target, "next", f"{where}.selector.transitions.{source}")),
+            score_at_least=float(target["score_at_least"]) if "score_at_least" in target else None,
+            otherwise=target_name(source, target.get("otherwise", "")),
+        )
+    if transitions and USER_KEY not in transitions:
+        raise AgentConfigError(f"{where}.selector.transitions 缺少起始状态 {USER_KEY}")
+    max_iterations = int(selector.get("max_iterations", 1))
+    if max_iterations < 1:
+        raise AgentConfigError(f"{where}.selector.max_iterations 必须大于 0")
+    speculation = table.get("speculation", {})
+    _check_fields(speculation, _SPECULATION_FIELDS, f"{where}.speculation")
+    speculative_writer = reconciler = None
+    if speculation:
+        speculative_writer = _require(speculation, "writer", f"{where}.speculation")
+        reconciler = _require(speculation, "reconciler", f"{where}.speculation")
+        if speculative_writer not in set(pipeline) | {node.key for node in dag}:
+            raise AgentConfigError(f"{where}.speculation.writer 不在团队中: {speculative_writer}")
+        if speculative_writer in pipeline[:1] or speculative_writer in [node.key for node in dag if not node.depends_on]:
+            raise AgentConfigError(f"{where}.speculation.writer 是流程的第一个代理，没有可以并行的规划")
+        if reconciler not in agents:
+            raise AgentConfigError(f"{where}.speculation 引用了未定义的智能体: {reconciler}")
+    return TeamSpec(
+        name=name,
+        pipeline=pipeline,
+        dag=dag,
+        mode=mode,
+        final=final,
+        scorers=scorers,
+        allow_repeated_speaker=bool(selector.get("allow_repeated_speaker", False)),
+        transitions=MappingProxyType(transitions),
+        max_iterations=max_iterations,
+        speculative_writer=speculative_writer,
+        reconciler=reconciler,
+    )
+
+
+def parse_agent_config(raw: bytes, path: str) -> AgentConfig:
+    """解析并校验配置内容，编译为不可变的 AgentConfig。"""
+    try:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise AgentConfigError("使用 YAML 配置文件需要安装 PyYAML")
+            data = yaml.safe_load(raw) or {}
+        else:
+            data = tomllib.loads(raw.decode("utf-8"))
+    except (tomllib.TOMLDecodeError, UnicodeDecodeError) as e:
+        raise AgentConfigError(f"配置文件 {path} 无法解析: {e}")
+    except Exception as e:
+        if yaml is not None and isinstance(e, yaml.YAMLError):
+            raise AgentConfigError(f"配置文件 {path} 无法解析: {e}")
+        raise
+    try:
+        _check_fields(data, {"agents", "teams"}, "配置文件")
+        agents = {key: _compile_agent(key, table) for key, table in data.get("agents", {}).items()}
+        teams = {name: _compile_team(name, table, agents) for name, table in data.get("teams", {}).items()}
+    except AgentConfigError:
+        raise
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        # 字段类型不符等没有逐项校验到的错误，同样作为配置错误处理 (热加载和 /config/reload 保留当前配置)
+        raise AgentConfigError(f"配置文件 {path} 无效: {type(e).__name__}: {e}")
+    return AgentConfig(
+        agents=MappingProxyType(agents),
+        teams=MappingProxyType(teams),
+        path=path,
+        digest=hashlib.sha256(raw).hexdigest()[:16],
+    )
+
+
+class AgentConfigRegistry:
+    """
+    持有当前生效的配置。首次访问时加载；reload() 在文件修改后重新编译并原子替换，
+    校验失败时保留旧配置。配置变化时通知监听者 (如团队池丢弃按旧配置创建的实例)。
+    每个 worker 进程独立检查文件，无需重启即可生效。
+    """
+
+    def __init__(self, path: str = AGENT_CONFIG_PATH):
+        self.path = path
+        self._config: AgentConfig | None = None
+        self._mtime: float | None = None
+        self._listeners: List[Callable[[AgentConfig], None]] = []
+        self.loaded_at: float | None = None
+
+    @property
+    def config(self) -> AgentConfig:
+        if self._config is None:
+            self._config = self._load()
+        return self._config
+
+    def _load(self) -> AgentConfig:
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path, "rb") as f:
+            config = parse_agent_config(f.read(), self.path)
+        self._mtime = mtime
+        self.loaded_at = time.time()
+        logger.info(f"已加载智能体配置 {self.path} ({len(config.agents)} 个智能体，{len(config.teams)} 个团队，版本 {config.digest})")
+        return config
+
+    def add_listener(self, listener: Callable[[AgentConfig], None]) -> None:
+        self._listeners.append(listener)
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        文件修改过 (或 force) 时重新加载，返回配置是否发生变化。
+        配置无效时抛出 AgentConfigError，当前配置保持不变。
+        """
+        if self._config is not None and not force and os.stat(self.path).st_mtime == self._mtime:
+            return False
+        previous = self._config
+        config = self._load()
+        if previous is not None and config.digest == previous.digest:
+            return False
+        self._config = config
+        for listener in self._listeners:
+            listener(config)
+        return True
+
+    async def watch(self, interval: float = AGENT_CONFIG_RELOAD_INTERVAL) -> None:
+        """后台定期检查配置文件 (在服务启动时创建任务)。"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.reload()
+            except (AgentConfigError, OSError) as e:
+                logger.error(f"热加载智能体配置失败，继续使用当前配置: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        config = self.config
+        return {
+            "path": config.path,
+            "version": config.digest,
+            "loaded_at": self.loaded_at,
+            "agents": len(config.agents),
+            "teams": sorted(config.teams),
+        }
+
+
+agent_config = AgentConfigRegistry()
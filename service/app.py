@@ -2,12 +2,15 @@ import sys
 import os
 import logging
 import asyncio
-import json
-from typing import Dict, Any, AsyncGenerator
+from typing import Dict, Any, AsyncGenerator, List
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from sse_starlette.sse import EventSourceResponse
+from autogen_agentchat.base import TaskResult
+from autogen_agentchat.messages import BaseChatMessage, ModelClientStreamingChunkEvent, StructuredMessage
+from opentelemetry import trace
 
 # 配置日志记录
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -20,13 +23,23 @@ if current_dir not in sys.path:
 
 # 尝试导入 agents 和 teams
 try:
-    from agents import user_proxy
-    from teams import (
-        chinese_writing_team,
-        english_writing_team,
-        chinese_revision_team,
-        english_revision_team
-    )
+    from teams import team_pools, TEAM_POOL_PREWARM, get_final_agent_names, get_scorer_names, configure_run, uses_local_tier
+    from termination import RunLimits, resolve_run_limits
+    from tiering import RoutingRules, set_request_routing, local_tier, LOCAL_TIER_WARM_INTERVAL
+    from scoring import parse_score
+    from speculation import speculation_stats
+    from client_registry import client_registry
+    from result_cache import result_cache, in_flight_runs, make_result_cache_key, StreamBroadcast
+    from llm_cache import get_completion_cache
+    from prompt_cache import prompt_cache_stats
+    from metrics import ACTIVE_STREAMS, start_request_usage, observe_request_usage, render_metrics
+    from tracing import setup_tracing, shutdown_tracing, start_request_span, end_request_span
+    from admission import admission_controller, ADMISSION_TENANT_HEADER, DEFAULT_TENANT
+    from jobs import JobManager, JobStore, JOB_QUEUED
+    from batch import run_batch, BATCH_MAX_ITEMS
+    from sse import encode_event, delta_events, event_source_response
+    from final_result import final_result_from_message
+    from agent_config import agent_config, AgentConfigError, AGENT_CONFIG_RELOAD_INTERVAL
     logger.info("成功导入 agents 和 teams 模块。")
 except ImportError as e:
     logger.error(f"导入模块失败: {e}", exc_info=True)
@@ -47,6 +60,9 @@ app = FastAPI(
     version="0.1.0",
 )
 
+# 配置热加载后，旧配置产出的结果不再从结果缓存中回放
+agent_config.add_listener(lambda config: result_cache.clear())
+
 # --- 启动事件：打印已注册路由 ---
 @app.on_event("startup")
 async def startup_event():
@@ -59,286 +75,572 @@ async def startup_event():
             # 对于其他类型的路由（如 WebSocketRoute, Mount），只打印路径
             logger.info(f"Path: {route.path}, Type: {type(route).__name__}")
     logger.info("-------------------------")
+    setup_tracing()
+    job_manager.start()
+    # 代理和模型客户端都是懒加载的；在后台预创建团队实例，不阻塞服务启动
+    if TEAM_POOL_PREWARM > 0:
+        app.state.warmup_task = asyncio.create_task(warm_up_team_pools(TEAM_POOL_PREWARM))
+    # 定期检查智能体配置文件，修改后热加载 (不需要重启 worker)
+    if AGENT_CONFIG_RELOAD_INTERVAL > 0:
+        app.state.config_watch_task = asyncio.create_task(agent_config.watch(AGENT_CONFIG_RELOAD_INTERVAL))
+    # 有代理可能使用本地层时预热本地模型，并在空闲时保持常驻，避免首个请求承担模型加载时间
+    if uses_local_tier() and LOCAL_TIER_WARM_INTERVAL > 0:
+        app.state.local_tier_warm_task = asyncio.create_task(local_tier.keep_warm(LOCAL_TIER_WARM_INTERVAL))
+
+async def warm_up_team_pools(count: int):
+    """后台预热：逐个池预创建团队实例，每个池之间让出事件循环，避免影响已到达的请求。"""
+    for pool in team_pools.values():
+        try:
+            pool.prewarm(count)
+        except Exception as e:
+            logger.error(f"预热团队池 {pool.name} 失败: {e}", exc_info=True)
+        await asyncio.sleep(0)
+    logger.info("团队池后台预热完成。")
+
+# --- 关闭事件：释放共享的模型客户端连接池 ---
+@app.on_event("shutdown")
+async def shutdown_event():
+    await job_manager.stop()
+    await client_registry.aclose()
+    shutdown_tracing()
 
 # --- 请求模型 ---
+# limits: 本次运行的结束条件 (评分阈值、发言次数、token / 时间预算、作文改动比例)，见 termination.py
+# routing: 本次运行的分层路由规则 (哪些代理使用本地模型)，见 tiering.py
 class WriteRequest(BaseModel):
     topic: str
     requirements: str | None = None # 提供默认值
+    limits: RunLimits | None = None
+    routing: RoutingRules | None = None
 
 class RevisionRequest(BaseModel):
     essay_content: str
+    limits: RunLimits | None = None
+    routing: RoutingRules | None = None
+
+class BatchRevisionRequest(BaseModel):
+    essays: list[RevisionRequest]
+    limits: RunLimits | None = None # 作文未单独设置时使用
+    routing: RoutingRules | None = None # 作文未单独设置时使用
+
+class JobRequest(BaseModel):
+    type: str # 'write_chinese' / 'write_english' / 'revise_chinese' / 'revise_english'
+    topic: str | None = None
+    requirements: str | None = None
+    essay_content: str | None = None
+    limits: RunLimits | None = None
+    routing: RoutingRules | None = None
 
 # --- 流式响应生成器 ---
 
+def _message_to_data(msg: Any) -> Dict[str, Any] | None:
+    """
+    将 Autogen 消息转换为 SSE 使用的字典，空消息返回 None。
+    """
+    # 尝试获取发送者名称，兼容不同 Autogen 版本或配置
+    sender_name = getattr(msg, 'source', 'Unknown')
+    if sender_name == 'Unknown' and hasattr(msg, 'metadata') and 'name' in msg.metadata:
+        sender_name = msg.metadata['name']
+
+    content = getattr(msg, 'content', '')
+    if not isinstance(content, str) and hasattr(msg, 'to_text'):
+        content = msg.to_text()  # 转换为文本，如果是复杂对象
+
+    role = getattr(msg, 'type', 'assistant')  # 默认为 assistant
+
+    # 过滤掉可能存在的空消息或不必要的消息
+    if not content:
+        return None
+
+    return {
+        "sender": sender_name,
+        "role": role,
+        "content": content,
+        # 可以添加时间戳或其他元数据（如果可用）
+    }
+
+
 async def run_autogen_chat_stream(
-    manager: Any, # Autogen SelectorGroupChat 实例
+    team_pool: Any, # TeamPool 实例，每次运行借出一个独立的 SelectorGroupChat
     initial_message: str,
-    request: Request # 用于检查客户端是否断开连接
+    request: Request, # 客户端请求 (断开连接由 EventSourceResponse 监听 http.disconnect 处理)
+    cache_key: str | None = None, # 结果缓存 / 请求合并的键，None 表示不缓存
+    span: trace.Span | None = None, # 端点创建的请求根 span，流结束时结束
+    delta: bool = False, # 增量模式：已通过 "片段" 流式发送的消息，"步骤" 事件不再重复完整内容
+    limits: RunLimits | None = None, # 本次运行的结束条件，None 表示使用默认值
+    routing: RoutingRules | None = None # 本次运行的分层路由规则，None 表示使用 LLM_TIER_MODE
 ) -> AsyncGenerator[str, None]:
     """
-    运行 Autogen 对话，并在完成后流式传输对话历史记录和最终结果。
-    使用异步方式调用 manager.run()，因为 SelectorGroupChat 的 run() 方法是异步的。
+    产出 chat_events 的事件，由 EventSourceResponse 封装为 SSE 的 data 行。
+    租户 / 班级标识取自请求头，用于准入控制的公平排队。
     """
-    queue = asyncio.Queue()
-    is_task_done = asyncio.Event()
+    tenant = request.headers.get(ADMISSION_TENANT_HEADER) or DEFAULT_TENANT
+    events = chat_events(team_pool, initial_message, tenant, cache_key=cache_key, span=span, limits=limits, routing=routing)
+    if delta:
+        events = delta_events(events)
+    async for item in events:
+        yield item
+
 
-    async def chat_task():
+async def chat_events(
+    team_pool: Any,
+    initial_message: str,
+    tenant: str = DEFAULT_TENANT, # 租户标识 (合并的请求使用发起运行的请求的租户)
+    cache_key: str | None = None,
+    span: trace.Span | None = None,
+    limits: RunLimits | None = None,
+    routing: RoutingRules | None = None
+) -> AsyncGenerator[str, None]:
+    """
+    运行 Autogen 对话，并实时产出每个代理的输出和最终结果 (JSON 字符串)。
+    使用 manager.run_stream()：代理开启 model_client_stream 时，模型的每个 token 片段
+    会以 "片段" 事件立即转发；每条完整消息前后分别发送 "代理开始" / "代理结束" 事件，
+    完整内容仍以 "步骤" 事件发送，保持原有事件约定 (已流式发送过的消息带 streamed 标记)。
+    最终结果取自团队最终代理 (见 teams.get_final_agent_names) 的消息，"任务完成" 事件的 final 字段
+    携带作文、标题、评分和修改要点 (结构化输出时)。
+    事件使用紧凑的 UTF-8 JSON 编码，中文不转义为 \\uXXXX。
+    团队实例从 team_pool 借出，运行结束后重置并归还，并发请求之间互不干扰。
+    传入 cache_key 时，成功的运行会缓存事件序列 (不含 "片段") 供后续相同请求回放；
+    并发的相同请求共享同一次运行 (single-flight)。
+    """
+    if span is None:
+        span = start_request_span("chat_events", **{"essay.team": team_pool.name})
+
+    # --- 结果缓存：相同请求直接回放已缓存的事件序列 ---
+    if cache_key is not None and result_cache.enabled:
+        cached_events = result_cache.get(cache_key)
+        if cached_events is not None:
+            logger.info(f"命中结果缓存，回放 {len(cached_events)} 个事件。")
+            span.set_attribute("essay.result_cache_hit", True)
+            try:
+                for item in cached_events:
+                    yield item
+            finally:
+                end_request_span(span)
+            return
+
+    async def chat_task(run: StreamBroadcast):
+        manager = None
+        # 运行被取消时 (最后一个订阅者断开、任务被取消) 通过令牌立即中止正在进行的模型请求
+        cancellation_token = run.cancellation_token
+        # 汇总本次运行中所有模型调用的 token 和费用 (团队内部创建的任务继承此上下文)
+        usage = start_request_usage()
+        # 本次运行中模型调用的层级 (本地 / 远程) 按请求的路由规则决定，同样由团队内部的任务继承
+        set_request_routing(routing)
         try:
-            await queue.put(json.dumps({"status": "任务开始", "message": initial_message}))
-            logger.info("Autogen 任务开始...")
-
-            # --- 直接异步调用 manager.run()，因为它是 coroutine ---
-            logger.info("开始执行 manager.run...")
-            # 使用 await 调用异步方法 run()
-            # 根据文档，run() 返回 TaskResult 对象，其中包含 messages 列表
-            task_result = await manager.run(task=initial_message)
-            logger.info("manager.run 执行完毕。")
-
-            chat_history = []
-            final_essay = None
-
-            # 从 TaskResult 中提取消息历史记录
-            if hasattr(task_result, 'messages') and isinstance(task_result.messages, list):
-                logger.info(f"从 TaskResult 中获取到 {len(task_result.messages)} 条聊天记录。")
-                processed_history = []
-                for i, msg in enumerate(task_result.messages):
-                    # 尝试获取发送者名称，兼容不同 Autogen 版本或配置
-                    sender_name = getattr(msg, 'source', 'Unknown')
-                    if sender_name == 'Unknown' and hasattr(msg, 'metadata') and 'name' in msg.metadata:
-                        sender_name = msg.metadata['name']
-
-                    content = getattr(msg, 'content', '')
-                    if not isinstance(content, str) and hasattr(content, 'to_text'):
-                        content = content.to_text()  # 转换为文本，如果是复杂对象
-
-                    role = getattr(msg, 'type', 'assistant')  # 默认为 assistant
-
-                    # 过滤掉可能存在的空消息或不必要的消息
-                    if not content:
-                        logger.debug(f"跳过第 {i} 条空消息。")
+            # 准入控制：超过全局并发上限时按租户公平排队，并向客户端报告排队位置
+            async def report_position(position: int):
+                await run.put(encode_event({"status": "排队中", "position": position}))
+
+            async with admission_controller.admit(tenant, on_position=report_position):
+                logger.info(f"从团队池借出实例: {team_pool.stats()}")
+                manager = await team_pool.acquire()
+                # 评分达标、token / 时间预算等条件满足时提前结束 (见 termination.py)
+                configure_run(manager, limits or resolve_run_limits())
+                # 写入结果缓存的事件：排队和 "片段" 事件不缓存 (回放时 "步骤" 已带完整内容)
+                replay_events: List[str] = []
+
+                async def publish(event: Dict[str, Any], replay: bool = True) -> None:
+                    encoded = encode_event(event)
+                    await run.put(encoded)
+                    if replay:
+                        replay_events.append(encoded)
+
+                await publish({"status": "任务开始", "message": initial_message})
+                logger.info("Autogen 任务开始...")
+
+                # --- 使用 manager.run_stream() 边运行边推送 ---
+                logger.info("开始执行 manager.run_stream...")
+                message_count = 0
+                final_agents = get_final_agent_names(team_pool.name)
+                final_message = None  # 最终代理的最新一条消息，运行结束时直接转换为结果
+                scorers = get_scorer_names(team_pool.name)
+                last_score = None  # 评分代理给出的最后一个分数，用于比较各分层模式的质量
+                stop_reason = None
+                active_agents = set()  # 已发送 "代理开始" 但尚未结束的代理 (DAG 团队中可能有多个并行)
+
+                async for item in manager.run_stream(task=initial_message, cancellation_token=cancellation_token):
+                    if isinstance(item, TaskResult):
+                        logger.info(f"manager.run_stream 执行完毕，停止原因: {item.stop_reason}")
+                        stop_reason = item.stop_reason
+                        continue
+
+                    if isinstance(item, ModelClientStreamingChunkEvent):
+                        if item.source not in active_agents:
+                            active_agents.add(item.source)
+                            await publish({"status": "代理开始", "agent": item.source})
+                        await publish({"status": "片段", "agent": item.source, "delta": item.content}, replay=False)
+                        continue
+
+                    msg_data = _message_to_data(item)
+                    if msg_data is None:
+                        logger.debug("跳过空消息。")
                         continue
 
-                    msg_data = {
-                        "sender": sender_name,
-                        "role": role,
-                        "content": content,
-                        # 可以添加时间戳或其他元数据（如果可用）
-                    }
-                    # 记录被处理的消息
-                    logger.debug(f"处理历史消息 {i}: Sender={sender_name}, Role={role}, Content Snippet='{str(content)[:50]}...'")
-                    processed_history.append(msg_data)
-                chat_history = processed_history
-            else:
-                logger.warning("无法在 TaskResult 中找到 'messages' 列表，无法获取聊天历史。")
-                # 备选方案：尝试直接从 manager 获取 messages，如果 API 允许
-                if hasattr(manager, 'messages') and isinstance(manager.messages, list):
-                    logger.info("尝试直接从 manager 获取 messages...")
-                    processed_history = []
-                    for i, msg in enumerate(manager.messages):
-                        sender_name = msg.get('name', 'Unknown')
-                        content = msg.get('content', '')
-                        role = msg.get('role', 'assistant')
-
-                        if not content:
-                            logger.debug(f"跳过第 {i} 条空消息。")
-                            continue
-
-                        msg_data = {
-                            "sender": sender_name,
-                            "role": role,
-                            "content": content,
-                        }
-                        logger.debug(f"处理历史消息 {i}: Sender={sender_name}, Role={role}, Content Snippet='{str(content)[:50]}...'")
-                        processed_history.append(msg_data)
-                    chat_history = processed_history
-                    logger.info(f"从 manager 中获取到 {len(chat_history)} 条聊天记录。")
+                    is_agent_message = isinstance(item, BaseChatMessage) and item.source != "user"
+                    streamed = is_agent_message and item.source in active_agents
+                    if is_agent_message and not streamed:
+                        # 未开启 token 流式的代理，在完整消息到达时补发开始事件
+                        await publish({"status": "代理开始", "agent": item.source})
+
+                    logger.debug(f"流式传输消息: Sender={msg_data['sender']}, Role={msg_data['role']}, Content Snippet='{str(msg_data['content'])[:50]}...'")
+                    message_count += 1
+                    if is_agent_message and item.source in final_agents:
+                        final_message = item
+                    if is_agent_message and item.source in scorers:
+                        score = parse_score(item.to_text())
+                        last_score = score if score is not None else last_score
+                    # 缓存的 "步骤" 不带 streamed 标记：回放时没有 "片段"，增量模式下也要保留完整内容
+                    replay_events.append(encode_event({"status": "步骤", "data": msg_data}))
+                    # 内容已通过 "片段" 事件发送，增量模式下客户端自行拼接；
+                    # 结构化消息的内容是渲染后的作文，与片段 (原始 JSON) 不同，始终携带完整内容
+                    if streamed and not isinstance(item, StructuredMessage):
+                        msg_data["streamed"] = True
+                    await publish({"status": "步骤", "data": msg_data}, replay=False)
+
+                    if is_agent_message:
+                        await publish({"status": "代理结束", "agent": item.source})
+                        active_agents.discard(item.source)
+
+                final_result = final_result_from_message(final_message) if final_message is not None else None
+                logger.info(f"聊天执行完成。共流式传输 {message_count} 条消息。")
+                observe_request_usage(team_pool.name, usage)
+                local_tier.record_run(team_pool.name, (routing or RoutingRules()).label, last_score)
+                logger.info(f"本次运行用量: {usage}")
+
+                # --- 发送最终完成信号和结果 ---
+                if final_result is None:
+                    # 不再回退到其他代理的消息 (如评分或 "TERMINATE")，避免把错误的文本当作结果
+                    final_label = "/".join(final_agents)
+                    logger.error(f"最终代理 {final_label} 没有产出有效的作文。")
+                    await run.put(encode_event({"status": "错误", "error": f"{final_label} 没有产出最终作文", "stop_reason": stop_reason}))
                 else:
-                    logger.warning("也无法直接从 manager 获取 messages。")
-
-            # 从历史记录中提取最终结果 (假设 Reviser 是最后输出者)
-            if chat_history:
-                reviser_name = "Reviser"  # 确认 Reviser 在 teams.py 中的名字
-                logger.info(f"尝试从历史记录中查找 '{reviser_name}' 的最终输出...")
-                found_reviser_output = False
-                for msg in reversed(chat_history):
-                    # 确保消息内容是字符串且不为空
-                    if msg["sender"] == reviser_name and isinstance(msg["content"], str) and msg["content"].strip():
-                        final_essay = msg["content"]
-                        logger.info(f"找到 Reviser 的最终输出 (前50字符): {final_essay[:50]}...")
-                        found_reviser_output = True
-                        break
-                if not found_reviser_output:
-                    logger.warning(f"未在历史记录中找到 '{reviser_name}' 的有效输出。尝试使用最后一条消息。")
-                    # 回退：使用最后一条非空字符串消息作为结果
-                    for msg in reversed(chat_history):
-                        if isinstance(msg["content"], str) and msg["content"].strip():
-                            final_essay = msg["content"]
-                            logger.info(f"使用最后一条有效消息作为最终输出 (Sender: {msg['sender']}, 前50字符): {final_essay[:50]}...")
-                            break
-                    if not final_essay:
-                        logger.error("聊天历史记录中没有找到任何有效的文本输出作为最终结果。")
-
-            logger.info(f"聊天执行完成。获取到 {len(chat_history)} 条历史记录。")
-
-            # --- 流式传输捕获的历史记录 ---
-            logger.info("开始流式传输聊天历史记录...")
-            for i, msg_data in enumerate(chat_history):
-                if await request.is_disconnected():
-                    logger.warning("客户端在流式传输历史记录时断开连接。")
-                    raise asyncio.CancelledError("Client disconnected during history streaming")
-                logger.debug(f"流式传输历史消息 {i}: {msg_data}")
-                await queue.put(json.dumps({"status": "步骤", "data": msg_data}))
-            logger.info("聊天历史记录流式传输完毕。")
-
-            # --- 发送最终完成信号和结果 ---
-            logger.info(f"发送任务完成信号。最终结果是否为空: {final_essay is None}")
-            await queue.put(json.dumps({"status": "任务完成", "result": final_essay}))
+                    logger.info(f"发送任务完成信号。最终作文来自 {final_result['agent']} (结构化: {final_result['structured']})")
+                    await publish({"status": "任务完成", "result": final_result["essay"], "final": final_result, "stop_reason": stop_reason})
+                    if cache_key is not None:
+                        result_cache.set(cache_key, replay_events)
 
         except asyncio.CancelledError:
             logger.warning("Chat task cancelled, likely due to client disconnect.")
-            await queue.put(json.dumps({"status": "错误", "error": "任务被取消 (客户端断开连接)"}))
+            cancellation_token.cancel()
+            trace.get_current_span().set_status(trace.Status(trace.StatusCode.ERROR, "cancelled"))
+            await run.put(encode_event({"status": "错误", "error": "任务被取消 (客户端断开连接)"}))
         except Exception as e:
             logger.error(f"Autogen 任务执行出错: {e}", exc_info=True)
-            await queue.put(json.dumps({"status": "错误", "error": str(e)}))
+            trace.get_current_span().record_exception(e)
+            trace.get_current_span().set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
+            await run.put(encode_event({"status": "错误", "error": str(e)}))
         finally:
-            # --- 关闭模型客户端 ---
-            logger.info("尝试关闭相关代理的模型客户端...")
-            try:
-                # 获取代理列表（兼容不同属性名）
-                agents_list = getattr(manager, 'agents', []) or getattr(manager, '_agents', []) or []
-                if not agents_list and hasattr(manager, 'groupchat') and hasattr(manager.groupchat, 'agents'):
-                    agents_list = manager.groupchat.agents  # 另一种可能的结构
-
-                closed_clients = set()  # 避免重复关闭同一个 client
-                for agent in agents_list:
-                    if hasattr(agent, 'llm_config') and isinstance(agent.llm_config, dict):
-                        model_client = agent.llm_config.get('model_client')
-                        # 检查 model_client 是否存在，是否可关闭，并且尚未关闭
-                        if model_client and hasattr(model_client, 'close') and model_client not in closed_clients:
-                            try:
-                                # 假设 close 是异步方法
-                                if asyncio.iscoroutinefunction(model_client.close):
-                                    await model_client.close()
-                                else:
-                                    # 如果是同步方法，在 executor 中运行以防阻塞
-                                    loop = asyncio.get_running_loop()
-                                    await loop.run_in_executor(None, model_client.close)
-
-                                logger.info(f"已关闭代理 {getattr(agent, 'name', 'Unknown')} 的模型客户端。")
-                                closed_clients.add(model_client)
-                            except Exception as close_agent_err:
-                                logger.error(f"关闭代理 {getattr(agent, 'name', 'Unknown')} 的模型客户端时出错: {close_agent_err}", exc_info=True)
-
-            except Exception as close_err:
-                logger.error(f"关闭模型客户端过程中发生错误: {close_err}", exc_info=True)
-            finally:
-                await queue.put(None)  # 发送 None 作为结束信号
-                is_task_done.set()
-                logger.info("chat_task 完成。")
-
-    # --- 启动后台聊天任务 ---
-    task = asyncio.create_task(chat_task())
-
-    # --- 从队列读取并发送 SSE 事件 ---
-    while True:
-        if await request.is_disconnected():
-            logger.warning("客户端断开连接，停止 SSE 生成器并取消任务...")
-            if not task.done():
-                task.cancel()
-            break
-
-        try:
-            item = await asyncio.wait_for(queue.get(), timeout=1.0)
+            # 模型客户端由 client_registry 在进程内共享，不在每次请求后关闭
+            if manager is not None:
+                # 重置并归还团队实例 (shield 保证取消时也能归还)
+                await asyncio.shield(team_pool.release(manager))
+            await run.put(None)  # 发送 None 作为结束信号
+            if cache_key is not None and in_flight_runs.get(cache_key) is run:
+                del in_flight_runs[cache_key]
+            logger.info("chat_task 完成。")
+
+    # --- 启动后台聊天任务 (single-flight：相同的请求挂到正在进行的运行上) ---
+    run = in_flight_runs.get(cache_key) if cache_key is not None else None
+    if run is not None:
+        logger.info("相同请求正在运行，加入已有的事件流。")
+        span.set_attribute("essay.joined_run", True)
+    else:
+        run = StreamBroadcast()
+        # 后台任务 (以及团队运行时创建的任务) 继承当前上下文，代理发言的 span 都挂在请求根 span 下
+        with trace.use_span(span, end_on_exit=False):
+            run.task = asyncio.create_task(chat_task(run))
+        if cache_key is not None:
+            in_flight_runs[cache_key] = run
+    task = run.task
+    queue = run.subscribe()
+
+    def cancel_if_last_subscriber():
+        # 只有最后一个订阅者离开时才取消运行，其他合并进来的请求继续接收
+        remaining = run.unsubscribe(queue)
+        if remaining == 0 and not task.done():
+            logger.warning("最后一个订阅者已断开，取消运行中的任务。")
+            run.cancel()
+        elif remaining:
+            logger.info(f"仍有 {remaining} 个订阅者，运行继续。")
+
+    # --- 从队列读取并产出事件 ---
+    # 不再轮询 request.is_disconnected()：EventSourceResponse 监听 ASGI http.disconnect 事件，
+    # 客户端断开时会立即取消本生成器 (在 queue.get() 处抛出 CancelledError)，空闲的流没有任何定时唤醒。
+    # 后台任务 (jobs.py) 被取消时同理。
+    finished = False
+    active_streams = ACTIVE_STREAMS.labels(team_pool.name)
+    active_streams.inc()
+    try:
+        while True:
+            item = await queue.get()
             if item is None:
                 logger.info("收到结束信号，停止 SSE 生成器。")
+                finished = True
                 break
-            yield f"data: {item}\n\n"
-            queue.task_done()
-        except asyncio.TimeoutError:
-            continue # 继续检查连接状态
-        except asyncio.CancelledError:
-            logger.info("SSE 生成器被取消。")
-            if not task.done(): # 确保后台任务也被取消
-                task.cancel()
-            break
-        except Exception as e:
-            logger.error(f"SSE 生成循环中发生错误: {e}", exc_info=True)
-            if not task.done():
-                task.cancel()
-            break # 出现意外错误时也停止
+            yield item
+    finally:
+        active_streams.dec()
+        if not finished:
+            logger.warning("客户端断开连接 (http.disconnect)，停止 SSE 生成器。")
+            cancel_if_last_subscriber()
+            span.add_event("client_disconnected")
+        else:
+            run.unsubscribe(queue)
+        end_request_span(span)
 
-    # --- 确保后台任务结束 ---
+    # 正常结束时 chat_task 已发送结束信号，只需等待它完成收尾
     try:
-        await asyncio.wait_for(is_task_done.wait(), timeout=10.0) # 等待任务完成信号
+        await asyncio.wait_for(asyncio.shield(task), timeout=10.0)
         logger.info("后台 chat_task 已确认完成。")
     except asyncio.TimeoutError:
         logger.warning("等待 chat_task 完成超时。")
     except Exception as gather_err:
          logger.error(f"等待 chat_task 完成时出错: {gather_err}", exc_info=True)
 
-    # 再次检查任务状态并记录
-    if task.done():
-        if task.cancelled():
-            logger.info("后台任务最终状态：已取消。")
-        elif task.exception():
-            logger.error(f"后台任务最终状态：异常结束 - {task.exception()}")
-        else:
-            logger.info("后台任务最终状态：正常完成。")
-    else:
-        logger.warning("后台任务在 SSE 生成器结束后仍未完成。")
-
 
 # --- API 端点 ---
 
-@app.post("/write/chinese", summary="中文范文写作 (流式)")
-async def api_run_chinese_writing_task(payload: WriteRequest, request: Request):
-    topic = payload.topic
-    requirements = payload.requirements or "800字左右的议论文" # 使用默认值
-    logger.info(f"收到中文写作请求: 主题='{topic}', 要求='{requirements}'")
-    message = f"请以“{topic}”为主题，写一篇{requirements}的中文范文。请严格按照 Planner -> Writer -> Scorer -> Reviser 的流程进行协作。最后由 Reviser 输出最终作文。"
-
-    return EventSourceResponse(
-        run_autogen_chat_stream(chinese_writing_team, message, request),
-        media_type="text/event-stream"
+@app.get("/cache/stats", summary="缓存命中统计")
+async def api_cache_stats():
+    completion_cache = get_completion_cache()
+    return {
+        "prompt_cache": prompt_cache_stats.stats(),  # 提供商前缀缓存命中的 token
+        "completion_cache": completion_cache.stats() if completion_cache else None,
+        "result_cache": result_cache.stats(),
+    }
+
+@app.get("/admission/stats", summary="准入控制与排队状态")
+async def api_admission_stats():
+    return {
+        "admission": admission_controller.stats(),
+        "team_pools": {name: pool.stats() for name, pool in team_pools.items()},
+        "jobs": job_manager.stats(),
+    }
+
+@app.get("/config", summary="当前生效的智能体 / 团队配置")
+async def api_config():
+    return agent_config.stats()
+
+@app.post("/config/reload", summary="重新加载智能体 / 团队配置")
+async def api_config_reload():
+    try:
+        changed = agent_config.reload(force=True)
+    except (AgentConfigError, OSError) as e:
+        # 配置无效时继续使用当前配置
+        raise HTTPException(status_code=400, detail=f"Invalid agent config: {e}")
+    return {"changed": changed, **agent_config.stats()}
+
+@app.get("/speculation/stats", summary="推测式起草的命中统计")
+async def api_speculation_stats():
+    return speculation_stats.stats()
+
+@app.get("/tiers/report", summary="分层执行 (本地 / 远程模型) 的延迟与质量报告")
+async def api_tiers_report():
+    return local_tier.stats()
+
+@app.get("/metrics", summary="Prometheus 监控指标")
+async def api_metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+# --- 任务定义 ---
+# 同步的 SSE 端点和异步任务 (/jobs) 共用同一套任务构造逻辑
+
+def prepare_run(
+    job_type: str,
+    topic: str | None = None,
+    requirements: str | None = None,
+    essay_content: str | None = None,
+    limits: RunLimits | Dict[str, Any] | None = None,
+    routing: RoutingRules | Dict[str, Any] | None = None,
+) -> Dict[str, Any]:
+    """
+    根据任务类型构造团队名称、初始消息、结束条件、结果缓存键和 trace 属性。
+    Args:
+        job_type: 'write_chinese' / 'write_english' / 'revise_chinese' / 'revise_english'
+        limits: 本次运行的结束条件 (异步任务从数据库恢复时为字典)，未设置的字段使用默认值
+        routing: 本次运行的分层路由规则 (同上)，None 表示使用 LLM_TIER_MODE
+    """
+    limits = resolve_run_limits(limits)
+    if isinstance(routing, dict):
+        routing = RoutingRules(**routing)
+    # 结束条件和使用的模型不同时结果可能不同 (如提前结束跳过了修改)，作为结果缓存键的一部分
+    options = encode_event({"limits": limits.model_dump(), "routing": routing.model_dump() if routing is not None else None})
+    if job_type == "write_chinese":
+        if topic is None:
+            raise HTTPException(status_code=400, detail="Topic is required.")
+        requirements = requirements or "800字左右的议论文" # 使用默认值
+        logger.info(f"收到中文写作请求: 主题='{topic}', 要求='{requirements}'")
+        message = f"请以“{topic}”为主题，写一篇{requirements}的中文范文。请严格按照 Planner -> Writer -> Scorer -> Reviser 的流程进行协作。最后由 Reviser 输出最终作文。"
+        return {
+            "team": "chinese_writing",
+            "message": message,
+            "cache_key": make_result_cache_key("/write/chinese", topic, requirements, options),
+            "attributes": {"essay.team": "chinese_writing", "essay.topic": topic},
+            "limits": limits,
+            "routing": routing,
+        }
+    if job_type == "write_english":
+        if topic is None:
+            raise HTTPException(status_code=400, detail="Topic is required.")
+        requirements = requirements or "around 500 words, argumentative essay"
+        logger.info(f"收到英文写作请求: Topic='{topic}', Requirements='{requirements}'")
+        message = f"Please write an English sample essay on the topic '{topic}'. Requirements: {requirements}. Strictly follow the flow: Planner -> Writer -> Scorer -> Reviser. The Reviser should output the final essay."
+        return {
+            "team": "english_writing",
+            "message": message,
+            "cache_key": make_result_cache_key("/write/english", topic, requirements, options),
+            "attributes": {"essay.team": "english_writing", "essay.topic": topic},
+            "limits": limits,
+            "routing": routing,
+        }
+    if job_type in ("revise_chinese", "revise_english"):
+        if not essay_content:
+            raise HTTPException(status_code=400, detail="Essay content cannot be empty.")
+        if job_type == "revise_chinese":
+            logger.info(f"收到中文修改请求 (前50字符): {essay_content[:50]}...")
+            message = f"请修改以下中文作文，请严格按照 Scorer -> Planner -> Reviser 的流程进行协作。最后由 Reviser 输出修改后的作文：\n\n{essay_content}\n\n"
+            team = "chinese_revision"
+        else:
+            logger.info(f"收到英文修改请求 (前50字符): {essay_content[:50]}...")
+            message = f"Please revise the following English essay. Strictly follow the flow: Scorer -> Planner -> Reviser. The Reviser should output the final revised essay:\n\n{essay_content}\n\n"
+            team = "english_revision"
+        return {
+            "team": team,
+            "message": message,
+            "cache_key": None,
+            "attributes": {"essay.team": team, "essay.essay_length": len(essay_content)},
+            "limits": limits,
+            "routing": routing,
+        }
+    raise HTTPException(status_code=400, detail=f"Unsupported job type: {job_type}")
+
+
+def _stream_response(run: Dict[str, Any], request: Request, span_name: str, delta: bool = False) -> EventSourceResponse:
+    # 客户端声明 Accept-Encoding 时按流压缩 (见 sse.py)
+    return event_source_response(
+        run_autogen_chat_stream(
+            team_pools[run["team"]], run["message"], request,
+            cache_key=run["cache_key"],
+            span=start_request_span(span_name, **run["attributes"]),
+            delta=delta,
+            limits=run["limits"],
+            routing=run["routing"]
+        ),
+        request
     )
 
+@app.post("/write/chinese", summary="中文范文写作 (流式)")
+async def api_run_chinese_writing_task(payload: WriteRequest, request: Request, delta: bool = False):
+    run = prepare_run("write_chinese", topic=payload.topic, requirements=payload.requirements, limits=payload.limits, routing=payload.routing)
+    return _stream_response(run, request, "POST /write/chinese", delta)
+
 @app.post("/write/english", summary="英文范文写作 (流式)")
-async def api_run_english_writing_task(payload: WriteRequest, request: Request):
-    topic = payload.topic
-    requirements = payload.requirements or "around 500 words, argumentative essay"
-    logger.info(f"收到英文写作请求: Topic='{topic}', Requirements='{requirements}'")
-    message = f"Please write an English sample essay on the topic '{topic}'. Requirements: {requirements}. Strictly follow the flow: Planner -> Writer -> Scorer -> Reviser. The Reviser should output the final essay."
-
-    return EventSourceResponse(
-        run_autogen_chat_stream(english_writing_team, message, request),
-        media_type="text/event-stream"
-    )
+async def api_run_english_writing_task(payload: WriteRequest, request: Request, delta: bool = False):
+    run = prepare_run("write_english", topic=payload.topic, requirements=payload.requirements, limits=payload.limits, routing=payload.routing)
+    return _stream_response(run, request, "POST /write/english", delta)
 
 @app.post("/revise/chinese", summary="中文作文修改 (流式)")
-async def api_run_chinese_revision_task(payload: RevisionRequest, request: Request):
-    essay_content = payload.essay_content
-    if not essay_content:
-        raise HTTPException(status_code=400, detail="Essay content cannot be empty.")
-    logger.info(f"收到中文修改请求 (前50字符): {essay_content[:50]}...")
-    message = f"请修改以下中文作文，请严格按照 Scorer -> Planner -> Reviser 的流程进行协作。最后由 Reviser 输出修改后的作文：\n\n{essay_content}\n\n"
-
-    return EventSourceResponse(
-        run_autogen_chat_stream(chinese_revision_team, message, request),
-        media_type="text/event-stream"
-    )
+async def api_run_chinese_revision_task(payload: RevisionRequest, request: Request, delta: bool = False):
+    run = prepare_run("revise_chinese", essay_content=payload.essay_content, limits=payload.limits, routing=payload.routing)
+    return _stream_response(run, request, "POST /revise/chinese", delta)
 
 @app.post("/revise/english", summary="英文作文修改 (流式)")
-async def api_run_english_revision_task(payload: RevisionRequest, request: Request):
-    essay_content = payload.essay_content
-    if not essay_content:
-        raise HTTPException(status_code=400, detail="Essay content cannot be empty.")
-    logger.info(f"收到英文修改请求 (前50字符): {essay_content[:50]}...")
-    message = f"Please revise the following English essay. Strictly follow the flow: Scorer -> Planner -> Reviser. The Reviser should output the final revised essay:\n\n{essay_content}\n\n"
-
-    return EventSourceResponse(
-        run_autogen_chat_stream(english_revision_team, message, request),
-        media_type="text/event-stream"
-    )
+async def api_run_english_revision_task(payload: RevisionRequest, request: Request, delta: bool = False):
+    run = prepare_run("revise_english", essay_content=payload.essay_content, limits=payload.limits, routing=payload.routing)
+    return _stream_response(run, request, "POST /revise/english", delta)
+
+# --- 批量修改 ---
+# 一次提交整个班级的作文，以有限并发调度到修改团队池，按作文 index 多路复用地返回事件。
+# 默认返回 SSE；Accept: application/x-ndjson 或 ?format=ndjson 时每行返回一个 JSON。
+
+def _batch_response(job_type: str, payload: BatchRevisionRequest, request: Request, format: str | None, include_steps: bool):
+    if not payload.essays:
+        raise HTTPException(status_code=400, detail="Essays cannot be empty.")
+    if len(payload.essays) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_ITEMS} essays per batch.")
+    contents = [essay.essay_content for essay in payload.essays]
+    # 内容相同的作文只运行一次，使用第一篇的结束条件
+    runs: Dict[str, Dict[str, Any]] = {}
+    for essay in payload.essays:
+        if essay.essay_content not in runs:
+            runs[essay.essay_content] = prepare_run(job_type, essay_content=essay.essay_content, limits=essay.limits or payload.limits, routing=essay.routing or payload.routing)
+    tenant = request.headers.get(ADMISSION_TENANT_HEADER) or DEFAULT_TENANT
+    logger.info(f"收到批量修改请求: {len(contents)} 篇作文 ({len(runs)} 篇不重复)")
+
+    def run_one(content: str):
+        run = runs[content]
+        span = start_request_span(f"batch {job_type}", **run["attributes"])
+        return chat_events(team_pools[run["team"]], run["message"], tenant, span=span, limits=run["limits"], routing=run["routing"])
+
+    events = run_batch(contents, run_one, include_steps=include_steps)
+    if format == "ndjson" or (format is None and "application/x-ndjson" in request.headers.get("accept", "")):
+        async def ndjson():
+            async for event in events:
+                yield encode_event(event) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    async def sse():
+        async for event in events:
+            yield encode_event(event)
+    return event_source_response(sse(), request)
+
+@app.post("/revise/chinese/batch", summary="中文作文批量修改 (流式)")
+async def api_run_chinese_revision_batch(payload: BatchRevisionRequest, request: Request, format: str | None = None, include_steps: bool = False):
+    return _batch_response("revise_chinese", payload, request, format, include_steps)
+
+@app.post("/revise/english/batch", summary="英文作文批量修改 (流式)")
+async def api_run_english_revision_batch(payload: BatchRevisionRequest, request: Request, format: str | None = None, include_steps: bool = False):
+    return _batch_response("revise_english", payload, request, format, include_steps)
+
+# --- 异步任务 API ---
+# POST /jobs 立即返回任务 id，任务由后台 worker 执行，事件持久化到 SQLite；
+# 客户端断开不会取消任务，可以通过 GET /jobs/{id} 查询结果，或带 Last-Event-ID 重连事件流。
+
+async def run_job(job_type: str, payload: Dict[str, Any], tenant: str) -> AsyncGenerator[str, None]:
+    run = prepare_run(job_type, **payload)
+    span = start_request_span(f"job {job_type}", **run["attributes"])
+    async for item in chat_events(team_pools[run["team"]], run["message"], tenant, cache_key=run["cache_key"], span=span, limits=run["limits"], routing=run["routing"]):
+        yield item
+
+job_manager = JobManager(JobStore(), run_job)
+
+@app.post("/jobs", summary="提交异步写作 / 修改任务", status_code=202)
+async def api_submit_job(payload: JobRequest, request: Request):
+    job_payload = payload.model_dump(exclude={"type"}, exclude_none=True)
+    prepare_run(payload.type, **job_payload)  # 提前校验参数
+    tenant = request.headers.get(ADMISSION_TENANT_HEADER) or DEFAULT_TENANT
+    job_id = job_manager.submit(payload.type, job_payload, tenant)
+    return {"job_id": job_id, "status": JOB_QUEUED, "events_url": f"/jobs/{job_id}/events"}
+
+@app.get("/jobs/{job_id}", summary="查询任务状态和结果")
+async def api_get_job(job_id: str):
+    job = job_manager.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+@app.get("/jobs/{job_id}/events", summary="任务事件流 (支持 Last-Event-ID 断点续传)")
+async def api_job_events(job_id: str, request: Request, last_event_id: int | None = None):
+    if job_manager.store.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    # 浏览器 EventSource 重连时自动携带 Last-Event-ID 请求头；不方便设置请求头的客户端可以使用查询参数
+    header = request.headers.get("Last-Event-ID")
+    if last_event_id is None:
+        last_event_id = int(header) if header and header.isdigit() else 0
+
+    async def event_stream():
+        async for seq, data in job_manager.follow(job_id, last_event_id):
+            yield {"id": str(seq), "data": data}
+
+    return event_source_response(event_stream(), request)
+
+@app.delete("/jobs/{job_id}", summary="取消任务")
+async def api_cancel_job(job_id: str):
+    if not job_manager.cancel(job_id):
+        raise HTTPException(status_code=404, detail="Job not found or already finished.")
+    return {"job_id": job_id, "cancelled": True}
 
 # --- 用于本地测试的启动命令 (在 service 目录下运行) ---
 # uvicorn app:app --reload --port 8001
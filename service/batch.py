@@ -0,0 +1,87 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, List, Sequence
+
+logger = logging.getLogger(__name__)
+
+# --- 批量修改配置 ---
+# BATCH_CONCURRENCY: 单个批量请求中同时运行的作文数 (还会受准入控制和团队池的限制)
+# BATCH_MAX_ITEMS: 单个批量请求最多包含的作文数
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "60"))
+
+# 默认只转发这些事件；代理的 token 片段和中间步骤对批量批改意义不大，且会让多路复用的流膨胀几十倍
+SUMMARY_STATUSES = ("排队中", "任务开始", "任务完成", "错误")
+
+# 单篇作文的执行函数：产出该作文运行过程中的事件 (JSON 字符串)
+ItemRunner = Callable[[str], AsyncIterator[str]]
+
+
+async def run_batch(
+    contents: Sequence[str],
+    runner: ItemRunner,
+    concurrency: int = BATCH_CONCURRENCY,
+    include_steps: bool = False,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    以有限并发运行一批作文，把各篇的事件合并为一个流，每个事件带上作文的 index。
+
+    内容完全相同的作文只运行一次，结果分发给所有对应的 index。
+    最后产出 "批量完成" 汇总事件。调用方停止迭代 (如客户端断开) 时取消所有未完成的运行。
+    """
+    started = time.perf_counter()
+    groups: Dict[str, List[int]] = {}
+    for index, content in enumerate(contents):
+        groups.setdefault(content, []).append(index)
+    yield {"status": "批量开始", "total": len(contents), "unique": len(groups)}
+
+    output: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def run_group(content: str, indices: List[int]) -> None:
+        group_started = None
+        final = {"status": "错误", "error": "运行没有返回结果"}
+        try:
+            async with semaphore:
+                group_started = time.perf_counter()
+                async for item in runner(content):
+                    event = json.loads(item)
+                    status = event.get("status")
+                    if status in ("任务完成", "错误"):
+                        final = event
+                        continue
+                    if include_steps or status in SUMMARY_STATUSES:
+                        for index in indices:
+                            await output.put({"index": index, **event})
+        except Exception as e:
+            logger.error(f"批量任务中的作文 {indices} 运行出错: {e}", exc_info=True)
+            final = {"status": "错误", "error": str(e)}
+        finally:
+            elapsed = time.perf_counter() - group_started if group_started is not None else 0.0
+            for index in indices:
+                await output.put({"index": index, **final, "elapsed": round(elapsed, 3)})
+
+    tasks = [asyncio.create_task(run_group(content, indices)) for content, indices in groups.items()]
+    succeeded = failed = 0
+    try:
+        # 每篇作文最后一定会产出一个 "任务完成" 或 "错误" 事件
+        while succeeded + failed < len(contents):
+            event = await output.get()
+            yield event
+            if event["status"] == "任务完成":
+                succeeded += 1
+            elif event["status"] == "错误":
+                failed += 1
+    finally:
+        for task in tasks:
+            task.cancel()
+    yield {
+        "status": "批量完成",
+        "total": len(contents),
+        "succeeded": succeeded,
+        "failed": failed,
+        "elapsed": round(time.perf_counter() - started, 3),
+    }
@@ -0,0 +1,273 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, Dict, List
+
+import httpx
+
+# 离线压测：启动模拟大模型服务 (mock_llm_server.py) 和本服务，把所有提供商的 base_url 指向模拟服务，
+# 以指定并发驱动四个流式端点，报告吞吐量、首字节时间、端到端延迟分位数和每个流的内存占用。
+# 用法 (在 service 目录下):
+#   python benchmark.py --requests 40 --concurrency 8 --mock-latency 0.3 --failure-rate 0.02 --json bench.json
+# 其他服务配置 (TEAM_MODE、ADMISSION_MAX_CONCURRENT 等) 通过环境变量传给被测服务。
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROVIDERS = ("OPENAI", "DEEPSEEK", "GROK", "GEMINI", "OLLAMA")
+
+_SAMPLE_CHINESE_ESSAY = "科技改变生活。清晨，智能闹钟把我从睡梦中唤醒；上学路上，导航软件为我规划最快的路线。科技让生活更便捷，但我们也要学会合理使用。"
+_SAMPLE_ENGLISH_ESSAY = "Technology changes our life. Every morning my smart alarm wakes me up, and on the way to school an app shows me the fastest route."
+
+# 端点 -> (路径, 第 i 个请求的请求体)；每个请求内容不同，避免命中结果缓存或被合并
+ENDPOINTS: Dict[str, tuple[str, Callable[[int], Dict[str, Any]]]] = {
+    "write_chinese": ("/write/chinese", lambda i: {"topic": f"科技与生活 ({i})", "requirements": "800字左右的议论文"}),
+    "write_english": ("/write/english", lambda i: {"topic": f"Technology and life ({i})"}),
+    "revise_chinese": ("/revise/chinese", lambda i: {"essay_content": f"{_SAMPLE_CHINESE_ESSAY} ({i})"}),
+    "revise_english": ("/revise/english", lambda i: {"essay_content": f"{_SAMPLE_ENGLISH_ESSAY} ({i})"}),
+}
+
+
+@dataclass
+class RequestResult:
+    ok: bool
+    error: str | None
+    ttfb: float | None         # 首字节时间 (第一个 SSE 事件)
+    first_token: float | None  # 首个模型 token (第一个 "片段" 或代理消息)
+    latency: float             # 端到端耗时
+    bytes: int                 # 传输的字节数
+    events: int
+
+
+def service_env(mock_url: str, jobs_db: str) -> Dict[str, str]:
+    """被测服务的环境变量：所有提供商指向模拟服务，关闭缓存以测量真实的运行开销。"""
+    env = dict(os.environ)
+    for provider in PROVIDERS:
+        env[f"{provider}_API_KEY"] = "mock"
+        env[f"{provider}_BASE_URL"] = mock_url
+    env.setdefault("RESULT_CACHE_TTL", "0")
+    env.setdefault("LLM_CACHE_BACKEND", "none")
+    env.setdefault("TRACING_EXPORTER", "none")
+    env.setdefault("JOBS_DB_PATH", jobs_db)
+    return env
+
+
+def read_rss(pid: int) -> int | None:
+    """读取进程的常驻内存 (字节)，不支持 /proc 的平台返回 None。"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def percentile(values: List[float], p: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+async def wait_until_ready(url: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"服务 {url} 在 {timeout} 秒内没有就绪")
+                await asyncio.sleep(0.2)
+
+
+async def run_request(client: httpx.AsyncClient, path: str, payload: Dict[str, Any]) -> RequestResult:
+    started = time.perf_counter()
+    ttfb = first_token = None
+    ok, error, size, events = False, None, 0, 0
+    buffer = b""
+    try:
+        async with client.stream("POST", path, json=payload) as response:
+            if response.status_code != 200:
+                return RequestResult(False, f"HTTP {response.status_code}", None, None, time.perf_counter() - started, 0, 0)
+            async for chunk in response.aiter_bytes():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - started
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    if not line.startswith(b"data:"):
+                        continue
+                    events += 1
+                    event = json.loads(line[5:])
+                    status = event.get("status")
+                    if first_token is None and status in ("片段", "步骤") and event.get("data", {}).get("sender") != "user":
+                        first_token = time.perf_counter() - started
+                    if status == "任务完成":
+                        ok = bool(event.get("result"))
+                        error = None if ok else "结果为空"
+                    elif status == "错误":
+                        error = event.get("error")
+            size = response.num_bytes_downloaded  # 实际传输的字节数 (服务端可能按流压缩)
+    except httpx.HTTPError as e:
+        error = f"{type(e).__name__}: {e}"
+    return RequestResult(ok, error, ttfb, first_token, time.perf_counter() - started, size, events)
+
+
+async def run_endpoint(base_url: str, name: str, requests: int, concurrency: int, service_pid: int) -> Dict[str, Any]:
+    path, make_payload = ENDPOINTS[name]
+    semaphore = asyncio.Semaphore(concurrency)
+    idle_rss = read_rss(service_pid)
+    peak_rss = idle_rss
+    sampling = True
+
+    async def sample_memory():
+        nonlocal peak_rss
+        while sampling:
+            rss = read_rss(service_pid)
+            if rss is not None:
+                peak_rss = max(peak_rss or 0, rss)
+            await asyncio.sleep(0.1)
+
+    async def one(i: int) -> RequestResult:
+        async with semaphore:
+            return await run_request(client, path, make_payload(i))
+
+    sampler = asyncio.create_task(sample_memory())
+    started = time.perf_counter()
+    async with httpx.AsyncClient(base_url=base_url, timeout=None, limits=httpx.Limits(max_connections=concurrency)) as client:
+        results = await asyncio.gather(*[one(i) for i in range(requests)])
+    elapsed = time.perf_counter() - started
+    sampling = False
+    await sampler
+
+    succeeded = [r for r in results if r.ok]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if not r.ok:
+            errors[str(r.error)[:80]] = errors.get(str(r.error)[:80], 0) + 1
+
+    def dist(values: List[float]) -> Dict[str, float | None]:
+        return {f"p{p}": percentile(values, p) for p in (50, 90, 95, 99)}
+
+    return {
+        "endpoint": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "succeeded": len(succeeded),
+        "failed": requests - len(succeeded),
+        "errors": errors,
+        "elapsed": elapsed,
+        "throughput": len(succeeded) / elapsed if elapsed else 0.0,
+        "ttfb": dist([r.ttfb for r in results if r.ttfb is not None]),
+        "first_token": dist([r.first_token for r in results if r.first_token is not None]),
+        "latency": dist([r.latency for r in succeeded]),
+        "avg_bytes": sum(r.bytes for r in results) / requests,
+        "avg_events": sum(r.events for r in results) / requests,
+        "idle_rss": idle_rss,
+        "peak_rss": peak_rss,
+        "rss_per_stream": (peak_rss - idle_rss) / concurrency if idle_rss is not None and peak_rss is not None else None,
+        "results": [asdict(r) for r in results],
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    def ms(value: float | None) -> str:
+        return f"{value * 1000:8.0f}" if value is not None else "     n/a"
+
+    def mb(value: float | None) -> str:
+        return f"{value / 1024 / 1024:.1f} MB" if value is not None else "n/a"
+
+    print(f"\n模拟服务: {json.dumps(report['mock'], ensure_ascii=False)}  LLM 调用总数: {report['llm_calls']}")
+    for r in report["endpoints"]:
+        print(f"\n== {r['endpoint']}: {r['succeeded']}/{r['requests']} 成功，并发 {r['concurrency']}，"
+              f"耗时 {r['elapsed']:.1f}s，吞吐 {r['throughput']:.2f} 篇/秒")
+        print(f"   {'(ms)':12}{'p50':>8}{'p90':>8}{'p95':>8}{'p99':>8}")
+        for label, key in (("首字节", "ttfb"), ("首 token", "first_token"), ("端到端", "latency")):
+            print(f"   {label:10}" + "".join(ms(r[key][f"p{p}"]) for p in (50, 90, 95, 99)))
+        print(f"   平均响应 {r['avg_bytes'] / 1024:.1f} KB / {r['avg_events']:.0f} 个事件；"
+              f"内存 空闲 {mb(r['idle_rss'])}，峰值 {mb(r['peak_rss'])}，每个流 {mb(r['rss_per_stream'])}")
+        for error, count in r["errors"].items():
+            print(f"   错误 x{count}: {error}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="使用模拟大模型服务对写作 / 修改端点进行离线压测")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help=f"逗号分隔，可选: {', '.join(ENDPOINTS)}")
+    parser.add_argument("--requests", type=int, default=20, help="每个端点的请求数")
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8801, help="被测服务端口")
+    parser.add_argument("--mock-port", type=int, default=9900)
+    parser.add_argument("--mock-latency", type=float, default=0.5, help="模拟首 token 延迟 (秒)")
+    parser.add_argument("--mock-tokens-per-second", type=float, default=50)
+    parser.add_argument("--mock-reply-tokens", type=int, default=200)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="模拟服务返回 500 的概率")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="模拟服务返回 429 的概率")
+    parser.add_argument("--json", help="把完整结果 (含每个请求) 写入 JSON 文件，便于比较回归")
+    parser.add_argument("--service-log", help="被测服务的日志文件，默认丢弃")
+    args = parser.parse_args()
+    names = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    unknown = [name for name in names if name not in ENDPOINTS]
+    if unknown:
+        parser.error(f"未知端点: {unknown}")
+
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    service_url = f"http://127.0.0.1:{args.port}"
+    mock = await asyncio.create_subprocess_exec(
+        sys.executable, "mock_llm_server.py", "--port", str(args.mock_port),
+        "--latency", str(args.mock_latency),
+        "--tokens-per-second", str(args.mock_tokens_per_second),
+        "--reply-tokens", str(args.mock_reply_tokens),
+        "--failure-rate", str(args.failure_rate),
+        "--rate-limit-rate", str(args.rate_limit_rate),
+        cwd=SERVICE_DIR,
+    )
+    log = open(args.service_log, "wb") if args.service_log else asyncio.subprocess.DEVNULL
+    with tempfile.TemporaryDirectory() as tmp:
+        service = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "uvicorn", "app:app", "--port", str(args.port), "--log-level", "warning",
+            cwd=SERVICE_DIR, env=service_env(f"{mock_url}/v1", os.path.join(tmp, "jobs.sqlite")),
+            stdout=log, stderr=asyncio.subprocess.STDOUT,
+        )
+        try:
+            await wait_until_ready(f"{mock_url}/stats")
+            await wait_until_ready(f"{service_url}/cache/stats")
+            results = []
+            for name in names:
+                results.append(await run_endpoint(service_url, name, args.requests, args.concurrency, service.pid))
+            async with httpx.AsyncClient() as client:
+                llm_calls = (await client.get(f"{mock_url}/stats")).json()["requests"]
+        finally:
+            for process in (service, mock):
+                if process.returncode is None:
+                    process.terminate()
+                    await process.wait()
+            if args.service_log:
+                log.close()
+
+    report = {
+        "mock": {
+            "latency": args.mock_latency,
+            "tokens_per_second": args.mock_tokens_per_second,
+            "reply_tokens": args.mock_reply_tokens,
+            "failure_rate": args.failure_rate,
+            "rate_limit_rate": args.rate_limit_rate,
+        },
+        "llm_calls": llm_calls,
+        "endpoints": results,
+    }
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
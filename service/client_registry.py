@@ -0,0 +1,115 @@
+import os
+import logging
+from typing import Any, Dict, Tuple
+
+import httpx
+from autogen_core.models import ChatCompletionClient
+from autogen_ext.models.openai import OpenAIChatCompletionClient
+
+from model_clients import StreamUsageClient
+from prompt_cache import UsageTrackingTransport
+from tracing import TracingTransport
+from rate_limit import RateLimitedChatCompletionClient, get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# --- HTTP 连接池配置 ---
+# 同一 (provider, base_url) 的所有模型客户端共用一个 keep-alive 连接池，避免每个代理重复 TLS 握手
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "120"))
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "600"))
+LLM_HTTP_CONNECT_TIMEOUT = float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT", "10"))
+
+
+class ClientRegistry:
+    """
+    模型客户端注册表。
+
+    - 每个 (provider, base_url) 只创建一个长生命周期的 httpx.AsyncClient (连接池)
+    - 每个 (provider, base_url, model) 只创建一个 OpenAIChatCompletionClient，供所有代理共享
+    客户端在整个进程生命周期内复用，只在服务关闭时统一释放。
+    """
+
+    def __init__(
+        self,
+        max_connections: int = LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections: int = LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = LLM_HTTP_KEEPALIVE_EXPIRY,
+        timeout: float = LLM_HTTP_TIMEOUT,
+        connect_timeout: float = LLM_HTTP_CONNECT_TIMEOUT,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self._http_clients: Dict[Tuple[str, str | None], httpx.AsyncClient] = {}
+        self._model_clients: Dict[Tuple[str, str | None, str], ChatCompletionClient] = {}
+
+    def get_http_client(self, provider: str, base_url: str | None) -> httpx.AsyncClient:
+        """获取 (provider, base_url) 对应的共享连接池，不存在时创建。"""
+        key = (provider, base_url)
+        http_client = self._http_clients.get(key)
+        if http_client is None or http_client.is_closed:
+            # 使用传输层包装记录 usage 中的缓存命中 token 和每次 HTTP 请求的 span (连接池限制需设置在传输层上)
+            transport = UsageTrackingTransport(httpx.AsyncHTTPTransport(limits=self.limits), provider)
+            transport = TracingTransport(transport, provider)
+            http_client = httpx.AsyncClient(transport=transport, timeout=self.timeout)
+            self._http_clients[key] = http_client
+            logger.info(f"为 {provider} ({base_url or '默认端点'}) 创建共享 HTTP 连接池。")
+        return http_client
+
+    def get_model_client(
+        self,
+        provider: str,
+        model: str,
+        base_url: str | None = None,
+        **client_kwargs: Any,
+    ) -> ChatCompletionClient:
+        """
+        获取共享的 OpenAIChatCompletionClient (流式调用时会请求返回 usage)。
+        Args:
+            provider: 模型提供商，用于区分连接池
+            model: 模型名称
+            base_url: API 基础 URL，None 表示使用默认 OpenAI 端点
+            client_kwargs: 传给 OpenAIChatCompletionClient 的其他参数 (api_key, model_info 等)
+        """
+        key = (provider, base_url, model)
+        model_client = self._model_clients.get(key)
+        if model_client is None:
+            model_client = StreamUsageClient(OpenAIChatCompletionClient(
+                model=model,
+                base_url=base_url,
+                http_client=self.get_http_client(provider, base_url),
+                **client_kwargs
+            ))
+            # 配置了 LLM_RATE_LIMITS 的提供商在发出请求前按令牌桶排队 (同一提供商的所有模型共享额度)
+            rate_limiter = get_rate_limiter(provider)
+            if rate_limiter is not None:
+                model_client = RateLimitedChatCompletionClient(model_client, rate_limiter)
+            self._model_clients[key] = model_client
+        return model_client
+
+    async def aclose(self) -> None:
+        """关闭所有连接池 (仅在服务关闭时调用)。"""
+        for (provider, base_url), http_client in self._http_clients.items():
+            try:
+                await http_client.aclose()
+            except Exception as e:
+                logger.error(f"关闭 {provider} ({base_url}) 的连接池时出错: {e}", exc_info=True)
+        self._http_clients.clear()
+        self._model_clients.clear()
+        logger.info("已关闭所有模型客户端连接池。")
+
+    def stats(self) -> Dict[str, Any]:
+        """返回注册表的当前状态。"""
+        return {
+            "http_clients": len(self._http_clients),
+            "model_clients": len(self._model_clients),
+        }
+
+
+# 进程内共享的注册表
+client_registry = ClientRegistry()
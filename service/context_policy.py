@@ -0,0 +1,134 @@
+import os
+import json
+import logging
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Sequence, Tuple
+
+from autogen_core.model_context import ChatCompletionContext
+from autogen_core.models import LLMMessage, UserMessage
+
+from metrics import record_context_trim
+
+logger = logging.getLogger(__name__)
+
+# --- 上下文策略配置 ---
+# CONTEXT_POLICY_ENABLED: 是否按代理的上下文策略裁剪历史消息，关闭后所有代理看到完整对话
+# CONTEXT_POLICIES: JSON，按智能体键覆盖 agent_config.toml 中声明的策略，例如
+#   {"polisher": {"sources": ["Writer", "Judge"], "latest_per_source": true, "max_tokens": 6000}}
+# CONTEXT_MAX_TOKENS: 未单独设置 max_tokens 的代理使用的默认上下文预算 (估算 token)，0 表示不限
+CONTEXT_POLICY_ENABLED = os.getenv("CONTEXT_POLICY_ENABLED", "true").lower() in ("1", "true", "yes")
+CONTEXT_POLICIES: Dict[str, Dict[str, Any]] = json.loads(os.getenv("CONTEXT_POLICIES", "{}"))
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "0"))
+
+_TRUNCATED_MARK = "…(已截断)"
+
+
+@dataclass(frozen=True)
+class ContextPolicy:
+    """
+    代理每次调用模型时能看到的历史消息。
+    任务消息 (对话的第一条) 和代理自己的发言始终可见，其余消息按以下规则筛选：
+    """
+    sources: Tuple[str, ...] | None = None  # 可见的发言者名称，None 表示全部可见
+    latest_per_source: bool = False         # 每个发言者只保留最新的一条 (如最新的草稿和评分)
+    keep_last: int | None = None            # 只保留最近 N 条，None 表示不限
+    summary_chars: int = 0                  # 被裁掉的消息压缩为每条前 N 个字符的摘要，0 表示直接丢弃
+    max_tokens: int | None = None           # 上下文的硬性预算 (估算 token)，超出时从最早的消息开始裁剪
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数 (与 rate_limit.py 一致，统一按 2 字符 / token 计)。"""
+    return len(text) // 2 + 1
+
+
+def _content(message: LLMMessage) -> str:
+    content = getattr(message, "content", "")
+    return content if isinstance(content, str) else str(content)
+
+
+def _count(messages: Sequence[LLMMessage]) -> int:
+    return sum(estimate_tokens(_content(message)) for message in messages)
+
+
+def _truncate(message: LLMMessage, tokens: int) -> LLMMessage:
+    # 截断标记本身也计入预算，截断后的消息估算不超过 tokens
+    content = _content(message)
+    keep = max((tokens - 1) * 2 - len(_TRUNCATED_MARK), 0)
+    return message.model_copy(update={"content": content[:keep] + _TRUNCATED_MARK})
+
+
+def apply_context_policy(messages: Sequence[LLMMessage], policy: ContextPolicy, agent: str) -> List[LLMMessage]:
+    """按策略返回裁剪后的消息列表，不修改传入的消息。"""
+    if not messages:
+        return []
+    task, history = messages[0], list(messages[1:])
+
+    def visible(message: LLMMessage) -> bool:
+        source = getattr(message, "source", None)
+        return policy.sources is None or source == agent or source in policy.sources
+
+    kept = [message for message in history if visible(message)]
+    if policy.latest_per_source:
+        latest: Dict[str, int] = {}
+        for index, message in enumerate(kept):
+            latest[getattr(message, "source", "")] = index
+        kept = [message for index, message in enumerate(kept) if index in latest.values()]
+    if policy.keep_last is not None:
+        kept = kept[-policy.keep_last:] if policy.keep_last > 0 else []
+
+    # 被裁掉的可见消息：按需压缩为一条摘要，放在保留的消息之前
+    summary: List[LLMMessage] = []
+    if policy.summary_chars > 0:
+        kept_ids = {id(message) for message in kept}
+        dropped = [message for message in history if visible(message) and id(message) not in kept_ids]
+        if dropped:
+            lines = [f"- {getattr(message, 'source', '')}: {_content(message)[:policy.summary_chars]}" for message in dropped]
+            summary = [UserMessage(content="【之前的讨论摘要】\n" + "\n".join(lines), source="context_summary")]
+
+    trimmed = [task, *summary, *kept]
+    budget = policy.max_tokens
+    if budget:
+        # 超出预算时先丢弃摘要和较早的消息，只剩任务和最新一条时再截断内容
+        while len(trimmed) > 2 and _count(trimmed) > budget:
+            del trimmed[1]
+        if _count(trimmed) > budget:
+            if len(trimmed) == 2:
+                trimmed[1] = _truncate(trimmed[1], budget - _count(trimmed[:1]))
+            if _count(trimmed) > budget:
+                trimmed[0] = _truncate(trimmed[0], budget - _count(trimmed[1:]))
+    return trimmed
+
+
+class PolicyChatCompletionContext(ChatCompletionContext):
+    """
+    按 ContextPolicy 裁剪历史的模型上下文。
+    完整消息仍然保存在上下文中，每次 get_messages 时裁剪，并把节省的 token 记入监控和本次请求的用量。
+    """
+
+    def __init__(self, policy: ContextPolicy, agent: str, initial_messages: List[LLMMessage] | None = None):
+        super().__init__(initial_messages)
+        self.policy = policy
+        self.agent = agent
+
+    async def get_messages(self) -> List[LLMMessage]:
+        trimmed = apply_context_policy(self._messages, self.policy, self.agent)
+        saved = _count(self._messages) - _count(trimmed)
+        if saved > 0:
+            logger.debug(f"代理 {self.agent} 的上下文裁剪了 {len(self._messages) - len(trimmed)} 条消息，约节省 {saved} token。")
+            record_context_trim(self.agent, saved)
+        return trimmed
+
+
+def get_context_policy(key: str, declared: ContextPolicy | None) -> ContextPolicy | None:
+    """返回智能体键对应的上下文策略 (环境变量覆盖 > agent_config.toml 声明 > 默认预算)，未启用时返回 None。"""
+    if not CONTEXT_POLICY_ENABLED:
+        return None
+    policy = declared
+    if key in CONTEXT_POLICIES:
+        override = dict(CONTEXT_POLICIES[key])
+        if override.get("sources") is not None:
+            override["sources"] = tuple(override["sources"])
+        policy = replace(policy or ContextPolicy(), **override)
+    if CONTEXT_MAX_TOKENS and (policy is None or policy.max_tokens is None):
+        policy = replace(policy or ContextPolicy(), max_tokens=CONTEXT_MAX_TOKENS)
+    return policy
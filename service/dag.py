@@ -0,0 +1,163 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Callable, Dict, List, Sequence, Tuple
+
+from autogen_agentchat.base import Response, TaskResult
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, TextMessage
+from autogen_core import CancellationToken
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class DagNode:
+    """DAG 中的一个节点：一个代理及其依赖的上游代理。"""
+    key: str                           # 代理在 agent_config.toml 中的键
+    depends_on: Tuple[str, ...] = ()   # 上游节点的键
+
+
+def _validate(nodes: Sequence[DagNode]) -> None:
+    """检查节点是否重复、依赖是否存在以及是否有环。"""
+    keys = [node.key for node in nodes]
+    if len(keys) != len(set(keys)):
+        raise ValueError(f"DAG 中存在重复的节点: {keys}")
+    deps = {node.key: node.depends_on for node in nodes}
+    for key, upstream in deps.items():
+        missing = [dep for dep in upstream if dep not in deps]
+        if missing:
+            raise ValueError(f"DAG 节点 {key} 依赖了不存在的节点: {missing}")
+
+    visiting, visited = set(), set()
+
+    def visit(key: str) -> None:
+        if key in visited:
+            return
+        if key in visiting:
+            raise ValueError(f"DAG 中存在环，涉及节点: {key}")
+        visiting.add(key)
+        for dep in deps[key]:
+            visit(dep)
+        visiting.remove(key)
+        visited.add(key)
+
+    for key in keys:
+        visit(key)
+
+
+class DagTeam:
+    """
+    按依赖关系并行执行代理的团队。
+
+    没有依赖关系的节点通过 asyncio 并发运行，每个节点收到原始任务以及所有上游节点的输出，
+    整体耗时取决于关键路径而不是所有代理耗时之和。
+    提供与 autogen 团队一致的 run_stream / reset 接口，可以直接放入 TeamPool，
+    事件 (token 片段、完整消息) 按到达顺序转发，最后产出 TaskResult。
+    """
+
+    def __init__(self, nodes: Sequence[DagNode], agent_factory: Callable[[str], Any]):
+        """
+        Args:
+            nodes: DAG 节点，顺序仅影响同时就绪节点的启动顺序
+            agent_factory: 根据键创建代理实例的函数 (通常是 agents.create_agent)
+        """
+        _validate(nodes)
+        self.nodes = list(nodes)
+        self._agents = {node.key: agent_factory(node.key) for node in self.nodes}
+
+    @property
+    def agents(self) -> List[Any]:
+        return list(self._agents.values())
+
+    @staticmethod
+    def _build_prompt(task: str, upstream: List[Tuple[str, str]]) -> str:
+        """把原始任务和上游节点的输出合并为节点的输入。"""
+        parts = [task]
+        for agent_name, content in upstream:
+            parts.append(f"【{agent_name} 的输出】\n{content}")
+        return "\n\n".join(parts)
+
+    async def _run_node(
+        self,
+        node: DagNode,
+        prompt: str,
+        queue: asyncio.Queue,
+        cancellation_token: CancellationToken,
+    ) -> BaseChatMessage:
+        agent = self._agents[node.key]
+        logger.info(f"DAG 节点 {node.key} ({agent.name}) 开始运行。")
+        response: Response | None = None
+        async for item in agent.on_messages_stream([TextMessage(content=prompt, source="user")], cancellation_token):
+            if isinstance(item, Response):
+                response = item
+            elif isinstance(item, BaseAgentEvent):
+                await queue.put(item)
+        if response is None:
+            raise RuntimeError(f"DAG 节点 {node.key} 没有返回结果。")
+        await queue.put(response.chat_message)
+        logger.info(f"DAG 节点 {node.key} ({agent.name}) 运行完成。")
+        return response.chat_message
+
+    async def _execute(self, task: str, queue: asyncio.Queue, cancellation_token: CancellationToken) -> None:
+        outputs: Dict[str, BaseChatMessage] = {}
+        pending = {node.key: node for node in self.nodes}
+        running: Dict[asyncio.Task, str] = {}
+        try:
+            while pending or running:
+                # 启动所有依赖已满足的节点
+                for key, node in list(pending.items()):
+                    if all(dep in outputs for dep in node.depends_on):
+                        upstream = [(outputs[dep].source, outputs[dep].to_text()) for dep in node.depends_on]
+                        prompt = self._build_prompt(task, upstream)
+                        running[asyncio.create_task(self._run_node(node, prompt, queue, cancellation_token))] = key
+                        del pending[key]
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    key = running.pop(finished)
+                    outputs[key] = finished.result()  # 节点异常会在这里抛出并终止整个 DAG
+        finally:
+            for unfinished in running:
+                unfinished.cancel()
+            # 等待被取消的节点真正结束 (释放模型请求等资源)，团队归还团队池前不留下仍在运行的节点
+            await asyncio.gather(*running, return_exceptions=True)
+            await queue.put(None)
+
+    async def run_stream(
+        self,
+        *,
+        task: str,
+        cancellation_token: CancellationToken | None = None,
+    ) -> AsyncGenerator[BaseAgentEvent | BaseChatMessage | TaskResult, None]:
+        task_message = TextMessage(content=task, source="user")
+        yield task_message
+
+        queue: asyncio.Queue = asyncio.Queue()
+        cancellation_token = cancellation_token or CancellationToken()
+        runner = asyncio.create_task(self._execute(task, queue, cancellation_token))
+        messages: List[BaseAgentEvent | BaseChatMessage] = [task_message]
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                if isinstance(item, BaseChatMessage):
+                    messages.append(item)
+                yield item
+            await runner  # 传播节点异常
+        finally:
+            if not runner.done():
+                cancellation_token.cancel()
+                runner.cancel()
+                await asyncio.gather(runner, return_exceptions=True)
+        yield TaskResult(messages=messages, stop_reason="DAG 所有节点运行完成")
+
+    async def run(self, *, task: str, cancellation_token: CancellationToken | None = None) -> TaskResult:
+        result = None
+        async for item in self.run_stream(task=task, cancellation_token=cancellation_token):
+            if isinstance(item, TaskResult):
+                result = item
+        return result
+
+    async def reset(self) -> None:
+        for agent in self._agents.values():
+            await agent.on_reset(CancellationToken())
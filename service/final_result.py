@@ -0,0 +1,44 @@
+import os
+import logging
+from typing import Any, Dict, List
+
+from autogen_agentchat.messages import BaseChatMessage, StructuredMessage
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger(__name__)
+
+# --- 最终结果配置 ---
+# FINAL_RESULT_STRUCTURED: 负责输出最终作文的代理 (agent_config.toml 中 final_result = true) 是否使用结构化输出，
+# 模型不支持结构化输出或关闭时，从该代理的文本回复中提取作文
+FINAL_RESULT_STRUCTURED = os.getenv("FINAL_RESULT_STRUCTURED", "true").lower() in ("1", "true", "yes")
+
+# 结构化消息的文本形式只保留作文正文：团队中的其他代理、终止条件和 "步骤" 事件看到的都是作文本身
+FINAL_ESSAY_FORMAT = "{essay}"
+
+# 文本回复中最终作文的标记 (Polisher 等代理的输出格式约定)
+_FINAL_ESSAY_MARK = "=== 最终作文 ==="
+
+
+class FinalEssay(BaseModel):
+    """最终作文的结构化输出。"""
+    title: str = Field(description="作文标题 / The title of the essay")
+    essay: str = Field(description="最终作文全文，不含修改说明 / The full final essay without any comments")
+    score: str = Field(description="对最终作文的总体评价，如 一类文 或 8/10 / Overall grade of the final essay")
+    changes: List[str] = Field(description="主要修改要点 / Main changes made to the draft")
+
+
+def final_result_from_message(message: BaseChatMessage) -> Dict[str, Any] | None:
+    """
+    把最终代理的消息转换为 "任务完成" 事件中的结果字典。
+    结构化消息直接取字段；普通文本消息取 "=== 最终作文 ===" 之后的内容并去掉 TERMINATE。
+    没有有效内容时返回 None。
+    """
+    if isinstance(message, StructuredMessage) and isinstance(message.content, FinalEssay):
+        return {**message.content.model_dump(), "agent": message.source, "structured": True}
+    text = message.to_text()
+    if _FINAL_ESSAY_MARK in text:
+        text = text.rsplit(_FINAL_ESSAY_MARK, 1)[1]
+    text = text.replace("TERMINATE", "").strip()
+    if not text:
+        return None
+    return {"title": None, "essay": text, "score": None, "changes": [], "agent": message.source, "structured": False}
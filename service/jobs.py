@@ -0,0 +1,286 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import logging
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# --- 异步任务配置 ---
+# JOBS_DB_PATH: 任务及其事件的 SQLite 数据库；JOBS_WORKERS: 后台并发执行的任务数
+# JOBS_TTL: 已结束任务的保留时间 (秒)，启动时清理过期任务
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".jobs.sqlite"))
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "4"))
+JOBS_TTL = float(os.getenv("JOBS_TTL", str(7 * 24 * 3600)))
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+class JobStore:
+    """基于 SQLite 的任务与事件存储，进程重启后仍可查询结果和回放事件。"""
+
+    def __init__(self, path: str = JOBS_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " type TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " tenant TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " result TEXT,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_events ("
+            " job_id TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " data TEXT NOT NULL,"
+            " PRIMARY KEY (job_id, seq))"
+        )
+
+    def create(self, job_type: str, payload: Dict[str, Any], tenant: str) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, type, payload, tenant, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, job_type, json.dumps(payload, ensure_ascii=False), tenant, JOB_QUEUED, now, now),
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Dict[str, Any] | None:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            events = self._conn.execute("SELECT COUNT(*) FROM job_events WHERE job_id = ?", (job_id,)).fetchone()[0]
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["events"] = events
+        return job
+
+    def update(self, job_id: str, status: str, result: str | None = None, error: str | None = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = COALESCE(?, result), error = COALESCE(?, error), updated_at = ? WHERE id = ?",
+                (status, result, error, time.time(), job_id),
+            )
+
+    def append_event(self, job_id: str, seq: int, data: str) -> None:
+        """写入一个事件，序号 (从 1 开始，作为 SSE 的事件 id) 由 JobManager 在内存中分配。"""
+        with self._lock:
+            self._conn.execute("INSERT INTO job_events (job_id, seq, data) VALUES (?, ?, ?)", (job_id, seq, data))
+
+    def events_after(self, job_id: str, seq: int) -> List[Tuple[int, str]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq", (job_id, seq)
+            ).fetchall()
+        return [(row["seq"], row["data"]) for row in rows]
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, status FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (JOB_QUEUED, JOB_RUNNING)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def purge(self, ttl: float = JOBS_TTL) -> int:
+        """删除超过保留时间的已结束任务及其事件。"""
+        cutoff = time.time() - ttl
+        with self._lock:
+            ids = [row[0] for row in self._conn.execute(
+                f"SELECT id FROM jobs WHERE updated_at < ? AND status IN ({','.join('?' * len(FINISHED_STATUSES))})",
+                (cutoff, *FINISHED_STATUSES),
+            ).fetchall()]
+            for job_id in ids:
+                self._conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+                self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        return len(ids)
+
+
+# 执行任务的函数：根据任务类型、参数和租户产生事件 (JSON 字符串) 的异步迭代器
+JobRunner = Callable[[str, Dict[str, Any], str], AsyncIterator[str]]
+
+
+class JobManager:
+    """
+    后台任务管理器。
+
+    提交的任务写入 JobStore 后进入队列，由固定数量的 worker 执行；
+    运行中任务的全部事件保存在内存中并通知正在跟随的客户端，除 "片段" 外的事件在后台线程中持久化
+    ("步骤" 事件带有完整内容，回放不需要 "片段")。
+    任务不依附于任何 HTTP 连接，客户端断开后任务继续运行，重连时可以从 Last-Event-ID 继续。
+    """
+
+    def __init__(self, store: JobStore, runner: JobRunner, workers: int = JOBS_WORKERS):
+        self.store = store
+        self.runner = runner
+        self.workers = workers
+        self._queue: asyncio.Queue | None = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._live: Dict[str, List[str]] = {}  # 运行中任务的全部事件，第 n 个事件的序号为 n
+        self._updates: Dict[str, asyncio.Condition] = {}  # 有新事件或状态变化时通知跟随者
+        self._stopping = False
+
+    def start(self) -> None:
+        """启动 worker；上次进程中断的任务：排队中的重新入队，运行中的标记为失败。"""
+        self._queue = asyncio.Queue()
+        purged = self.store.purge()
+        if purged:
+            logger.info(f"清理了 {purged} 个过期任务。")
+        for job in self.store.unfinished():
+            if job["status"] == JOB_QUEUED:
+                self._queue.put_nowait(job["id"])
+            else:
+                self.store.update(job["id"], JOB_FAILED, error="服务重启，任务中断")
+        self._worker_tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"任务管理器已启动 {self.workers} 个 worker。")
+
+    async def stop(self) -> None:
+        # 运行中的任务 (worker 以 shield 等待) 也要取消，其事件流随之取消团队运行并中止模型调用
+        self._stopping = True
+        tasks = [*self._running.values(), *self._worker_tasks]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._stopping = False
+
+    def submit(self, job_type: str, payload: Dict[str, Any], tenant: str) -> str:
+        job_id = self.store.create(job_type, payload, tenant)
+        self._queue.put_nowait(job_id)
+        logger.info(f"任务 {job_id} ({job_type}) 已提交，队列长度 {self._queue.qsize()}。")
+        return job_id
+
+    def cancel(self, job_id: str) -> bool:
+        """取消排队中或运行中的任务，任务不存在或已结束时返回 False。"""
+        job = self.store.get(job_id)
+        if job is None or job["status"] in FINISHED_STATUSES:
+            return False
+        task = self._running.get(job_id)
+        if task is not None:
+            # 任务的事件流 (runner) 随之退出，最后一个订阅者离开时先触发运行的取消令牌再取消团队运行
+            # (见 result_cache.StreamBroadcast.cancel)，进行中的模型调用立即中止
+            task.cancel()
+        else:
+            # 排队中的任务在 worker 取出时会被跳过
+            self.store.update(job_id, JOB_CANCELLED)
+            self._notify(job_id)
+        return True
+
+    def _condition(self, job_id: str) -> asyncio.Condition:
+        if job_id not in self._updates:
+            self._updates[job_id] = asyncio.Condition()
+        return self._updates[job_id]
+
+    def _notify(self, job_id: str) -> None:
+        condition = self._updates.get(job_id)
+        if condition is not None:
+            async def notify():
+                async with condition:
+                    condition.notify_all()
+            asyncio.create_task(notify())
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job_id = await self._queue.get()
+            job = self.store.get(job_id)
+            if job is None or job["status"] != JOB_QUEUED:
+                continue
+            task = asyncio.create_task(self._run(job))
+            self._running[job_id] = task
+            try:
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.done():
+                    raise  # worker 本身被取消 (服务关闭)
+            finally:
+                self._running.pop(job_id, None)
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        job_id = job["id"]
+        await asyncio.to_thread(self.store.update, job_id, JOB_RUNNING)
+        status, result, error = JOB_FAILED, None, "任务没有返回结果"
+        live = self._live[job_id] = []
+        try:
+            async for event in self.runner(job["type"], job["payload"], job["tenant"]):
+                live.append(event)
+                self._notify(job_id)
+                data = json.loads(event)
+                # "片段" 事件只发给正在跟随的客户端，不写入数据库
+                if data.get("status") == "片段":
+                    continue
+                # SQLite 写入放到线程中，不阻塞事件循环；序号按内存中的事件数分配
+                await asyncio.to_thread(self.store.append_event, job_id, len(live), event)
+                if data.get("status") == "任务完成":
+                    status, result, error = JOB_SUCCEEDED, data.get("result"), None
+                elif data.get("status") == "错误":
+                    status, error = JOB_FAILED, data.get("error")
+        except asyncio.CancelledError:
+            if self._stopping:
+                status, error = JOB_FAILED, "服务关闭，任务中断"
+            else:
+                status, error = JOB_CANCELLED, "任务被取消"
+        except Exception as e:
+            logger.error(f"任务 {job_id} 执行出错: {e}", exc_info=True)
+            status, error = JOB_FAILED, str(e)
+        finally:
+            # 先写入最终状态再移除内存中的事件，跟随者此后从数据库读取
+            await asyncio.to_thread(self.store.update, job_id, status, result, error)
+            self._live.pop(job_id, None)
+            self._notify(job_id)
+            self._updates.pop(job_id, None)
+            logger.info(f"任务 {job_id} 结束，状态: {status}")
+
+    async def follow(self, job_id: str, last_event_id: int = 0) -> AsyncIterator[Tuple[int, str]]:
+        """
+        按顺序产出 last_event_id 之后的事件 (序号, JSON)；任务未结束时等待新事件，结束后停止。
+        运行中的任务从内存读取 (包括 "片段")，其他任务从数据库读取 (序号在 "片段" 处不连续)。
+        """
+        condition = self._condition(job_id)
+        seq = last_event_id
+        while True:
+            async with condition:
+                live = self._live.get(job_id)
+                if live is not None:
+                    events = [(index, data) for index, data in enumerate(live[seq:], start=seq + 1)]
+                    finished = False
+                else:
+                    # 先读状态再读事件：事件在最终状态之前写入，读到结束状态后读取的事件一定完整
+                    job = await asyncio.to_thread(self.store.get, job_id)
+                    finished = job is None or job["status"] in FINISHED_STATUSES
+                    events = await asyncio.to_thread(self.store.events_after, job_id, seq)
+                if not events:
+                    if finished:
+                        self._updates.pop(job_id, None)
+                        return
+                    await condition.wait()
+                    continue
+            for seq, data in events:
+                yield seq, data
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": len(self._running),
+        }
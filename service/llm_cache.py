@@ -0,0 +1,224 @@
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from autogen_core import CacheStore
+from autogen_core.models import ChatCompletionClient
+from autogen_ext.models.cache import ChatCompletionCache, CHAT_CACHE_VALUE_TYPE
+
+logger = logging.getLogger(__name__)
+
+# --- 补全缓存配置 ---
+# LLM_CACHE_BACKEND: 'memory' (进程内 LRU), 'sqlite' (磁盘，多进程共享) 或 'none' (关闭)
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory").lower()
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".llm_cache.sqlite"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))  # 秒，0 表示永不过期
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2000"))
+
+
+class CountingCacheStore(CacheStore[CHAT_CACHE_VALUE_TYPE], ABC):
+    """带命中/未命中计数、TTL 和容量上限的缓存基类，子类实现 _get / _set / size。"""
+
+    def __init__(self, ttl: float = LLM_CACHE_TTL, max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expires_at(self) -> float:
+        return time.time() + self.ttl if self.ttl > 0 else 0.0
+
+    def get(self, key: str, default: Optional[CHAT_CACHE_VALUE_TYPE] = None) -> Optional[CHAT_CACHE_VALUE_TYPE]:
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: CHAT_CACHE_VALUE_TYPE) -> None:
+        self._set(key, value)
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[CHAT_CACHE_VALUE_TYPE]:
+        ...
+
+    @abstractmethod
+    def _set(self, key: str, value: CHAT_CACHE_VALUE_TYPE) -> None:
+        ...
+
+    @abstractmethod
+    def size(self) -> int:
+        ...
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存命中统计。"""
+        total = self.hits + self.misses
+        return {
+            "backend": type(self).__name__,
+            "entries": self.size(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class LRUCacheStore(CountingCacheStore):
+    """进程内 LRU 缓存，按最近使用顺序淘汰。"""
+
+    def __init__(self, ttl: float = LLM_CACHE_TTL, max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        super().__init__(ttl, max_entries)
+        self._data: "OrderedDict[str, Tuple[float, CHAT_CACHE_VALUE_TYPE]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> Optional[CHAT_CACHE_VALUE_TYPE]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at and expires_at < time.time():
+                del self._data[key]
+                self.evictions += 1
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value: CHAT_CACHE_VALUE_TYPE) -> None:
+        with self._lock:
+            self._data[key] = (self._expires_at(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def size(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCacheStore(CountingCacheStore):
+    """基于 SQLite 的磁盘缓存，可在多个 uvicorn worker 之间共享，重启后仍然有效。"""
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: float = LLM_CACHE_TTL, max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        super().__init__(ttl, max_entries)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            " key TEXT PRIMARY KEY,"
+            " value BLOB NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_completions_accessed ON completions(accessed_at)")
+
+    def _get(self, key: str) -> Optional[CHAT_CACHE_VALUE_TYPE]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at and expires_at < now:
+                self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self.evictions += 1
+                return None
+            self._conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+        try:
+            return pickle.loads(value)
+        except Exception as e:
+            logger.warning(f"缓存条目反序列化失败，忽略该条目: {e}")
+            return None
+
+    def _set(self, key: str, value: CHAT_CACHE_VALUE_TYPE) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, pickle.dumps(value), self._expires_at(), now),
+            )
+            # 清理过期条目，并按最近访问时间淘汰超出容量的条目
+            cursor = self._conn.execute("DELETE FROM completions WHERE expires_at > 0 AND expires_at < ?", (now,))
+            self.evictions += max(cursor.rowcount, 0)
+            cursor = self._conn.execute(
+                "DELETE FROM completions WHERE key IN ("
+                " SELECT key FROM completions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self.evictions += max(cursor.rowcount, 0)
+
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+
+class NamespacedCacheStore(CacheStore[CHAT_CACHE_VALUE_TYPE]):
+    """
+    为共享的缓存后端加上命名空间前缀。
+    ChatCompletionCache 的缓存键只包含消息和调用参数，不包含模型名称，
+    因此需要用 (provider, model, cache_seed) 区分不同的模型客户端。
+    """
+
+    def __init__(self, store: CacheStore[CHAT_CACHE_VALUE_TYPE], namespace: str):
+        self.store = store
+        self.namespace = namespace
+
+    def _key(self, key: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\x00{key}".encode()).hexdigest()
+
+    def get(self, key: str, default: Optional[CHAT_CACHE_VALUE_TYPE] = None) -> Optional[CHAT_CACHE_VALUE_TYPE]:
+        return self.store.get(self._key(key), default)
+
+    def set(self, key: str, value: CHAT_CACHE_VALUE_TYPE) -> None:
+        self.store.set(self._key(key), value)
+
+
+def _create_completion_cache() -> CountingCacheStore | None:
+    if LLM_CACHE_BACKEND == "none":
+        return None
+    if LLM_CACHE_BACKEND == "sqlite":
+        logger.info(f"使用 SQLite 补全缓存: {LLM_CACHE_PATH}")
+        return SQLiteCacheStore(LLM_CACHE_PATH)
+    if LLM_CACHE_BACKEND != "memory":
+        raise ValueError(f"不支持的缓存后端: {LLM_CACHE_BACKEND}")
+    return LRUCacheStore()
+
+
+# 进程内共享的缓存后端，首次使用时创建
+_completion_cache: CountingCacheStore | None = None
+
+
+def get_completion_cache() -> CountingCacheStore | None:
+    """返回共享的缓存后端，缓存关闭时返回 None。"""
+    global _completion_cache
+    if _completion_cache is None and LLM_CACHE_BACKEND != "none":
+        _completion_cache = _create_completion_cache()
+    return _completion_cache
+
+
+def wrap_with_cache(
+    model_client: ChatCompletionClient,
+    provider: str,
+    model: str,
+    cache_seed: int | None,
+) -> ChatCompletionClient:
+    """
+    用补全缓存包装模型客户端。cache_seed 为 None 或缓存关闭时原样返回。
+    相同的 (system_message, 对话历史, 调用参数, 模型, cache_seed) 会直接命中缓存。
+    """
+    completion_cache = get_completion_cache() if cache_seed is not None else None
+    if completion_cache is None:
+        return model_client
+    namespace = f"{provider}:{model}:{cache_seed}"
+    return ChatCompletionCache(model_client, NamespacedCacheStore(completion_cache, namespace))
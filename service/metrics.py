@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import logging
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, Dict, Mapping, Optional, Sequence, Union
+
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage
+from autogen_core.tools import Tool, ToolSchema
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from pydantic import BaseModel
+
+from model_clients import DelegatingChatCompletionClient
+from prompt_cache import prompt_cache_stats
+
+logger = logging.getLogger(__name__)
+
+# --- 价格配置 ---
+# LLM_PRICING: JSON，按模型名配置每百万 token 的美元价格，例如
+#   {"deepseek-chat": {"prompt": 0.27, "completion": 1.10}, "grok-3": {"prompt": 3, "completion": 15}}
+# 未配置价格的模型不计算费用
+def _load_pricing() -> Dict[str, Dict[str, float]]:
+    raw = os.getenv("LLM_PRICING", "")
+    if not raw:
+        return {}
+    try:
+        return {model: {k: float(v) for k, v in price.items()} for model, price in json.loads(raw).items()}
+    except (ValueError, AttributeError) as e:
+        logger.error(f"LLM_PRICING 配置无法解析，忽略费用统计: {e}")
+        return {}
+
+LLM_PRICING = _load_pricing()
+
+# 选择器模型客户端在指标中使用的代理名
+SELECTOR_AGENT = "Selector"
+
+# --- 指标定义 ---
+_LLM_LABELS = ("agent", "provider", "model")
+# 大模型首 token 通常在数百毫秒到十几秒之间，完整回复可能长达数分钟
+_TTFT_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+_LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 40, 60, 120, 240, 600)
+
+LLM_REQUESTS = Counter("essay_llm_requests_total", "模型调用次数 (status: ok / cached / error)", _LLM_LABELS + ("status",))
+LLM_TTFT = Histogram("essay_llm_time_to_first_token_seconds", "流式调用的首 token 延迟", _LLM_LABELS, buckets=_TTFT_BUCKETS)
+LLM_LATENCY = Histogram("essay_llm_latency_seconds", "模型调用的总耗时 (不含补全缓存命中)", _LLM_LABELS, buckets=_LATENCY_BUCKETS)
+LLM_PROMPT_TOKENS = Counter("essay_llm_prompt_tokens_total", "prompt token 数", _LLM_LABELS)
+LLM_COMPLETION_TOKENS = Counter("essay_llm_completion_tokens_total", "completion token 数", _LLM_LABELS)
+LLM_CACHED_TOKENS = Counter("essay_llm_cached_prompt_tokens_total", "命中提供商前缀缓存的 prompt token 数", ("provider", "model"))
+LLM_COST = Counter("essay_llm_cost_usd_total", "按 LLM_PRICING 估算的费用 (美元)", _LLM_LABELS)
+SELECTOR_CALLS = Counter("essay_selector_calls_total", "SelectorGroupChat 选择发言者的模型调用次数", ("provider", "model"))
+ACTIVE_STREAMS = Gauge("essay_active_streams", "正在推送的 SSE 流数量", ("team",))
+TEAM_POOL_WAITING = Gauge("essay_team_pool_waiting", "等待团队实例的请求数 (队列深度)", ("team",))
+TEAM_POOL_IN_USE = Gauge("essay_team_pool_in_use", "已借出的团队实例数", ("team",))
+LLM_FAILOVERS = Counter("essay_llm_failovers_total", "首选提供商失败后由后备提供商完成的调用次数", ("primary", "fallback"))
+LLM_HEDGED_REQUESTS = Counter("essay_llm_hedged_requests_total", "发出的对冲请求次数", ("provider",))
+CIRCUIT_BREAKER_OPEN = Gauge("essay_circuit_breaker_open", "提供商是否处于熔断状态 (1 为熔断)", ("provider",))
+RATE_LIMIT_WAIT = Histogram(
+    "essay_rate_limit_wait_seconds", "请求在提供商令牌桶中的排队时间", ("provider",),
+    buckets=(0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60),
+)
+ADMISSION_RUNNING = Gauge("essay_admission_running", "已获得准入名额正在运行的任务数")
+ADMISSION_QUEUED = Gauge("essay_admission_queued", "等待准入名额的请求数")
+REQUEST_COST = Histogram(
+    "essay_request_cost_usd", "单次请求所有模型调用的估算费用 (美元)", ("team",),
+    buckets=(0.001, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1),
+)
+REQUEST_TOKENS = Histogram(
+    "essay_request_tokens", "单次请求所有模型调用的 token 总数", ("team",),
+    buckets=(1000, 2500, 5000, 10000, 20000, 40000, 80000, 160000),
+)
+CONTEXT_TOKENS_SAVED = Counter("essay_context_tokens_saved_total", "上下文策略裁剪掉的 prompt token (估算)", ("agent",))
+REQUEST_CONTEXT_TOKENS_SAVED = Histogram(
+    "essay_request_context_tokens_saved", "单次请求中上下文策略节省的 prompt token (估算)", ("team",),
+    buckets=(0, 500, 1000, 2500, 5000, 10000, 20000, 40000),
+)
+RUN_TERMINATIONS = Counter("essay_run_terminations_total", "按请求条件提前结束的运行次数", ("team", "reason"))
+LLM_TIER_LATENCY = Histogram(
+    "essay_llm_tier_latency_seconds", "按执行层级统计的模型调用耗时 (本地层含排队和回退到远程的时间)", ("tier",),
+    buckets=_LATENCY_BUCKETS,
+)
+LOCAL_TIER_QUEUE_WAIT = Histogram(
+    "essay_local_tier_queue_wait_seconds", "本地模型调用等待并行槽位的时间", buckets=(0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60),
+)
+SPECULATION_OUTCOMES = Counter(
+    "essay_speculation_outcomes_total", "推测式起草的结果 (keep / patch / regenerate / failed / unused)", ("team", "outcome"),
+)
+SPECULATION_DRAFT_WAIT = Histogram(
+    "essay_speculation_draft_wait_seconds", "轮到写作代理时等待推测草稿完成的时间 (0 表示草稿已就绪)",
+    buckets=(0, 0.5, 1, 2, 5, 10, 20, 40, 60),
+)
+REQUEST_SCORE = Histogram(
+    "essay_request_score", "单次运行中评分代理给出的最后一个分数 (0-10)，按分层路由模式区分", ("team", "routing"),
+    buckets=(3, 5, 6, 7, 8, 9, 10),
+)
+
+# 提供商前缀缓存命中的 token 由传输层解析，这里订阅后转成计数器
+prompt_cache_stats.add_listener(
+    lambda provider, model, prompt_tokens, cached_tokens: LLM_CACHED_TOKENS.labels(provider, model).inc(cached_tokens)
+)
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """按 LLM_PRICING 估算一次调用的费用，未配置价格时返回 0。"""
+    price = LLM_PRICING.get(model)
+    if not price:
+        return 0.0
+    return (prompt_tokens * price.get("prompt", 0.0) + completion_tokens * price.get("completion", 0.0)) / 1_000_000
+
+
+# --- 单次请求的用量汇总 ---
+# 在 chat_task 中开始汇总，团队运行时创建的任务会继承上下文，其中的模型调用都会累加到同一个字典
+_request_usage: ContextVar[Dict[str, float] | None] = ContextVar("request_usage", default=None)
+
+
+def start_request_usage() -> Dict[str, float]:
+    """为当前上下文开始一次请求级的用量汇总，返回累加用的字典。"""
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0, "context_tokens_saved": 0}
+    _request_usage.set(usage)
+    return usage
+
+
+def current_request_usage() -> Dict[str, float] | None:
+    """返回当前上下文中正在汇总的请求用量，不在请求中时返回 None。"""
+    return _request_usage.get()
+
+
+def observe_request_usage(team: str, usage: Dict[str, float]) -> None:
+    """记录一次请求的 token 总数和费用。"""
+    REQUEST_TOKENS.labels(team).observe(usage["prompt_tokens"] + usage["completion_tokens"])
+    if LLM_PRICING:
+        REQUEST_COST.labels(team).observe(usage["cost_usd"])
+    REQUEST_CONTEXT_TOKENS_SAVED.labels(team).observe(usage["context_tokens_saved"])
+
+
+def record_context_trim(agent: str, saved_tokens: int) -> None:
+    """记录上下文策略为一次模型调用节省的 prompt token。"""
+    CONTEXT_TOKENS_SAVED.labels(agent).inc(saved_tokens)
+    usage = _request_usage.get()
+    if usage is not None:
+        usage["context_tokens_saved"] += saved_tokens
+
+
+def record_run_termination(team: str, reason: str) -> None:
+    """记录一次按请求条件 (评分达标、token / 时间预算等) 提前结束的运行。"""
+    RUN_TERMINATIONS.labels(team, reason).inc()
+
+
+class InstrumentedChatCompletionClient(DelegatingChatCompletionClient):
+    """
+    记录每次模型调用的首 token 延迟、总耗时、token 用量和费用，按 (agent, provider, model) 区分。
+    包在补全缓存之外：缓存命中只计入 status="cached"，不影响延迟和 token 统计。
+    """
+
+    def __init__(self, inner: ChatCompletionClient, agent: str, provider: str, model: str):
+        super().__init__(inner)
+        self.labels = (agent, provider, model)
+        self.model = model
+
+    def _record_result(self, result: CreateResult, started: float, first_token_at: float | None = None) -> None:
+        if result.cached:
+            LLM_REQUESTS.labels(*self.labels, "cached").inc()
+            return
+        LLM_REQUESTS.labels(*self.labels, "ok").inc()
+        if first_token_at is not None:
+            LLM_TTFT.labels(*self.labels).observe(first_token_at - started)
+        LLM_LATENCY.labels(*self.labels).observe(time.perf_counter() - started)
+        prompt_tokens = result.usage.prompt_tokens
+        completion_tokens = result.usage.completion_tokens
+        cost = estimate_cost(self.model, prompt_tokens, completion_tokens)
+        LLM_PROMPT_TOKENS.labels(*self.labels).inc(prompt_tokens)
+        LLM_COMPLETION_TOKENS.labels(*self.labels).inc(completion_tokens)
+        if cost:
+            LLM_COST.labels(*self.labels).inc(cost)
+        usage = _request_usage.get()
+        if usage is not None:
+            usage["prompt_tokens"] += prompt_tokens
+            usage["completion_tokens"] += completion_tokens
+            usage["cost_usd"] += cost
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        started = time.perf_counter()
+        try:
+            result = await super().create(
+                messages,
+                tools=tools,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token,
+            )
+        except Exception:
+            LLM_REQUESTS.labels(*self.labels, "error").inc()
+            raise
+        self._record_result(result, started)
+        return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        started = time.perf_counter()
+        first_token_at = None  # 结果可能来自补全缓存，等拿到 CreateResult 后再记录首 token 延迟
+        try:
+            async for item in super().create_stream(
+                messages,
+                tools=tools,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token,
+            ):
+                if isinstance(item, CreateResult):
+                    self._record_result(item, started, first_token_at)
+                elif first_token_at is None:
+                    first_token_at = time.perf_counter()
+                yield item
+        except Exception:
+            LLM_REQUESTS.labels(*self.labels, "error").inc()
+            raise
+
+
+class InstrumentedSelectorClient(InstrumentedChatCompletionClient):
+    """选择器模型客户端：除通用指标外，额外统计选择发言者的调用次数。"""
+
+    def __init__(self, inner: ChatCompletionClient, provider: str, model: str):
+        super().__init__(inner, SELECTOR_AGENT, provider, model)
+
+    def _record_result(self, result: CreateResult, started: float, first_token_at: float | None = None) -> None:
+        SELECTOR_CALLS.labels(*self.labels[1:]).inc()
+        super()._record_result(result, started, first_token_at)
+
+
+def register_team_pool(pool: Any) -> None:
+    """导出团队池的排队深度和借出数量 (抓取时读取 TeamPool.stats)。"""
+    TEAM_POOL_WAITING.labels(pool.name).set_function(lambda: pool.stats()["waiting"])
+    TEAM_POOL_IN_USE.labels(pool.name).set_function(lambda: pool.stats()["in_use"])
+
+
+def register_admission_controller(controller: Any) -> None:
+    """导出准入控制的运行数和排队数。"""
+    ADMISSION_RUNNING.set_function(lambda: controller.running)
+    ADMISSION_QUEUED.set_function(lambda: controller.queued)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """返回 Prometheus 文本格式的指标及其 Content-Type。"""
+    return generate_latest(), CONTENT_TYPE_LATEST
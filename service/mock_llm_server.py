@@ -0,0 +1,168 @@
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 模拟回复的素材，按 "token" 切分后循环使用 (中文每 2 个字符、英文每个单词算一个 token)
+_CHINESE_TEXT = "科技的进步让我们的生活发生了翻天覆地的变化，从清晨的闹钟到夜晚的灯光，处处都有它的身影。我们应当善用科技，而不是被科技所奴役。"
+_ENGLISH_TEXT = "Technology has changed the way we live, learn and communicate. We should use it wisely and never let it control our lives. "
+_CJK = re.compile(r"[一-鿿]")
+
+
+@dataclass
+class MockLLMConfig:
+    """模拟服务的行为：延迟、输出速度和故障注入。"""
+    latency: float = 0.5           # 首 token 前的延迟 (秒)
+    jitter: float = 0.2            # 首 token 延迟的随机抖动比例
+    tokens_per_second: float = 50  # 输出速度
+    reply_tokens: int = 200        # 每次回复的 token 数
+    failure_rate: float = 0.0      # 返回 500 的概率
+    rate_limit_rate: float = 0.0   # 返回 429 的概率
+    terminate: bool = True         # 回复末尾附加 "TERMINATE"，让选择器团队按终止条件结束
+
+
+def _tokens(text: str, count: int) -> List[str]:
+    if _CJK.search(text):
+        pieces = [_CHINESE_TEXT[i:i + 2] for i in range(0, len(_CHINESE_TEXT), 2)]
+    else:
+        pieces = [word + " " for word in _ENGLISH_TEXT.split()]
+    return [pieces[i % len(pieces)] for i in range(count)]
+
+
+def _prompt_text(body: Dict[str, Any]) -> str:
+    parts = []
+    for message in body.get("messages", []):
+        content = message.get("content") or ""
+        parts.append(content if isinstance(content, str) else json.dumps(content, ensure_ascii=False))
+    return "\n".join(parts)
+
+
+def _sample_from_schema(schema: Dict[str, Any], text: str, defs: Dict[str, Any] | None = None) -> Any:
+    """按 JSON Schema 生成示例值，用于响应结构化输出 (response_format=json_schema) 的请求。"""
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return _sample_from_schema(defs[schema["$ref"].rsplit("/", 1)[-1]], text, defs)
+    if "anyOf" in schema:
+        return _sample_from_schema(schema["anyOf"][0], text, defs)
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: _sample_from_schema(prop, text, defs) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [_sample_from_schema(schema.get("items", {}), text[:20], defs)]
+    if kind in ("integer", "number"):
+        return 0
+    if kind == "boolean":
+        return False
+    return text
+
+
+def create_app(config: MockLLMConfig) -> FastAPI:
+    """创建 OpenAI 兼容的模拟服务 (POST /v1/chat/completions，支持流式和非流式)。"""
+    app = FastAPI(title="Mock OpenAI-compatible LLM")
+    app.state.requests = 0
+
+    def chunk(completion_id: str, model: str, **fields: Any) -> str:
+        data = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model, **fields}
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": []}
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        app.state.requests += 1
+        body = await request.json()
+        model = body.get("model", "mock")
+        roll = random.random()
+        if roll < config.failure_rate:
+            return JSONResponse({"error": {"message": "injected failure", "type": "server_error"}}, status_code=500)
+        if roll < config.failure_rate + config.rate_limit_rate:
+            return JSONResponse(
+                {"error": {"message": "injected rate limit", "type": "rate_limit_error"}},
+                status_code=429, headers={"retry-after": "1"},
+            )
+
+        prompt = _prompt_text(body)
+        tokens = _tokens(prompt, config.reply_tokens)
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            # 结构化输出：按 schema 生成 JSON，再按约 4 个字符一个 token 流式返回
+            content = json.dumps(_sample_from_schema(response_format["json_schema"]["schema"], "".join(tokens)), ensure_ascii=False)
+            tokens = [content[i:i + 4] for i in range(0, len(content), 4)]
+        elif response_format.get("type") == "json_object":
+            content = json.dumps({"content": "".join(tokens)}, ensure_ascii=False)
+            tokens = [content[i:i + 4] for i in range(0, len(content), 4)]
+        elif config.terminate:
+            tokens.append("\nTERMINATE")
+        usage = {"prompt_tokens": len(prompt) // 2 + 1, "completion_tokens": len(tokens), "total_tokens": len(prompt) // 2 + 1 + len(tokens)}
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        await asyncio.sleep(config.latency * (1 + random.uniform(-config.jitter, config.jitter)))
+
+        if not body.get("stream"):
+            await asyncio.sleep(len(tokens) / config.tokens_per_second)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        async def stream() -> AsyncIterator[str]:
+            yield chunk(completion_id, model, choices=[{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+            for token in tokens:
+                await asyncio.sleep(1 / config.tokens_per_second)
+                yield chunk(completion_id, model, choices=[{"index": 0, "delta": {"content": token}, "finish_reason": None}])
+            yield chunk(completion_id, model, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield chunk(completion_id, model, choices=[], usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的模拟大模型服务，用于离线压测")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9900)
+    parser.add_argument("--latency", type=float, default=MockLLMConfig.latency, help="首 token 延迟 (秒)")
+    parser.add_argument("--jitter", type=float, default=MockLLMConfig.jitter, help="延迟抖动比例")
+    parser.add_argument("--tokens-per-second", type=float, default=MockLLMConfig.tokens_per_second)
+    parser.add_argument("--reply-tokens", type=int, default=MockLLMConfig.reply_tokens)
+    parser.add_argument("--failure-rate", type=float, default=MockLLMConfig.failure_rate, help="返回 500 的概率")
+    parser.add_argument("--rate-limit-rate", type=float, default=MockLLMConfig.rate_limit_rate, help="返回 429 的概率")
+    parser.add_argument("--no-terminate", action="store_true", help="回复末尾不附加 TERMINATE")
+    args = parser.parse_args()
+
+    config = MockLLMConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        tokens_per_second=args.tokens_per_second,
+        reply_tokens=args.reply_tokens,
+        failure_rate=args.failure_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        terminate=not args.no_terminate,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+# 单独运行 (在 service 目录下): python mock_llm_server.py --port 9900 --latency 0.5 --failure-rate 0.05
+if __name__ == "__main__":
+    main()
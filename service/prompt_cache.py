@@ -0,0 +1,154 @@
+import json
+import zlib
+import hashlib
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# --- 提供商提示缓存 (Prompt / Context Caching) ---
+# DeepSeek 的上下文缓存、OpenAI / Grok 的提示缓存以及 Gemini 2.5 的隐式缓存都是按请求前缀自动命中的：
+# 只要 system_message 和之前的对话逐字节不变，重复的前缀就只按缓存价格计费并跳过预填充。
+# 这里负责两件事：
+#   1. 记录每个代理 system_message 的指纹，发现前缀在进程内发生变化时告警
+#   2. 从响应的 usage 中解析缓存命中的 token 数并汇总
+
+
+def _extract_cached_tokens(usage: Dict[str, Any]) -> int:
+    """从不同提供商的 usage 字段中解析缓存命中的 prompt token 数。"""
+    # DeepSeek: prompt_cache_hit_tokens / prompt_cache_miss_tokens
+    if "prompt_cache_hit_tokens" in usage:
+        return int(usage.get("prompt_cache_hit_tokens") or 0)
+    # OpenAI / Grok / Gemini (OpenAI 兼容端点): prompt_tokens_details.cached_tokens
+    details = usage.get("prompt_tokens_details") or {}
+    if isinstance(details, dict) and details.get("cached_tokens") is not None:
+        return int(details.get("cached_tokens") or 0)
+    # Gemini 原生字段名
+    return int(usage.get("cached_content_token_count") or usage.get("cachedContentTokenCount") or 0)
+
+
+class PromptCacheStats:
+    """按 (provider, model) 汇总 prompt token 与缓存命中 token。"""
+
+    def __init__(self):
+        self._stats: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._prefix_fingerprints: Dict[str, str] = {}
+        self._listeners: list[Callable[[str, str, int, int], None]] = []
+
+    def add_listener(self, listener: Callable[[str, str, int, int], None]) -> None:
+        """注册回调 (provider, model, prompt_tokens, cached_tokens)，供监控模块订阅。"""
+        self._listeners.append(listener)
+
+    def record(self, provider: str, model: str, usage: Dict[str, Any]) -> None:
+        prompt_tokens = int(usage.get("prompt_tokens") or 0)
+        cached_tokens = _extract_cached_tokens(usage)
+        entry = self._stats.setdefault((provider, model), {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0})
+        entry["requests"] += 1
+        entry["prompt_tokens"] += prompt_tokens
+        entry["cached_tokens"] += cached_tokens
+        logger.debug(f"{provider}/{model} prompt_tokens={prompt_tokens}, cached_tokens={cached_tokens}")
+        for listener in self._listeners:
+            listener(provider, model, prompt_tokens, cached_tokens)
+
+    def register_prefix(self, agent_key: str, system_message: str) -> str:
+        """记录代理 system_message 的指纹；同一代理的前缀发生变化会导致缓存失效，记录告警。"""
+        fingerprint = hashlib.sha256(system_message.encode("utf-8")).hexdigest()[:16]
+        previous = self._prefix_fingerprints.get(agent_key)
+        if previous is not None and previous != fingerprint:
+            logger.warning(f"代理 {agent_key} 的 system_message 发生变化 ({previous} -> {fingerprint})，提供商前缀缓存将失效。")
+        self._prefix_fingerprints[agent_key] = fingerprint
+        return fingerprint
+
+    def stats(self) -> Dict[str, Any]:
+        """返回各模型的缓存命中情况。"""
+        models = {}
+        for (provider, model), entry in self._stats.items():
+            prompt_tokens = entry["prompt_tokens"]
+            models[f"{provider}/{model}"] = {
+                **entry,
+                "cached_ratio": entry["cached_tokens"] / prompt_tokens if prompt_tokens else 0.0,
+            }
+        return {"models": models, "prefix_fingerprints": dict(self._prefix_fingerprints)}
+
+
+prompt_cache_stats = PromptCacheStats()
+
+
+class _UsageSniffingStream(httpx.AsyncByteStream):
+    """原样转发响应字节，同时从 JSON 响应或 SSE 分片中解析 usage。"""
+
+    # 非流式响应最多缓冲的字节数，超过后不再解析
+    MAX_BUFFER = 4 * 1024 * 1024
+
+    def __init__(self, inner: httpx.AsyncByteStream, is_event_stream: bool, content_encoding: str, on_usage: Callable[[Dict[str, Any]], None]):
+        self._inner = inner
+        self._is_event_stream = is_event_stream
+        self._content_encoding = content_encoding
+        self._on_usage = on_usage
+        self._buffer = b""
+
+    def _handle_payload(self, payload: bytes) -> None:
+        if b'"usage"' not in payload:
+            return
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return
+        usage = data.get("usage") if isinstance(data, dict) else None
+        if usage:
+            self._on_usage(usage)
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._inner:
+            if self._is_event_stream:
+                self._buffer += chunk
+                *lines, self._buffer = self._buffer.split(b"\n")
+                for line in lines:
+                    if line.startswith(b"data:"):
+                        self._handle_payload(line[5:].strip())
+            elif len(self._buffer) < self.MAX_BUFFER:
+                self._buffer += chunk
+            yield chunk
+        if not self._is_event_stream:
+            payload = self._buffer
+            if self._content_encoding in ("gzip", "deflate"):
+                try:
+                    payload = zlib.decompress(payload, wbits=47)  # 自动识别 gzip / zlib 头
+                except zlib.error:
+                    payload = b""
+            self._handle_payload(payload)
+        self._buffer = b""
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+
+class UsageTrackingTransport(httpx.AsyncBaseTransport):
+    """包装 httpx 传输层，把每个 chat completions 响应中的 usage 记录到 prompt_cache_stats。"""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, provider: str, stats: PromptCacheStats = prompt_cache_stats):
+        self._inner = inner
+        self._provider = provider
+        self._stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self._inner.handle_async_request(request)
+        if not request.url.path.endswith("/chat/completions"):
+            return response
+        try:
+            model = json.loads(request.content or b"{}").get("model", "unknown")
+        except ValueError:
+            model = "unknown"
+        is_event_stream = "text/event-stream" in response.headers.get("content-type", "")
+        response.stream = _UsageSniffingStream(
+            response.stream,
+            is_event_stream,
+            response.headers.get("content-encoding", "").lower(),
+            lambda usage: self._stats.record(self._provider, model, usage),
+        )
+        return response
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Any, AsyncGenerator, Dict, Mapping, Optional, Sequence, Union
+
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage
+from autogen_core.tools import Tool, ToolSchema
+from pydantic import BaseModel
+
+from model_clients import DelegatingChatCompletionClient
+from metrics import RATE_LIMIT_WAIT
+
+logger = logging.getLogger(__name__)
+
+# --- 提供商限流配置 ---
+# LLM_RATE_LIMITS: JSON，按提供商配置每分钟请求数 (rpm) 和每分钟 token 数 (tpm)，例如
+#   {"gemini": {"rpm": 60, "tpm": 1000000}, "deepseek": {"rpm": 300}}
+# 未配置的提供商不限流。请求在发出前按令牌桶排队，避免突发流量触发 429 后集体重试。
+LLM_RATE_LIMITS: Dict[str, Dict[str, float]] = json.loads(os.getenv("LLM_RATE_LIMITS", "{}"))
+
+
+class TokenBucket:
+    """
+    令牌桶：容量为每分钟额度，按 rate/60 每秒匀速补充。
+    等待者通过锁按先来先到的顺序获取令牌；允许透支 (debit)，透支部分由后续请求等待补齐。
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self._updated = time.monotonic()
+        self._lock: asyncio.Lock | None = None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        amount = min(amount, self.capacity)  # 超过容量的请求在桶满时放行
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def debit(self, amount: float) -> None:
+        """按实际用量修正 (amount 可以为负，表示退还多扣的令牌)。"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class ProviderRateLimiter:
+    """单个提供商的 RPM / TPM 限流器，所有模型客户端共享。"""
+
+    def __init__(self, provider: str, rpm: float | None = None, tpm: float | None = None):
+        self.provider = provider
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        started = time.perf_counter()
+        if self.requests is not None:
+            await self.requests.acquire(1)
+        if self.tokens is not None:
+            await self.tokens.acquire(estimated_tokens)
+        waited = time.perf_counter() - started
+        RATE_LIMIT_WAIT.labels(self.provider).observe(waited)
+        if waited > 1:
+            logger.info(f"提供商 {self.provider} 限流等待 {waited:.1f} 秒。")
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int) -> None:
+        if self.tokens is not None:
+            self.tokens.debit(actual_tokens - estimated_tokens)
+
+
+_rate_limiters: Dict[str, ProviderRateLimiter | None] = {}
+
+
+def get_rate_limiter(provider: str) -> ProviderRateLimiter | None:
+    """返回提供商的共享限流器，未配置限额时返回 None。"""
+    if provider not in _rate_limiters:
+        limits = LLM_RATE_LIMITS.get(provider)
+        _rate_limiters[provider] = ProviderRateLimiter(provider, limits.get("rpm"), limits.get("tpm")) if limits else None
+    return _rate_limiters[provider]
+
+
+def _estimate_prompt_tokens(messages: Sequence[LLMMessage]) -> int:
+    """粗略估算 prompt token 数 (中文约 1.5 字符 / token，英文约 4 字符 / token，这里统一按 2 字符计)。"""
+    chars = sum(len(str(getattr(message, "content", ""))) for message in messages)
+    return chars // 2 + 1
+
+
+class RateLimitedChatCompletionClient(DelegatingChatCompletionClient):
+    """在请求发出前按提供商的令牌桶排队，响应后按实际 usage 修正 TPM 额度。"""
+
+    def __init__(self, inner: ChatCompletionClient, limiter: ProviderRateLimiter):
+        super().__init__(inner)
+        self.limiter = limiter
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        estimated = _estimate_prompt_tokens(messages)
+        await self.limiter.acquire(estimated)
+        result = await super().create(
+            messages,
+            tools=tools,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        )
+        self.limiter.record_usage(estimated, result.usage.prompt_tokens + result.usage.completion_tokens)
+        return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        estimated = _estimate_prompt_tokens(messages)
+        await self.limiter.acquire(estimated)
+        async for item in super().create_stream(
+            messages,
+            tools=tools,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        ):
+            if isinstance(item, CreateResult):
+                self.limiter.record_usage(estimated, item.usage.prompt_tokens + item.usage.completion_tokens)
+            yield item
@@ -0,0 +1,129 @@
+import os
+import re
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from autogen_core import CancellationToken
+
+logger = logging.getLogger(__name__)
+
+# --- 整体结果缓存配置 ---
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "1800"))  # 秒，0 表示关闭结果缓存
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "256"))
+
+
+def _normalize(text: str | None) -> str:
+    """规范化请求文本：去掉首尾空白、合并连续空白并统一大小写。"""
+    return re.sub(r"\s+", " ", (text or "").strip()).casefold()
+
+
+def make_result_cache_key(endpoint: str, topic: str, requirements: str | None, options: str = "") -> str:
+    """根据 (endpoint, topic, requirements) 和影响结果的运行选项 (如结束条件) 生成缓存键。"""
+    raw = "\x00".join([endpoint, _normalize(topic), _normalize(requirements), options])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    已完成运行的 SSE 事件序列缓存 (进程内 LRU + TTL)。
+    命中时按原顺序回放事件，客户端看到的流与真实运行一致。
+    """
+
+    def __init__(self, ttl: float = RESULT_CACHE_TTL, max_entries: int = RESULT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, Tuple[float, List[str]]]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, key: str) -> Optional[List[str]]:
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.time():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, events: List[str]) -> None:
+        if not self.enabled:
+            return
+        self._data[key] = (time.time() + self.ttl, list(events))
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """清空缓存 (如智能体配置热加载后，旧配置产出的结果不再复用)。"""
+        self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存命中统计。"""
+        return {"entries": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class StreamBroadcast:
+    """
+    一次团队运行产生的事件流。
+
+    记录运行产生的全部事件，并分发给所有订阅者；后加入的订阅者会先收到已产生的事件，
+    因此并发的相同请求可以挂到同一个运行上，收到完全相同的事件流。
+    事件以 None 结束。
+    """
+
+    def __init__(self):
+        self.events: List[str] = []
+        self.done = False
+        self.task: asyncio.Task | None = None
+        # 运行中所有模型调用共用的取消令牌
+        self.cancellation_token = CancellationToken()
+        self._subscribers: List[asyncio.Queue] = []
+
+    async def put(self, event: str | None) -> None:
+        """发布一个事件 (None 表示运行结束)。"""
+        if event is None:
+            self.done = True
+        else:
+            self.events.append(event)
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+
+    def subscribe(self) -> asyncio.Queue:
+        """订阅事件流，返回的队列中会先放入已产生的事件。"""
+        queue: asyncio.Queue = asyncio.Queue()
+        for event in self.events:
+            queue.put_nowait(event)
+        if self.done:
+            queue.put_nowait(None)
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> int:
+        """取消订阅，返回剩余的订阅者数量。"""
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+        return len(self._subscribers)
+
+    def cancel(self) -> None:
+        """
+        取消运行。先触发取消令牌，立即中止进行中的模型调用；只取消任务的话，
+        团队的 run_stream 会等待进行中的调用自然结束 (stop_when_idle) 后才退出，团队迟迟不能归还。
+        """
+        self.cancellation_token.cancel()
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+
+
+# 进程内共享的结果缓存，以及正在运行中的请求 (single-flight)
+result_cache = ResultCache()
+in_flight_runs: Dict[str, StreamBroadcast] = {}
@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Mapping, Optional, Sequence, Tuple, TypeVar, Union
+
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage
+from autogen_core.tools import Tool, ToolSchema
+from pydantic import BaseModel
+
+from model_clients import DelegatingChatCompletionClient
+from metrics import LLM_FAILOVERS, LLM_HEDGED_REQUESTS, CIRCUIT_BREAKER_OPEN
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# --- 路由配置 ---
+# LLM_ROUTE_TIMEOUT: 默认的单次尝试超时 (秒)。流式调用计算到首个分片，非流式调用计算到完整响应
+# LLM_PROVIDER_TIMEOUTS: JSON，按提供商覆盖超时，例如 {"gemini": 20, "ollama": 60}
+# LLM_HEDGE_AFTER: 首选候选超过该秒数仍未响应时，并发向下一个候选发出对冲请求；0 表示关闭
+# LLM_BREAKER_FAILURES / LLM_BREAKER_RESET: 连续失败多少次后熔断提供商，以及熔断多少秒后放行一次试探请求
+LLM_ROUTE_TIMEOUT = float(os.getenv("LLM_ROUTE_TIMEOUT", "120"))
+LLM_PROVIDER_TIMEOUTS: Dict[str, float] = {
+    provider: float(timeout) for provider, timeout in json.loads(os.getenv("LLM_PROVIDER_TIMEOUTS", "{}")).items()
+}
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+
+
+class CircuitBreaker:
+    """
+    提供商级别的熔断器。
+
+    连续失败达到阈值后进入熔断状态，路由时跳过该提供商；
+    熔断 reset_timeout 秒后放行一次试探请求，成功则恢复，失败则继续熔断。
+    排序候选时用 is_available() (不改变状态)，真正发出请求时才用 allow() 占用试探名额。
+    """
+
+    def __init__(self, name: str, failure_threshold: int = LLM_BREAKER_FAILURES, reset_timeout: float = LLM_BREAKER_RESET):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._probing = False
+
+    def is_available(self) -> bool:
+        """是否可以向该提供商发送请求 (熔断超时后且试探名额未被占用)，不改变熔断器状态。"""
+        if self.opened_at is None:
+            return True
+        return not self._probing and time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def allow(self) -> bool:
+        """即将向该提供商发送请求时调用：熔断中时占用唯一的试探名额。"""
+        if not self.is_available():
+            return False
+        if self.opened_at is not None:
+            self._probing = True
+        return True
+
+    def release_probe(self) -> None:
+        """试探请求被取消、没有结果时归还试探名额 (否则熔断器再也不会放行请求)。"""
+        self._probing = False
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info(f"提供商 {self.name} 已恢复，关闭熔断。")
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        CIRCUIT_BREAKER_OPEN.labels(self.name).set(0)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(f"提供商 {self.name} 连续失败 {self.failures} 次，熔断 {self.reset_timeout} 秒。")
+            self.opened_at = time.monotonic()
+            CIRCUIT_BREAKER_OPEN.labels(self.name).set(1)
+
+
+# 每个提供商一个熔断器，所有代理共享
+circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(provider: str) -> CircuitBreaker:
+    if provider not in circuit_breakers:
+        circuit_breakers[provider] = CircuitBreaker(provider)
+    return circuit_breakers[provider]
+
+
+@dataclass(frozen=True)
+class RouteCandidate:
+    """路由候选：一个 (provider, model) 及其模型客户端。"""
+    provider: str
+    model: str
+    client: ChatCompletionClient
+
+    @property
+    def timeout(self) -> float:
+        return LLM_PROVIDER_TIMEOUTS.get(self.provider, LLM_ROUTE_TIMEOUT)
+
+    @property
+    def label(self) -> str:
+        return f"{self.provider}/{self.model}"
+
+
+class RoutingChatCompletionClient(DelegatingChatCompletionClient):
+    """
+    按顺序在多个 (provider, model) 候选之间路由的模型客户端。
+
+    - 每次尝试受提供商超时限制，失败或超时后依次切换到下一个候选
+    - 设置 hedge_after 时，首选候选迟迟没有响应会并发发出一个对冲请求，采用先返回的结果
+    - 熔断中的提供商排到最后，只在其他候选都失败时才尝试
+    流式调用只在收到首个分片之前切换候选；开始输出后中途失败会直接抛出，避免重复输出。
+    模型信息和 token 计数使用首选候选。
+    """
+
+    def __init__(
+        self,
+        candidates: Sequence[RouteCandidate],
+        hedge_after: float = LLM_HEDGE_AFTER,
+        on_failover: Callable[[RouteCandidate], None] | None = None,
+    ):
+        """
+        Args:
+            candidates: 按优先级排列的候选
+            hedge_after: 对冲阈值 (秒)，0 表示关闭
+            on_failover: 调用由首选之外的候选完成时的回调 (如统计本地层回退到远程的次数)
+        """
+        if not candidates:
+            raise ValueError("路由客户端至少需要一个候选模型")
+        super().__init__(candidates[0].client)
+        self.candidates = list(candidates)
+        self.hedge_after = hedge_after
+        self.on_failover = on_failover
+
+    def _ordered_candidates(self) -> List[RouteCandidate]:
+        healthy = [c for c in self.candidates if get_circuit_breaker(c.provider).is_available()]
+        return healthy + [c for c in self.candidates if c not in healthy]
+
+    async def _run_with_failover(
+        self,
+        attempt: Callable[[RouteCandidate], Awaitable[T]],
+        discard: Callable[[T], Awaitable[None]] | None = None,
+    ) -> Tuple[RouteCandidate, T]:
+        """依次 (或对冲) 尝试各候选，返回第一个成功的候选及其结果；其余进行中的尝试被取消。"""
+        candidates = self._ordered_candidates()
+        pending: Dict[asyncio.Task, RouteCandidate] = {}
+        probes: List[RouteCandidate] = []  # 占用了熔断器试探名额的候选
+        errors: List[str] = []
+        next_index = 0
+
+        def launch() -> None:
+            nonlocal next_index
+            candidate = candidates[next_index]
+            next_index += 1
+            # 只有真正发出的请求才占用试探名额；熔断中且没有名额的候选作为最后的手段仍会尝试
+            breaker = get_circuit_breaker(candidate.provider)
+            if breaker.opened_at is not None and breaker.allow():
+                probes.append(candidate)
+            pending[asyncio.create_task(asyncio.wait_for(attempt(candidate), candidate.timeout))] = candidate
+
+        launch()
+        try:
+            while pending:
+                # 只有一个尝试在进行且还有后备候选时才等待对冲阈值
+                can_hedge = self.hedge_after > 0 and len(pending) == 1 and next_index < len(candidates)
+                done, _ = await asyncio.wait(
+                    pending, timeout=self.hedge_after if can_hedge else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    logger.info(f"{next(iter(pending.values())).label} 超过 {self.hedge_after} 秒未响应，对冲请求 {candidates[next_index].label}。")
+                    LLM_HEDGED_REQUESTS.labels(candidates[next_index].provider).inc()
+                    launch()
+                    continue
+                for task in done:
+                    candidate = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        get_circuit_breaker(candidate.provider).record_failure()
+                        errors.append(f"{candidate.label}: {type(e).__name__}: {e}")
+                        logger.warning(f"候选模型 {candidate.label} 调用失败: {type(e).__name__}: {e}")
+                        continue
+                    get_circuit_breaker(candidate.provider).record_success()
+                    if candidate is not self.candidates[0]:
+                        LLM_FAILOVERS.labels(self.candidates[0].provider, candidate.provider).inc()
+                        if self.on_failover is not None:
+                            self.on_failover(candidate)
+                    return candidate, result
+                if not pending and next_index < len(candidates):
+                    launch()
+            raise RuntimeError(f"所有候选模型均调用失败: {errors}")
+        finally:
+            for task, candidate in pending.items():
+                task.cancel()
+                if candidate in probes:
+                    get_circuit_breaker(candidate.provider).release_probe()
+            if discard is not None:
+                # 与胜出者同时完成的尝试需要释放其资源 (如未读完的流)
+                for result in await asyncio.gather(*pending, return_exceptions=True):
+                    if not isinstance(result, BaseException):
+                        await discard(result)
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        _, result = await self._run_with_failover(
+            lambda candidate: candidate.client.create(
+                messages,
+                tools=tools,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token,
+            )
+        )
+        return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        async def open_stream(candidate: RouteCandidate):
+            stream = candidate.client.create_stream(
+                messages,
+                tools=tools,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token,
+            )
+            try:
+                first = await stream.__anext__()
+            except BaseException:
+                await stream.aclose()
+                raise
+            return stream, first
+
+        async def close_stream(opened) -> None:
+            await opened[0].aclose()
+
+        candidate, (stream, first) = await self._run_with_failover(open_stream, close_stream)
+        try:
+            yield first
+            async for item in stream:
+                yield item
+        except Exception:
+            get_circuit_breaker(candidate.provider).record_failure()
+            raise
+        finally:
+            await stream.aclose()
@@ -0,0 +1,33 @@
+import re
+
+# 评分代理的输出统一换算为 0-10 分：Judge 给出 "一类文" 等分类，EnglishScorer 给出各维度的 "8/10"
+# 分类取各档的中间值，阈值 8 表示只有一类文 / 平均 8 分以上的作文才算通过
+_GRADE_SCORES = {"一": 9.0, "二": 7.0, "三": 5.0, "四": 3.0}
+_GRADE = re.compile(r"([一二三四])类文")
+_RATIO = re.compile(r"(\d+(?:\.\d+)?)\s*/\s*(10|100)(?!\d)")
+# "综合评分" / "Overall" 之后的内容优先，避免取到评分细则中提到的其他档次
+_OVERALL = re.compile(r"综合评分|总分|总体评价|overall", re.IGNORECASE)
+_OVERALL_WINDOW = 40
+
+
+def _score_in(text: str) -> float | None:
+    grade = _GRADE.search(text)
+    if grade:
+        return _GRADE_SCORES[grade.group(1)]
+    ratios = [float(value) * 10 / float(scale) for value, scale in _RATIO.findall(text)]
+    if ratios:
+        return round(sum(ratios) / len(ratios), 2)
+    return None
+
+
+def parse_score(text: str) -> float | None:
+    """
+    从评分代理的回复中解析 0-10 分的总分。
+    有 "综合评分" 等总评时取总评，否则取第一个分类或所有 "x/10" 分数的平均值；无法解析时返回 None。
+    """
+    overall = _OVERALL.search(text)
+    if overall:
+        score = _score_in(text[overall.end():overall.end() + _OVERALL_WINDOW])
+        if score is not None:
+            return score
+    return _score_in(text)
@@ -0,0 +1,256 @@
+import os
+import re
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, AsyncGenerator, Deque, Dict, Iterable, List, Sequence
+
+from autogen_agentchat.agents import BaseChatAgent
+from autogen_agentchat.base import Response, TaskResult
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, TextMessage
+from autogen_core import CancellationToken
+
+from metrics import SPECULATION_OUTCOMES, SPECULATION_DRAFT_WAIT
+
+logger = logging.getLogger(__name__)
+
+# --- 推测式起草 ---
+# SPECULATIVE_DRAFTING: 开启后，声明了 speculation 的团队 (见 agent_config.toml) 在开始运行时
+#   让写作代理只根据题目先行起草，与规划代理并行；轮到写作代理时由核对代理比较规划和草稿，
+#   决定直接采用 (keep)、按规划修补 (patch) 还是丢弃草稿重新写作 (regenerate)。
+#   命中时写作代理的整段生成不在关键路径上；未命中时多消耗一次草稿的 token
+SPECULATIVE_DRAFTING = os.getenv("SPECULATIVE_DRAFTING", "false").lower() in ("1", "true", "yes")
+
+KEEP = "keep"
+PATCH = "patch"
+REGENERATE = "regenerate"
+# 草稿生成失败，以及运行在轮到写作代理之前就结束 (草稿被丢弃)
+FAILED = "failed"
+UNUSED = "unused"
+OUTCOMES = (KEEP, PATCH, REGENERATE, FAILED, UNUSED)
+
+# 核对代理的结论，例如 "结论：保留" / "Verdict: KEEP"；无法解析时按重写处理
+_VERDICT = re.compile(r"(?:结论|verdict)\s*[:：]\s*(保留|修补|重写|keep|patch|regenerate)", re.IGNORECASE)
+_VERDICTS = {"保留": KEEP, "修补": PATCH, "重写": REGENERATE, "keep": KEEP, "patch": PATCH, "regenerate": REGENERATE}
+# 延迟样本窗口
+_SAMPLE_WINDOW = 1000
+
+
+def parse_verdict(text: str) -> str:
+    """从核对代理的回复中解析结论 (取最后一个)，无法解析时返回 REGENERATE。"""
+    matches = _VERDICT.findall(text)
+    return _VERDICTS[matches[-1].lower()] if matches else REGENERATE
+
+
+class SpeculationStats:
+    """推测式起草的命中统计：各结论的次数、命中率，以及写作代理等待草稿和核对的耗时。"""
+
+    def __init__(self):
+        self._outcomes: Dict[str, Dict[str, int]] = {}
+        self._waits: Deque[float] = deque(maxlen=_SAMPLE_WINDOW)
+        self._reconcile: Deque[float] = deque(maxlen=_SAMPLE_WINDOW)
+
+    def record(self, team: str, outcome: str) -> None:
+        counts = self._outcomes.setdefault(team, {name: 0 for name in OUTCOMES})
+        counts[outcome] += 1
+        SPECULATION_OUTCOMES.labels(team, outcome).inc()
+
+    def record_turn(self, wait: float, reconcile: float) -> None:
+        """轮到写作代理时：等待草稿完成的秒数 (0 表示草稿已就绪) 和核对耗时。"""
+        self._waits.append(wait)
+        self._reconcile.append(reconcile)
+        SPECULATION_DRAFT_WAIT.observe(wait)
+
+    def stats(self) -> Dict[str, Any]:
+        teams = {}
+        for team, counts in self._outcomes.items():
+            reconciled = counts[KEEP] + counts[PATCH] + counts[REGENERATE]
+            teams[team] = {
+                **counts,
+                # 直接采用草稿的比例；修补也复用了草稿，单独给出
+                "hit_rate": round(counts[KEEP] / reconciled, 3) if reconciled else None,
+                "reuse_rate": round((counts[KEEP] + counts[PATCH]) / reconciled, 3) if reconciled else None,
+            }
+        return {
+            "enabled": SPECULATIVE_DRAFTING,
+            "teams": teams,
+            "draft_wait_mean": round(sum(self._waits) / len(self._waits), 3) if self._waits else None,
+            "reconcile_mean": round(sum(self._reconcile) / len(self._reconcile), 3) if self._reconcile else None,
+        }
+
+
+speculation_stats = SpeculationStats()
+
+
+class SpeculativeWriterAgent(BaseChatAgent):
+    """
+    推测式写作代理，在团队中代替原写作代理 (名称、描述和消息类型相同)。
+
+    speculate(task) 在团队开始运行时由 SpeculativeTeam 调用，用一个独立的写作代理实例只根据任务起草；
+    轮到发言时等待草稿完成，交给核对代理比较规划与草稿：
+    - keep: 直接以草稿作为本轮回复，不再调用写作模型
+    - patch: 把草稿和修补意见交给写作代理，按规划修改草稿
+    - regenerate: 丢弃草稿，写作代理按原流程写作
+    草稿失败或核对失败时同样按原流程写作，推测不会改变流程的结果格式。
+    """
+
+    def __init__(self, writer: Any, drafter: Any, reconciler: Any, team: str):
+        """
+        Args:
+            writer: 按原流程发言的写作代理
+            drafter: 与 writer 配置相同的另一个实例，只用于起草 (不共享上下文)
+            reconciler: 核对代理，回复中包含 "结论：保留 / 修补 / 重写"
+            team: 团队名称，用于统计
+        """
+        super().__init__(writer.name, writer.description)
+        self._writer = writer
+        self._drafter = drafter
+        self._reconciler = reconciler
+        self.team = team
+        self._draft: asyncio.Task | None = None
+
+    @property
+    def produced_message_types(self) -> Sequence[type[BaseChatMessage]]:
+        return self._writer.produced_message_types
+
+    def speculate(self, task: str, cancellation_token: CancellationToken) -> None:
+        """开始根据任务起草 (在当前上下文中创建任务，模型调用计入本次请求的用量和路由规则)。"""
+        self.discard()
+        self._draft = asyncio.create_task(
+            self._drafter.on_messages([TextMessage(content=task, source="user")], cancellation_token)
+        )
+        logger.info(f"{self.name} 开始推测式起草。")
+
+    def discard(self) -> None:
+        """运行结束时草稿仍未使用：取消起草并记为 unused。"""
+        draft, self._draft = self._draft, None
+        if draft is None:
+            return
+        if not draft.done():
+            draft.cancel()
+        elif not draft.cancelled() and draft.exception() is not None:
+            logger.debug(f"未使用的草稿生成失败: {draft.exception()}")
+        speculation_stats.record(self.team, UNUSED)
+
+    @staticmethod
+    def _reconcile_prompt(messages: Sequence[BaseChatMessage], draft: str) -> str:
+        plan = "\n\n".join(f"【{message.source} 的输出】\n{message.to_text()}" for message in messages)
+        return f"{plan}\n\n【草稿】\n{draft}"
+
+    def _patch_message(self, draft: str, notes: str) -> TextMessage:
+        # 以写作代理自身的名义加入上下文，上下文策略 (只看指定发言者的消息) 不会把草稿过滤掉
+        return TextMessage(
+            content=(
+                "以下是在规划完成前只根据题目写好的草稿。请按照上面的规划和修补意见修改草稿，"
+                "保留与规划一致的部分，并按原有格式输出完整的作文。\n"
+                "(Revise this draft, written from the topic alone, to follow the plan above and the notes; "
+                "keep the parts that already fit and output the full essay in the usual format.)\n\n"
+                f"【修补意见】\n{notes}\n\n【草稿】\n{draft}"
+            ),
+            source=self.name,
+        )
+
+    async def on_messages(self, messages: Sequence[BaseChatMessage], cancellation_token: CancellationToken) -> Response:
+        response = None
+        async for item in self.on_messages_stream(messages, cancellation_token):
+            if isinstance(item, Response):
+                response = item
+        return response
+
+    async def on_messages_stream(
+        self, messages: Sequence[BaseChatMessage], cancellation_token: CancellationToken
+    ) -> AsyncGenerator[BaseAgentEvent | BaseChatMessage | Response, None]:
+        draft_task, self._draft = self._draft, None
+        if draft_task is None:
+            async for item in self._writer.on_messages_stream(messages, cancellation_token):
+                yield item
+            return
+
+        started = time.monotonic()
+        try:
+            draft: Response = await draft_task
+        except Exception as e:
+            logger.warning(f"{self.name} 的推测草稿生成失败，按原流程写作: {type(e).__name__}: {e}")
+            speculation_stats.record(self.team, FAILED)
+            async for item in self._writer.on_messages_stream(messages, cancellation_token):
+                yield item
+            return
+        waited = time.monotonic() - started
+
+        try:
+            verdict_response = await self._reconciler.on_messages(
+                [TextMessage(content=self._reconcile_prompt(messages, draft.chat_message.to_text()), source="user")],
+                cancellation_token,
+            )
+            notes = verdict_response.chat_message.to_text()
+            verdict = parse_verdict(notes)
+        except Exception as e:
+            logger.warning(f"核对推测草稿失败，按原流程写作: {type(e).__name__}: {e}")
+            notes, verdict = "", REGENERATE
+        finally:
+            await self._reconciler.on_reset(cancellation_token)
+        speculation_stats.record_turn(waited, time.monotonic() - started - waited)
+        speculation_stats.record(self.team, verdict)
+        logger.info(f"{self.name} 的推测草稿核对结论: {verdict} (等待草稿 {waited:.2f} 秒)")
+
+        if verdict == KEEP:
+            yield Response(chat_message=draft.chat_message, inner_messages=draft.inner_messages)
+            return
+        if verdict == PATCH:
+            messages = [*messages, self._patch_message(draft.chat_message.to_text(), notes)]
+        async for item in self._writer.on_messages_stream(messages, cancellation_token):
+            yield item
+
+    async def on_reset(self, cancellation_token: CancellationToken) -> None:
+        self.discard()
+        await self._writer.on_reset(cancellation_token)
+        await self._drafter.on_reset(cancellation_token)
+        await self._reconciler.on_reset(cancellation_token)
+
+
+class SpeculativeTeam:
+    """
+    包装团队：开始运行时通知其中的推测式写作代理起草，其余接口 (reset、池化等) 与原团队一致。
+    流水线、选择器和 DAG 团队都以这种方式开启推测，团队本身的流程不变。
+    """
+
+    def __init__(self, team: Any, writers: Iterable[SpeculativeWriterAgent]):
+        self.team = team
+        self.writers: List[SpeculativeWriterAgent] = list(writers)
+
+    async def run_stream(
+        self,
+        *,
+        task: str,
+        cancellation_token: CancellationToken | None = None,
+    ) -> AsyncGenerator[BaseAgentEvent | BaseChatMessage | TaskResult, None]:
+        cancellation_token = cancellation_token or CancellationToken()
+        if isinstance(task, str):
+            for writer in self.writers:
+                writer.speculate(task, cancellation_token)
+        try:
+            async for item in self.team.run_stream(task=task, cancellation_token=cancellation_token):
+                yield item
+        finally:
+            for writer in self.writers:
+                writer.discard()
+
+    async def run(self, *, task: str, cancellation_token: CancellationToken | None = None) -> TaskResult:
+        result = None
+        async for item in self.run_stream(task=task, cancellation_token=cancellation_token):
+            if isinstance(item, TaskResult):
+                result = item
+        return result
+
+    async def reset(self) -> None:
+        await self.team.reset()
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self.team, attr)
+
+
+def with_speculation(team: Any, agents: Iterable[Any]) -> Any:
+    """团队中有推测式写作代理时用 SpeculativeTeam 包装，否则原样返回。"""
+    writers = [agent for agent in agents if isinstance(agent, SpeculativeWriterAgent)]
+    return SpeculativeTeam(team, writers) if writers else team
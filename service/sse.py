@@ -0,0 +1,114 @@
+import os
+import json
+import zlib
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict
+
+from sse_starlette.sse import EventSourceResponse
+from starlette.requests import Request
+from starlette.types import Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# --- SSE 编码配置 ---
+# SSE_COMPRESSION: 'auto' 按 Accept-Encoding 协商 br / gzip (每个事件后同步刷新，不会积压)，'none' 关闭压缩
+SSE_COMPRESSION = os.getenv("SSE_COMPRESSION", "auto").lower()
+
+try:
+    import brotli  # 可选依赖，未安装时只使用 gzip
+except ImportError:
+    brotli = None
+
+
+def encode_event(data: Dict[str, Any]) -> str:
+    """紧凑的事件编码：直接输出 UTF-8 中文 (不转义为 \\uXXXX)，去掉分隔符后的空格。"""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+async def delta_events(events: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    增量模式：代理以 "片段" 事件流式输出过的消息，其 "步骤" 事件不再重复携带完整内容，
+    客户端按 "片段" 拼接即可。其他事件原样转发。
+    """
+    async for item in events:
+        # 按解析后的字段判断，消息内容中出现同样的文本不会被误判
+        event = json.loads(item)
+        if event.get("status") == "步骤" and event["data"].get("streamed") is True:
+            event["data"].pop("content", None)
+            item = encode_event(event)
+        yield item
+
+
+class _GzipEncoder:
+    name = "gzip"
+
+    def __init__(self):
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    def encode(self, chunk: bytes) -> bytes:
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliEncoder:
+    name = "br"
+
+    def __init__(self):
+        self._compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=5)
+
+    def encode(self, chunk: bytes) -> bytes:
+        return self._compressor.process(chunk) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+def _negotiate_encoder(accept_encoding: str):
+    if SSE_COMPRESSION == "none":
+        return None
+    accepted = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+    if "br" in accepted and brotli is not None:
+        return _BrotliEncoder()
+    if "gzip" in accepted:
+        return _GzipEncoder()
+    return None
+
+
+class CompressedEventSourceResponse(EventSourceResponse):
+    """
+    按流压缩的 EventSourceResponse。压缩在 ASGI send 层进行，每个事件 (及心跳) 单独同步刷新，
+    客户端可以立即解压出完整事件；断开检测、心跳等行为与 EventSourceResponse 一致。
+    """
+
+    def __init__(self, *args: Any, encoder: Any = None, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.encoder = encoder
+        if encoder is not None:
+            self.headers["content-encoding"] = encoder.name
+            self.headers["vary"] = "Accept-Encoding"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.encoder is None:
+            return await super().__call__(scope, receive, send)
+        lock = asyncio.Lock()  # 事件流和心跳并发发送，保证压缩顺序与发送顺序一致
+
+        async def compressed_send(message: Message) -> None:
+            if message["type"] == "http.response.body":
+                async with lock:
+                    body = self.encoder.encode(message.get("body", b""))
+                    if not message.get("more_body", False):
+                        body += self.encoder.finish()
+                    await send({**message, "body": body})
+                return
+            await send(message)
+
+        await super().__call__(scope, receive, compressed_send)
+
+
+def event_source_response(events: AsyncIterator[Any], request: Request) -> EventSourceResponse:
+    """创建 SSE 响应，客户端支持时按流压缩。"""
+    encoder = _negotiate_encoder(request.headers.get("accept-encoding", ""))
+    return CompressedEventSourceResponse(events, media_type="text/event-stream", encoder=encoder)
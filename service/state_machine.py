@@ -0,0 +1,113 @@
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from typing import List, Mapping, Sequence
+
+from autogen_agentchat.base import TerminatedException, TerminationCondition
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, StopMessage
+
+from scoring import parse_score
+
+logger = logging.getLogger(__name__)
+
+# 转移表中代表任务消息 / 用户代理的状态
+USER_KEY = "user"
+# 流程结束 (交给终止条件处理)
+END = "<end>"
+
+
+@dataclass(frozen=True)
+class Transition:
+    """
+    发言者状态的转移：无条件转到 next，或按该发言者回复中解析出的分数分支
+    (分数 >= score_at_least 转到 next，否则转到 otherwise，例如评分未达标时交给修改代理再来一轮)。
+    目标为 END 表示流程结束。
+    """
+    next: str
+    score_at_least: float | None = None
+    otherwise: str | None = None
+
+
+class TransitionStateMachine:
+    """
+    由声明的转移表驱动的发言者状态机，供选择器团队选择发言者和判断流程结束。
+
+    状态即上一个发言者的名称，每轮按字典直接查表得到下一个发言者；转移表允许环
+    (如 Scorer -> Reviser -> Scorer)，max_iterations 限制每个代理最多发言的次数，
+    即将超出时流程直接结束，避免修改循环无限消耗 token。
+    状态机本身不保存状态，每次从消息历史推导，团队实例 reset 后无需额外处理。
+    """
+
+    def __init__(self, transitions: Mapping[str, Transition], max_iterations: int = 1, user_names: Sequence[str] = ()):
+        """
+        Args:
+            transitions: 发言者名称 -> Transition，USER_KEY 表示任务消息
+            max_iterations: 每个代理最多发言的次数
+            user_names: 与任务消息等价的发言者名称 (如用户代理)
+        """
+        if max_iterations < 1:
+            raise ValueError("max_iterations 必须大于 0")
+        self.transitions = transitions
+        self.max_iterations = max_iterations
+        self._user_names = {"user", *user_names}
+
+    def _state(self, source: str) -> str:
+        return USER_KEY if source in self._user_names else source
+
+    def step(self, message: BaseChatMessage, visits: Counter) -> str | None:
+        """返回 message 之后的下一个发言者 (END 表示结束)；发言者不在转移表中时返回 None。"""
+        transition = self.transitions.get(self._state(message.source))
+        if transition is None:
+            return None
+        target = transition.next
+        if transition.score_at_least is not None:
+            score = parse_score(message.to_text())
+            if score is None or score < transition.score_at_least:
+                target = transition.otherwise or END
+            logger.debug(f"{message.source} 评分 {score}，阈值 {transition.score_at_least}，下一个发言者: {target}")
+        if target != END and visits[target] >= self.max_iterations:
+            logger.info(f"{target} 已发言 {visits[target]} 次，达到 max_iterations，流程结束。")
+            return END
+        return target
+
+    def next_speaker(self, messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> str | None:
+        """按消息历史推导下一个发言者 (END 表示结束)；无法由转移表决定时返回 None。"""
+        visits: Counter = Counter()
+        target = self.transitions[USER_KEY].next if USER_KEY in self.transitions else None
+        for message in messages:
+            if not isinstance(message, BaseChatMessage):
+                continue
+            visits[self._state(message.source)] += 1
+            target = self.step(message, visits)
+        return target
+
+    def selector(self, messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> str | None:
+        """SelectorGroupChat 的 selector_func：返回 None 时交给选择器模型决定。"""
+        target = self.next_speaker(messages)
+        return None if target == END else target
+
+
+class TransitionTermination(TerminationCondition):
+    """状态机走到 END (包括达到 max_iterations) 时结束对话。"""
+
+    def __init__(self, machine: TransitionStateMachine):
+        self._machine = machine
+        self._messages: List[BaseAgentEvent | BaseChatMessage] = []
+        self._terminated = False
+
+    @property
+    def terminated(self) -> bool:
+        return self._terminated
+
+    async def __call__(self, messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> StopMessage | None:
+        if self._terminated:
+            raise TerminatedException("Termination condition has already been reached")
+        self._messages.extend(messages)
+        if messages and self._machine.next_speaker(self._messages) == END:
+            self._terminated = True
+            return StopMessage(content=f"'{self._messages[-1].source}' finished the flow", source="TransitionTermination")
+        return None
+
+    async def reset(self) -> None:
+        self._messages.clear()
+        self._terminated = False
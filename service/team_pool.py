@@ -0,0 +1,161 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Set
+
+logger = logging.getLogger(__name__)
+
+# 池耗尽时的排队策略
+POLICY_WAIT = "wait"      # 排队等待，直到有实例归还 (可设置超时)
+POLICY_REJECT = "reject"  # 立即拒绝请求
+
+
+class PoolExhaustedError(RuntimeError):
+    """团队池中没有可用实例，且排队策略为拒绝或等待超时。"""
+
+
+class TeamPool:
+    """
+    团队实例池。
+
+    每个团队 (SelectorGroupChat 等) 在运行时持有消息线程等状态，不能被并发请求共享。
+    团队池通过工厂函数预先创建若干实例，请求到来时借出一个实例，运行结束后 reset 并归还，
+    从而让 N 个并发请求对应 N 个并行运行的团队。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        factory: Callable[[], Any],
+        max_size: int = 4,
+        policy: str = POLICY_WAIT,
+        acquire_timeout: float | None = None,
+    ):
+        """
+        Args:
+            name: 池名称，用于日志
+            factory: 创建新团队实例的工厂函数
+            max_size: 池中最多存在的实例数量 (借出 + 空闲)
+            policy: 池耗尽时的策略，'wait' 排队等待，'reject' 立即抛出 PoolExhaustedError
+            acquire_timeout: 'wait' 策略下的最长等待秒数，None 表示一直等待
+        """
+        if max_size < 1:
+            raise ValueError(f"团队池 {name} 的 max_size 必须大于 0")
+        if policy not in (POLICY_WAIT, POLICY_REJECT):
+            raise ValueError(f"不支持的团队池排队策略: {policy}")
+        self.name = name
+        self.max_size = max_size
+        self.policy = policy
+        self.acquire_timeout = acquire_timeout
+        self._factory = factory
+        self._idle: List[Any] = []
+        self._current: Set[int] = set()  # 按当前工厂 (配置) 创建的实例 id，invalidate 后旧实例归还时丢弃
+        self._created = 0
+        self._waiting = 0
+        self._condition: asyncio.Condition | None = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        # 延迟创建，确保与运行中的事件循环绑定
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def prewarm(self, count: int) -> None:
+        """预先创建最多 count 个空闲实例 (不超过 max_size)。"""
+        while self._created < min(count, self.max_size):
+            team = self._factory()
+            self._current.add(id(team))
+            self._idle.append(team)
+            self._created += 1
+        logger.info(f"团队池 {self.name} 已预创建 {self._created} 个实例。")
+
+    async def acquire(self) -> Any:
+        """借出一个团队实例，必要时按排队策略等待。"""
+        condition = self._get_condition()
+        loop = asyncio.get_running_loop()
+        deadline = None if self.acquire_timeout is None else loop.time() + self.acquire_timeout
+
+        async with condition:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._created < self.max_size:
+                    self._created += 1
+                    break
+                if self.policy == POLICY_REJECT:
+                    raise PoolExhaustedError(f"团队池 {self.name} 已满 (max_size={self.max_size})，请稍后重试。")
+
+                timeout = None if deadline is None else deadline - loop.time()
+                if timeout is not None and timeout <= 0:
+                    raise PoolExhaustedError(f"等待团队池 {self.name} 的可用实例超时。")
+                self._waiting += 1
+                try:
+                    await asyncio.wait_for(condition.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    raise PoolExhaustedError(f"等待团队池 {self.name} 的可用实例超时。")
+                finally:
+                    self._waiting -= 1
+
+        # 在锁外创建新实例，避免阻塞其他归还操作
+        try:
+            team = self._factory()
+        except Exception:
+            async with condition:
+                self._created -= 1
+                condition.notify()
+            raise
+        self._current.add(id(team))
+        logger.info(f"团队池 {self.name} 创建了新实例 (当前共 {self._created} 个)。")
+        return team
+
+    async def release(self, team: Any) -> None:
+        """重置团队状态后归还到池中；重置失败的实例直接丢弃。"""
+        condition = self._get_condition()
+        try:
+            await team.reset()
+            discard = False
+        except Exception as e:
+            logger.warning(f"团队池 {self.name} 重置实例失败，丢弃该实例: {e}")
+            discard = True
+
+        async with condition:
+            if id(team) not in self._current:
+                # 实例是按旧配置创建的 (见 invalidate)，不再放回池中
+                discard = True
+            if discard:
+                self._current.discard(id(team))
+                self._created -= 1
+            else:
+                self._idle.append(team)
+            condition.notify()
+
+    def invalidate(self) -> None:
+        """
+        丢弃所有空闲实例，借出中的实例在归还时丢弃，之后按工厂重新创建。
+        用于配置热加载：正在运行的请求不受影响，新请求使用新配置。
+        """
+        self._created -= len(self._idle)
+        self._idle.clear()
+        self._current.clear()
+        logger.info(f"团队池 {self.name} 的实例已失效，将按新配置重新创建。")
+
+    @asynccontextmanager
+    async def checkout(self) -> AsyncIterator[Any]:
+        """以上下文管理器的方式借出并自动归还团队实例。"""
+        team = await self.acquire()
+        try:
+            yield team
+        finally:
+            # 即使调用方被取消，也要完成归还，避免实例泄漏
+            await asyncio.shield(self.release(team))
+
+    def stats(self) -> Dict[str, Any]:
+        """返回池的当前状态。"""
+        return {
+            "name": self.name,
+            "max_size": self.max_size,
+            "created": self._created,
+            "idle": len(self._idle),
+            "in_use": self._created - len(self._idle),
+            "waiting": self._waiting,
+        }
@@ -1,122 +1,211 @@
-from autogen_agentchat.teams import SelectorGroupChat
-from autogen_agentchat.conditions import TextMentionTermination
-from autogen_ext.models.openai import OpenAIChatCompletionClient
+from autogen_agentchat.teams import SelectorGroupChat, RoundRobinGroupChat
+from autogen_agentchat.conditions import TextMentionTermination, MaxMessageTermination, SourceMatchTermination
 from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage
-from typing import Sequence
-from agents import (
-    user_proxy,
-    chinese_planner, chinese_writer, chinese_scorer, chinese_reviser,
-    english_planner, english_writer, english_scorer, english_reviser
-)
-
-# 创建模型客户端 (使用 Gemini 兼容端点，需要在环境中设置 GEMINI_API_KEY 或其他兼容 API 密钥)
-model_client = OpenAIChatCompletionClient(model="gemini-1.5-flash-8b")
-
-# 设置终止条件 (当消息中包含 "TERMINATE" 时结束)
-termination = TextMentionTermination("TERMINATE")
-
-# 自定义选择函数，确保严格按照流程顺序选择下一个发言者
-def chinese_writing_selector(messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> str | None:
-    if not messages:
-        return chinese_planner.name  # 如果没有消息，默认从 Planner 开始
-    
-    last_message = messages[-1]
-    last_source = last_message.source
-    
-    if last_source == user_proxy.name:
-        return chinese_planner.name  # 用户发言后，选择 Planner
-    elif last_source == chinese_planner.name:
-        return chinese_writer.name  # Planner 发言后，选择 Writer
-    elif last_source == chinese_writer.name:
-        return chinese_scorer.name  # Writer 发言后，选择 Scorer
-    elif last_source == chinese_scorer.name:
-        return chinese_reviser.name  # Scorer 发言后，选择 Reviser
-    elif last_source == chinese_reviser.name:
-        return None  # Reviser 发言后，流程结束，交给终止条件处理
-    
-    return None  # 默认情况下不选择，返回 None 使用模型选择
-
-def chinese_revision_selector(messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> str | None:
-    if not messages:
-        return chinese_scorer.name  # 如果没有消息，默认从 Scorer 开始
-    
-    last_message = messages[-1]
-    last_source = last_message.source
-    
-    if last_source == user_proxy.name:
-        return chinese_scorer.name  # 用户发言后，选择 Scorer
-    elif last_source == chinese_scorer.name:
-        return chinese_planner.name  # Scorer 发言后，选择 Planner
-    elif last_source == chinese_planner.name:
-        return chinese_reviser.name  # Planner 发言后，选择 Reviser
-    elif last_source == chinese_reviser.name:
-        return None  # Reviser 发言后，流程结束，交给终止条件处理
-    
-    return None  # 默认情况下不选择，返回 None 使用模型选择
-
-# --- 1. 中文范文写作团队 (Chinese Sample Essay Writing Team) ---
-# 流程: User -> Planner -> Writer -> Scorer -> Reviser -> User
-# 注意: 使用自定义选择函数确保严格按照流程顺序选择发言者
-chinese_writing_agents = [user_proxy, chinese_planner, chinese_writer, chinese_scorer, chinese_reviser]
-chinese_writing_team = SelectorGroupChat(
-    chinese_writing_agents,
-    model_client=model_client,
-    termination_condition=termination,
-    allow_repeated_speaker=False,  # 不允许同一发言者连续发言
-    selector_func=chinese_writing_selector
-)
-
-# --- 2. 英文范文写作团队 (English Sample Essay Writing Team) ---
-# 流程: User -> Planner -> Writer -> Scorer -> Reviser -> User
-# 注意: agent 列表顺序反映了期望的调用流程，确保从 Planner 开始，依次到 Writer、Scorer 和 Reviser
-english_writing_agents = [user_proxy, english_planner, english_writer, english_scorer, english_reviser]
-english_writing_team = SelectorGroupChat(
-    english_writing_agents,
-    model_client=model_client,
-    termination_condition=termination,
-    allow_repeated_speaker=True
-)
-
-# --- 3. 中文作文修改团队 (Chinese Essay Revision Team) ---
-# 流程: User -> Scorer -> Planner -> Reviser -> User
-# 注意: 使用自定义选择函数确保严格按照流程顺序选择发言者
-chinese_revision_agents = [user_proxy, chinese_scorer, chinese_planner, chinese_reviser]
-chinese_revision_team = SelectorGroupChat(
-    chinese_revision_agents,
-    model_client=model_client,
-    termination_condition=termination,
-    allow_repeated_speaker=False,  # 不允许同一发言者连续发言
-    selector_func=chinese_revision_selector
-)
-
-# --- 4. 英文作文修改团队 (English Essay Revision Team) ---
-# 流程: User -> Scorer -> Planner -> Reviser -> User
-# 注意: agent 列表顺序反映了期望的调用流程，确保从 Scorer 开始，依次到 Planner 和 Reviser
-english_revision_agents = [user_proxy, english_scorer, english_planner, english_reviser]
-english_revision_team = SelectorGroupChat(
-    english_revision_agents,
-    model_client=model_client,
-    termination_condition=termination,
-    allow_repeated_speaker=True
-)
+from typing import Any, Sequence, Tuple
+import os
+import logging
+import weakref
+import functools
+from team_pool import TeamPool, POLICY_WAIT
+from dag import DagTeam
+from agent_config import agent_config, AgentConfig, TeamSpec, TEAM_MODES
+from state_machine import TransitionStateMachine, TransitionTermination
+from termination import RunLimits, RunTermination
+from speculation import SpeculativeTeam, SpeculativeWriterAgent, with_speculation, SPECULATIVE_DRAFTING
+from client_registry import client_registry
+from metrics import InstrumentedSelectorClient, register_team_pool, SELECTOR_AGENT
+from tracing import TracingChatCompletionClient
+from routing import RouteCandidate
+from tiering import SELECTOR_KEY, TIER_LOCAL, LLM_TIER_MODE
+from agents import create_agent, create_user_proxy, create_tiered_model_client, agent_name, USER_PROXY_NAME
+
+logger = logging.getLogger(__name__)
+
+# 选择器模型客户端 (使用 Gemini 兼容端点，需要在环境中设置 GEMINI_API_KEY 或其他兼容 API 密钥)
+# 仅 selector 模式的团队需要，首次构建团队时才创建
+# 选择器只输出下一个发言者的名称，分层执行时属于本地层 (见 tiering.py)
+def get_selector_model_client():
+    model_client = InstrumentedSelectorClient(
+        client_registry.get_model_client("openai", "gemini-1.5-flash-8b"), "openai", "gemini-1.5-flash-8b"
+    )
+    model_client = TracingChatCompletionClient(model_client, SELECTOR_AGENT, "openai", "gemini-1.5-flash-8b")
+    candidates = [RouteCandidate("openai", "gemini-1.5-flash-8b", model_client)]
+    return create_tiered_model_client(SELECTOR_KEY, TIER_LOCAL, candidates, agent=SELECTOR_AGENT)
+
+# --- 团队工厂 ---
+# 团队定义在 agent_config.toml 中声明 (见 agent_config.py)。工厂在每次调用时读取当前配置，
+# 并创建一组全新的代理和终止条件，保证不同团队实例之间不共享消息线程等状态；
+# 配置热加载后团队池丢弃旧实例，新实例自动按新配置创建。
+
+def team_spec(team_name: str) -> TeamSpec:
+    spec = agent_config.config.teams.get(team_name)
+    if spec is None:
+        raise ValueError(f"未定义的团队: {team_name}")
+    return spec
+
+def selector_termination(final_agent_keys: Sequence[str]):
+    # 输出最终作文的代理发言后结束 (结构化输出的回复中没有 "TERMINATE")
+    return TextMentionTermination("TERMINATE") | SourceMatchTermination([agent_name(key) for key in final_agent_keys])
+
+# 每个团队实例的请求级结束条件 (评分达标、token / 时间预算等，见 termination.py)，
+# 与团队自身的终止条件以 OR 组合；借出实例后由 configure_run 设置本次请求的条件
+_run_terminations: "weakref.WeakKeyDictionary[Any, RunTermination]" = weakref.WeakKeyDictionary()
+
+def create_run_termination(team_name: str) -> RunTermination:
+    spec = team_spec(team_name)
+    return RunTermination(team_name, [agent_name(key) for key in spec.scorers], get_final_agent_names(team_name))
+
+def configure_run(team: Any, limits: RunLimits) -> None:
+    """为借出的团队实例设置本次请求的结束条件 (DAG 团队按固定的节点运行，不受影响)。"""
+    condition = _run_terminations.get(team)
+    if condition is not None:
+        condition.configure(limits)
+
+# 开启推测式起草 (SPECULATIVE_DRAFTING) 时，团队声明的写作代理替换为推测式写作代理，
+# 团队用 SpeculativeTeam 包装，开始运行时即根据任务起草 (见 speculation.py)
+def create_team_agent(team_name: str, key: str):
+    spec = team_spec(team_name)
+    if SPECULATIVE_DRAFTING and key == spec.speculative_writer:
+        return SpeculativeWriterAgent(create_agent(key), create_agent(key), create_agent(spec.reconciler), team_name)
+    return create_agent(key)
+
+# --- 选择器团队 (SelectorGroupChat) ---
+# 代理列表顺序反映了期望的调用流程。声明了转移表的团队由状态机按表选择发言者 (见 state_machine.py)，
+# 支持评分未达标时回到修改代理的循环，状态机走到结束或达到 max_iterations 时终止；
+# 代理回复中的 "TERMINATE" 只表示自身任务完成。没有转移表的团队由选择器模型决定下一个发言者。
+def build_selector_team(team_name: str) -> "SelectorGroupChat | SpeculativeTeam":
+    spec = team_spec(team_name)
+    selector_func = None
+    termination = selector_termination(spec.final or spec.pipeline[-1:])
+    if spec.transitions:
+        machine = TransitionStateMachine(spec.transitions, spec.max_iterations, user_names=(USER_PROXY_NAME,))
+        selector_func = machine.selector
+        # 转移表没有覆盖的发言者交给选择器模型，按消息数兜底
+        termination = TransitionTermination(machine) | MaxMessageTermination(len(spec.pipeline) * spec.max_iterations + 1)
+    run_termination = create_run_termination(team_name)
+    agents = [create_team_agent(team_name, key) for key in spec.pipeline]
+    team = with_speculation(SelectorGroupChat(
+        [create_user_proxy(), *agents],
+        model_client=get_selector_model_client(),
+        termination_condition=termination | run_termination,
+        allow_repeated_speaker=spec.allow_repeated_speaker,
+        selector_func=selector_func,
+    ), agents)
+    _run_terminations[team] = run_termination
+    return team
+
+# --- 确定性流水线团队 (Pipeline Team) ---
+# 按声明的顺序依次发言，每个代理各发言一次，完全不调用选择器模型，
+# 相比 SelectorGroupChat 每轮节省一次选择发言者的模型往返。
+# 与选择器团队使用相同的代理和 run_stream 接口，SSE 事件约定保持不变。
+def build_pipeline_team(team_name: str) -> "RoundRobinGroupChat | SpeculativeTeam":
+    agent_keys = team_spec(team_name).pipeline
+    run_termination = create_run_termination(team_name)
+    agents = [create_team_agent(team_name, key) for key in agent_keys]
+    team = with_speculation(RoundRobinGroupChat(
+        agents,
+        # 任务消息 + 每个代理一条消息后结束；代理回复中的 "TERMINATE" 只表示自身任务完成
+        termination_condition=MaxMessageTermination(len(agent_keys) + 1) | run_termination,
+    ), agents)
+    _run_terminations[team] = run_termination
+    return team
+
+# --- DAG 并行团队 (DAG Team) ---
+# 声明代理之间的依赖关系，互不依赖的代理并发运行，所有规划结果合并进最后一个节点 (Writer) 的上下文。
+def build_dag_team(team_name: str) -> "DagTeam | SpeculativeTeam":
+    team = DagTeam(team_spec(team_name).dag, functools.partial(create_team_agent, team_name))
+    return with_speculation(team, team.agents)
+
+# 团队模式: 'pipeline' (按声明顺序执行，无选择器调用)、'selector' (SelectorGroupChat)
+# 或 'dag' (声明了 DAG 的团队并行执行，其余团队使用 pipeline)；团队可以在配置中用 mode 单独覆盖
+TEAM_MODE = os.getenv("TEAM_MODE", "pipeline").lower()
+if TEAM_MODE not in TEAM_MODES:
+    raise ValueError(f"不支持的团队模式: {TEAM_MODE}")
+
+TEAM_BUILDERS = {
+    "pipeline": build_pipeline_team,
+    "selector": build_selector_team,
+    "dag": build_dag_team,
+}
+
+def get_team_mode(team_name: str) -> str:
+    """返回团队当前生效的模式 (没有声明 DAG 的团队在 dag 模式下使用 pipeline)。"""
+    spec = team_spec(team_name)
+    mode = spec.mode or TEAM_MODE
+    if mode == "dag" and not spec.dag:
+        return "pipeline"
+    return mode
+
+def build_team(team_name: str):
+    """按当前配置和团队模式创建一个新的团队实例。"""
+    return TEAM_BUILDERS[get_team_mode(team_name)](team_name)
+
+def get_final_agent_names(team_name: str) -> Tuple[str, ...]:
+    """
+    返回团队中输出最终作文的代理名称，最终结果取其中最新的一条消息。
+    使用配置中的 final (只保留当前模式下参与运行的代理)，默认为流程的最后一个角色或 DAG 的最后一个节点。
+    """
+    spec = team_spec(team_name)
+    keys = [node.key for node in spec.dag] if get_team_mode(team_name) == "dag" else list(spec.pipeline)
+    final = [key for key in spec.final if key in keys] or keys[-1:]
+    return tuple(agent_name(key) for key in final)
+
+def get_scorer_names(team_name: str) -> Tuple[str, ...]:
+    """返回团队中评分代理的名称 (用于统计各分层模式的评分)。"""
+    return tuple(agent_name(key) for key in team_spec(team_name).scorers)
+
+def uses_local_tier() -> bool:
+    """
+    是否有调用可能落在本地层：全局分层模式不是 remote，配置中有代理声明了本地层，
+    或有团队使用选择器 (选择器属于本地层)；请求也可以用路由规则按代理声明的层级执行。
+    """
+    if LLM_TIER_MODE != "remote":
+        return True
+    if any(spec.tier == TIER_LOCAL for spec in agent_config.config.agents.values()):
+        return True
+    return any(get_team_mode(team_name) == "selector" for team_name in agent_config.config.teams)
+
+def get_team_factory(team_name: str):
+    """返回团队的工厂函数；模式和代理在每次创建实例时按当前配置决定。"""
+    return functools.partial(build_team, team_name)
+
+# --- 团队池 ---
+# 每种团队一个池，请求借出独立的团队实例并行运行，结束后 reset 归还
+TEAM_POOL_MAX_SIZE = int(os.getenv("TEAM_POOL_MAX_SIZE", "4"))
+TEAM_POOL_POLICY = os.getenv("TEAM_POOL_POLICY", POLICY_WAIT)  # 'wait' 或 'reject'
+TEAM_POOL_ACQUIRE_TIMEOUT = float(os.getenv("TEAM_POOL_ACQUIRE_TIMEOUT", "60")) or None  # 0 表示不限时
+TEAM_POOL_PREWARM = int(os.getenv("TEAM_POOL_PREWARM", "1"))  # 启动时每个池预创建的实例数
+
+def _create_pool(name: str, factory) -> TeamPool:
+    pool = TeamPool(
+        name,
+        factory,
+        max_size=TEAM_POOL_MAX_SIZE,
+        policy=TEAM_POOL_POLICY,
+        acquire_timeout=TEAM_POOL_ACQUIRE_TIMEOUT,
+    )
+    register_team_pool(pool)  # 在 /metrics 中导出排队深度
+    return pool
+
+team_pools = {
+    team_name: _create_pool(team_name, get_team_factory(team_name))
+    for team_name in agent_config.config.teams
+}
+
+def _on_config_reload(config: AgentConfig) -> None:
+    """配置热加载后丢弃按旧配置创建的团队实例，并为新增的团队创建团队池。"""
+    for team_name, pool in team_pools.items():
+        if team_name not in config.teams:
+            logger.warning(f"团队 {team_name} 已从配置中移除，该团队的请求将失败。")
+        pool.invalidate()
+    for team_name in config.teams:
+        if team_name not in team_pools:
+            team_pools[team_name] = _create_pool(team_name, get_team_factory(team_name))
+
+agent_config.add_listener(_on_config_reload)
 
 # Example usage (to be placed in app.py or a similar entry point):
-# from teams import chinese_writing_team, user_proxy
-#
-# user_proxy.initiate_chat(
-#     chinese_writing_team,
-#     message="请以“科技进步对现代生活的影响”为主题，写一篇800字左右的中文议论文范文。TERMINATE"
-# )
-#
-# from teams import english_revision_team, user_proxy
-#
-# user_essay_to_revise = """
-# Technology is change the world very fast. Many people think it good, some think it bad.
-# For example, phone make communication easy. But people look phone too much.
-# Also car help travel but make pollution. We need find balance.
-# """
+# from teams import team_pools
 #
-# user_proxy.initiate_chat(
-#     english_revision_team,
-#     message=f"Please revise the following English essay:\n\n{user_essay_to_revise}\n\nTERMINATE"
-# )
+# async with team_pools["chinese_writing"].checkout() as team:
+#     result = await team.run(task="请以“科技进步对现代生活的影响”为主题，写一篇800字左右的中文议论文范文。")
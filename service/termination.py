@@ -0,0 +1,158 @@
+import os
+import time
+import difflib
+import logging
+from typing import Any, Collection, Dict, Sequence
+
+from autogen_agentchat.base import TerminatedException, TerminationCondition
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, StopMessage
+from pydantic import BaseModel, Field
+
+from final_result import final_result_from_message
+from metrics import current_request_usage, record_run_termination
+from scoring import parse_score
+
+logger = logging.getLogger(__name__)
+
+# --- 运行预算 / 提前结束的默认值 (每个请求可以通过 limits 字段覆盖) ---
+# TERMINATION_SCORE_THRESHOLD: 已有作文且评分代理给出的分数 (0-10，见 scoring.py) 达到该值时结束，跳过后续修改；0 表示不启用
+# TERMINATION_MAX_TURNS: 代理最多发言的总次数，0 表示不限
+# TERMINATION_MAX_TOKENS: 本次运行所有模型调用的 token 上限，0 表示不限
+# TERMINATION_TIME_BUDGET: 运行的时间预算 (秒)，超出后当前代理发言结束时停止，0 表示不限
+# TERMINATION_MIN_CHANGE: 相邻两版作文的改动比例低于该值时结束 (如 0.02 表示改动不足 2%)，0 表示不启用
+TERMINATION_SCORE_THRESHOLD = float(os.getenv("TERMINATION_SCORE_THRESHOLD", "0"))
+TERMINATION_MAX_TURNS = int(os.getenv("TERMINATION_MAX_TURNS", "0"))
+TERMINATION_MAX_TOKENS = int(os.getenv("TERMINATION_MAX_TOKENS", "0"))
+TERMINATION_TIME_BUDGET = float(os.getenv("TERMINATION_TIME_BUDGET", "0"))
+TERMINATION_MIN_CHANGE = float(os.getenv("TERMINATION_MIN_CHANGE", "0"))
+
+
+class RunLimits(BaseModel):
+    """单次运行的结束条件，任一条件满足即结束。未设置的字段使用环境变量中的默认值，0 表示不启用。"""
+    score_threshold: float | None = Field(default=None, ge=0, le=10, description="评分达到该分数 (0-10) 且已有作文时结束")
+    max_turns: int | None = Field(default=None, ge=0, description="代理最多发言的总次数")
+    max_tokens: int | None = Field(default=None, ge=0, description="所有模型调用的 token 上限")
+    time_budget: float | None = Field(default=None, ge=0, description="时间预算 (秒)")
+    min_change: float | None = Field(default=None, ge=0, le=1, description="相邻两版作文的改动比例低于该值时结束")
+
+
+def resolve_run_limits(overrides: RunLimits | Dict[str, Any] | None = None) -> RunLimits:
+    """用环境变量中的默认值补全请求中未设置的条件。"""
+    if isinstance(overrides, dict):
+        overrides = RunLimits(**overrides)
+    defaults = RunLimits(
+        score_threshold=TERMINATION_SCORE_THRESHOLD,
+        max_turns=TERMINATION_MAX_TURNS,
+        max_tokens=TERMINATION_MAX_TOKENS,
+        time_budget=TERMINATION_TIME_BUDGET,
+        min_change=TERMINATION_MIN_CHANGE,
+    )
+    if overrides is None:
+        return defaults
+    return defaults.model_copy(update=overrides.model_dump(exclude_none=True))
+
+
+def draft_change(previous: str, current: str) -> float:
+    """两版作文之间的改动比例 (0 表示完全相同，1 表示完全不同)。"""
+    return 1 - difflib.SequenceMatcher(None, previous, current, autojunk=False).ratio()
+
+
+class RunTermination(TerminationCondition):
+    """
+    按请求的 RunLimits 结束运行的组合条件：评分达标、发言次数、token 上限、时间预算、作文不再有实质改动。
+
+    每个团队实例创建一个，借出实例后通过 configure 设置本次请求的条件，reset (归还团队池) 时恢复默认值。
+    与团队自身的终止条件 (流程结束、状态机等) 以 OR 组合；触发的原因记录在 /metrics 中。
+    """
+
+    def __init__(self, team: str, scorers: Collection[str] = (), drafts: Collection[str] = ()):
+        """
+        Args:
+            team: 团队名称，用于监控指标
+            scorers: 评分代理的名称，从其回复中解析分数
+            drafts: 输出作文的代理的名称，用于判断是否已有作文以及相邻两版的改动
+        """
+        self.team = team
+        self._scorers = set(scorers)
+        self._drafts = set(drafts)
+        self.limits = resolve_run_limits()
+        self._reset_state()
+
+    def _reset_state(self) -> None:
+        self._terminated = False
+        self._started: float | None = None
+        self._turns = 0
+        self._message_tokens = 0
+        self._latest_draft: str | None = None
+
+    def configure(self, limits: RunLimits) -> None:
+        """设置本次运行的条件 (在 run_stream 之前调用)。"""
+        self.limits = limits
+
+    @property
+    def terminated(self) -> bool:
+        return self._terminated
+
+    def _tokens_used(self) -> int:
+        # 优先使用请求级用量汇总 (包含选择器和故障转移的调用)，不在请求上下文中时按消息自带的用量累计
+        usage = current_request_usage()
+        if usage is not None:
+            return int(usage["prompt_tokens"] + usage["completion_tokens"])
+        return self._message_tokens
+
+    def _check_message(self, message: BaseChatMessage) -> tuple[str, str] | None:
+        limits = self.limits
+        if message.source in self._drafts:
+            result = final_result_from_message(message)
+            if result is not None:
+                previous, self._latest_draft = self._latest_draft, result["essay"]
+                if limits.min_change and previous is not None:
+                    change = draft_change(previous, self._latest_draft)
+                    if change < limits.min_change:
+                        return "no_change", f"{message.source} 的改动比例 {change:.1%} 低于 {limits.min_change:.1%}"
+        if limits.score_threshold and message.source in self._scorers and self._latest_draft is not None:
+            score = parse_score(message.to_text())
+            if score is not None and score >= limits.score_threshold:
+                return "score", f"{message.source} 评分 {score} 达到 {limits.score_threshold}"
+        return None
+
+    def _check_budget(self) -> tuple[str, str] | None:
+        limits = self.limits
+        if limits.max_turns and self._turns >= limits.max_turns:
+            return "max_turns", f"代理已发言 {self._turns} 次"
+        if limits.max_tokens:
+            tokens = self._tokens_used()
+            if tokens >= limits.max_tokens:
+                return "max_tokens", f"已使用 {tokens} token"
+        if limits.time_budget and time.monotonic() - self._started >= limits.time_budget:
+            return "time_budget", f"已运行 {time.monotonic() - self._started:.1f} 秒"
+        return None
+
+    async def __call__(self, messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> StopMessage | None:
+        if self._terminated:
+            raise TerminatedException("Termination condition has already been reached")
+        if self._started is None:
+            self._started = time.monotonic()
+        stop = None
+        for message in messages:
+            if not isinstance(message, BaseChatMessage) or message.source == "user":
+                continue
+            self._turns += 1
+            if message.models_usage is not None:
+                self._message_tokens += message.models_usage.prompt_tokens + message.models_usage.completion_tokens
+            stop = self._check_message(message)
+            if stop is not None:
+                break
+        if stop is None and messages:
+            stop = self._check_budget()
+        if stop is None:
+            return None
+        reason, detail = stop
+        self._terminated = True
+        record_run_termination(self.team, reason)
+        logger.info(f"团队 {self.team} 提前结束 ({reason}): {detail}")
+        return StopMessage(content=f"{reason}: {detail}", source="RunTermination")
+
+    async def reset(self) -> None:
+        self._reset_state()
+        self.limits = resolve_run_limits()
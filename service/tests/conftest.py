@@ -0,0 +1,32 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 测试直接导入 service 目录下的模块 (与 uvicorn app:app 的运行方式一致)
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVICE_DIR not in sys.path:
+    sys.path.insert(0, SERVICE_DIR)
+
+# 模块导入时按 API Key 登记模型客户端配置；测试中的团队都是假的，不会发出真实的模型请求
+for _key in ("OPENAI_API_KEY", "DEEPSEEK_API_KEY", "GROK_API_KEY", "GEMINI_API_KEY", "OLLAMA_API_KEY"):
+    os.environ.setdefault(_key, "test")
+# 任务数据库放在临时目录，不写入 service/.jobs.sqlite
+os.environ.setdefault("JOBS_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="essay-tests-"), "jobs.sqlite"))
+
+
+@pytest.fixture
+def chat_app(monkeypatch):
+    """
+    导入 app 模块，团队相关的钩子换成与 ScriptedTeam 对应的版本：
+    最终代理为 Polisher，不解析评分，不配置结束条件。每个测试使用空的结果缓存。
+    """
+    import app
+
+    monkeypatch.setattr(app, "get_final_agent_names", lambda team_name: ("Polisher",))
+    monkeypatch.setattr(app, "get_scorer_names", lambda team_name: ())
+    monkeypatch.setattr(app, "configure_run", lambda team, limits: None)
+    app.result_cache.clear()
+    app.in_flight_runs.clear()
+    return app
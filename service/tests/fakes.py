@@ -0,0 +1,61 @@
+import asyncio
+from typing import List, Sequence, Tuple
+
+from autogen_agentchat.base import TaskResult
+from autogen_agentchat.messages import ModelClientStreamingChunkEvent, TextMessage
+from autogen_core import CancellationToken
+
+
+class ScriptedTeam:
+    """
+    按脚本发言的假团队，接口与 autogen 团队的 run_stream / reset 一致。
+    每个代理先以 "片段" 流式输出内容 (按字符)，再产出完整消息。
+    """
+
+    def __init__(self, script: Sequence[Tuple[str, str]], delay: float = 0.0):
+        self.script = list(script)
+        self.delay = delay  # 每个片段之间的间隔秒数
+        self.runs = 0
+        self.tokens: List[CancellationToken] = []
+
+    async def run_stream(self, *, task: str, cancellation_token: CancellationToken | None = None):
+        self.runs += 1
+        self.tokens.append(cancellation_token)
+        yield TextMessage(content=task, source="user")
+        messages = []
+        for agent, text in self.script:
+            for char in text:
+                await asyncio.sleep(self.delay)
+                yield ModelClientStreamingChunkEvent(content=char, source=agent)
+            message = TextMessage(content=text, source=agent)
+            messages.append(message)
+            yield message
+        yield TaskResult(messages=messages, stop_reason="done")
+
+    async def reset(self) -> None:
+        pass
+
+
+class BlockingTeam:
+    """
+    模拟一次长时间的模型调用：调用只会被取消令牌中止。
+    与 autogen 团队一致，run_stream 被取消后仍等待进行中的调用结束 (stop_when_idle) 才退出。
+    """
+
+    def __init__(self, call_seconds: float = 30.0):
+        self.call_seconds = call_seconds
+        self.started = asyncio.Event()
+
+    async def run_stream(self, *, task: str, cancellation_token: CancellationToken | None = None):
+        yield TextMessage(content=task, source="user")
+        call = asyncio.ensure_future(asyncio.sleep(self.call_seconds))
+        cancellation_token.link_future(call)
+        self.started.set()
+        try:
+            await asyncio.shield(call)
+        finally:
+            await asyncio.gather(call, return_exceptions=True)
+        yield TaskResult(messages=[], stop_reason="done")
+
+    async def reset(self) -> None:
+        pass
@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+import pytest
+from autogen_core import CancellationToken
+
+from admission import AdmissionController, AdmissionRejectedError
+from fakes import BlockingTeam, ScriptedTeam
+from team_pool import TeamPool
+
+
+async def _hold(controller: AdmissionController, team: BlockingTeam, tenant: str = "default"):
+    """占用一个运行名额，直到 BlockingTeam 的调用结束。"""
+    async with controller.admit(tenant):
+        async for _ in team.run_stream(task="题目", cancellation_token=CancellationToken()):
+            pass
+
+
+def test_round_robin_across_tenants_and_positions():
+    controller = AdmissionController(max_concurrent=1, max_queue=10)
+    team = BlockingTeam(call_seconds=0.05)
+    admitted = []
+    positions = {}
+
+    async def request(name: str, tenant: str):
+        async def on_position(position: int):
+            positions.setdefault(name, []).append(position)
+
+        async with controller.admit(tenant, on_position=on_position):
+            admitted.append(name)
+            await asyncio.sleep(0)
+
+    async def main():
+        holder = asyncio.create_task(_hold(controller, team))
+        await team.started.wait()
+        # 班级 a 突发三个请求，班级 b 随后一个
+        waiters = [asyncio.create_task(request(name, name[0])) for name in ("a1", "a2", "a3", "b1")]
+        await asyncio.sleep(0.01)
+        queued = controller.stats(), {name: reported[-1] for name, reported in positions.items()}
+        await asyncio.gather(holder, *waiters)
+        return queued
+
+    queued, snapshot = asyncio.run(main())
+
+    assert queued["queued"] == 4 and queued["tenants"] == {"a": 3, "b": 1}
+    # 位置按轮转推算：b1 排在 a 的第二个请求之前 (b1 入队时 a2、a3 的位置后移)
+    assert snapshot == {"a1": 1, "b1": 2, "a2": 3, "a3": 4}
+    assert admitted == ["a1", "b1", "a2", "a3"]
+    # 名额空出后位置前移，每个请求被放行前都报告过位置 1
+    assert all(reported[-1] == 1 for reported in positions.values())
+    assert controller.stats()["running"] == 0
+
+
+def test_queue_full_rejects_and_cancelled_waiter_leaves_queue():
+    controller = AdmissionController(max_concurrent=1, max_queue=1)
+    team = BlockingTeam(call_seconds=0.1)
+
+    async def wait_admitted():
+        async with controller.admit("b"):
+            pass
+
+    async def main():
+        holder = asyncio.create_task(_hold(controller, team))
+        await team.started.wait()
+        waiter = asyncio.create_task(wait_admitted())
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejectedError):
+            async with controller.admit("c"):
+                pass
+        waiter.cancel()  # 排队中的客户端断开
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert controller.stats()["queued"] == 0
+        await holder
+
+    asyncio.run(main())
+    assert controller.stats() == {"max_concurrent": 1, "running": 0, "queued": 0, "tenants": {}}
+
+
+def test_chat_events_reports_queue_position_and_rejection(chat_app, monkeypatch):
+    monkeypatch.setattr(chat_app, "admission_controller", AdmissionController(max_concurrent=1, max_queue=1))
+    blocking = BlockingTeam(call_seconds=30)
+    blocking_pool = TeamPool("chinese_writing", lambda: blocking)
+    scripted_pool = TeamPool("english_writing", lambda: ScriptedTeam([("Polisher", "essay")]))
+
+    async def collect(pool, topic):
+        return [json.loads(event) async for event in chat_app.chat_events(pool, topic)]
+
+    async def main():
+        holder = asyncio.create_task(collect(blocking_pool, "占用"))
+        await blocking.started.wait()
+        queued = asyncio.create_task(collect(scripted_pool, "排队"))
+        await asyncio.sleep(0.01)
+        rejected = await collect(scripted_pool, "拒绝")
+        holder.cancel()
+        await asyncio.gather(holder, return_exceptions=True)
+        return await queued, rejected
+
+    queued, rejected = asyncio.run(main())
+
+    assert queued[0] == {"status": "排队中", "position": 1}
+    assert queued[-1]["status"] == "任务完成"
+    assert [event["status"] for event in rejected] == ["错误"]
+    assert "排队请求已达上限" in rejected[0]["error"]
@@ -0,0 +1,53 @@
+import pytest
+
+from agent_config import AgentConfigError, AgentConfigRegistry, parse_agent_config
+
+VALID = """
+[agents.writer]
+name = "Writer"
+provider = "deepseek"
+model = "deepseek-chat"
+system_message = "写作"
+
+[agents.judge]
+name = "Judge"
+provider = "gemini"
+model = "gemini-2.0-flash"
+system_message = "评分"
+
+[teams.essay]
+pipeline = ["writer", "judge"]
+"""
+
+MALFORMED = {
+    "fallback_not_a_pair": VALID.replace('system_message = "写作"', 'system_message = "写作"\nfallbacks = [["deepseek"]]'),
+    "dag_node_without_key": VALID + '\n[[teams.essay.dag]]\ndepends_on = ["writer"]\n',
+    "context_policy_bad_field": VALID.replace('system_message = "写作"', 'system_message = "写作"\ncontext_policy = { keep_last = 2, unknown = 1 }'),
+    "context_policy_not_a_table": VALID.replace('system_message = "写作"', 'system_message = "写作"\ncontext_policy = "all"'),
+    "selector_not_a_table": VALID + '\n[teams.other]\npipeline = ["writer"]\nselector = "fast"\n',
+    "pipeline_not_a_list": VALID.replace('pipeline = ["writer", "judge"]', "pipeline = 3"),
+    "invalid_toml": VALID + "\n[agents.writer\n",
+}
+
+
+def test_valid_config_compiles():
+    config = parse_agent_config(VALID.encode(), "agent_config.toml")
+    assert config.teams["essay"].pipeline == ("writer", "judge")
+
+
+@pytest.mark.parametrize("case", sorted(MALFORMED))
+def test_malformed_config_raises_agent_config_error(case):
+    with pytest.raises(AgentConfigError):
+        parse_agent_config(MALFORMED[case].encode(), "agent_config.toml")
+
+
+def test_reload_keeps_current_config_when_file_is_malformed(tmp_path):
+    path = tmp_path / "agent_config.toml"
+    path.write_text(VALID, encoding="utf-8")
+    registry = AgentConfigRegistry(str(path))
+    current = registry.config
+
+    path.write_text(MALFORMED["dag_node_without_key"], encoding="utf-8")
+    with pytest.raises(AgentConfigError):
+        registry.reload(force=True)
+    assert registry.config is current
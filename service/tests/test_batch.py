@@ -0,0 +1,61 @@
+import asyncio
+
+from batch import run_batch
+from fakes import ScriptedTeam
+from team_pool import TeamPool
+
+
+def test_batch_dedupes_bounds_concurrency_and_tags_results(chat_app):
+    teams = []
+
+    def factory():
+        team = ScriptedTeam([("Writer", "草稿"), ("Polisher", "修改稿")], delay=0.01)
+        teams.append(team)
+        return team
+
+    pool = TeamPool("chinese_revision", factory, max_size=4)
+    running = peak = 0
+
+    async def run_one(content: str):
+        nonlocal running, peak
+        if content == "坏作文":
+            raise RuntimeError("模型调用失败")
+        running += 1
+        peak = max(peak, running)
+        try:
+            async for event in chat_app.chat_events(pool, content):
+                yield event
+        finally:
+            running -= 1
+
+    contents = ["甲", "乙", "甲", "丙", "坏作文", "丁"]
+
+    async def main():
+        return [event async for event in run_batch(contents, run_one, concurrency=2)]
+
+    events = asyncio.run(main())
+
+    assert events[0] == {"status": "批量开始", "total": 6, "unique": 5}
+    assert peak == 2
+    assert sum(team.runs for team in teams) == 4  # 重复的 "甲" 只运行一次，坏作文没有借出团队
+    # 默认只转发摘要事件，不包含片段和步骤
+    assert {event["status"] for event in events[1:-1]} <= {"排队中", "任务开始", "任务完成", "错误"}
+    finals = {event["index"]: event for event in events[1:-1] if event["status"] in ("任务完成", "错误")}
+    assert sorted(finals) == list(range(6))
+    assert finals[0]["result"] == finals[2]["result"] == "修改稿"
+    assert finals[4]["status"] == "错误" and "模型调用失败" in finals[4]["error"]
+    assert all("elapsed" in event for event in finals.values())
+    summary = events[-1]
+    assert summary["status"] == "批量完成"
+    assert (summary["total"], summary["succeeded"], summary["failed"]) == (6, 5, 1)
+
+
+def test_batch_include_steps_forwards_every_event(chat_app):
+    pool = TeamPool("chinese_revision", lambda: ScriptedTeam([("Polisher", "修改稿")]))
+
+    async def main():
+        return [event async for event in run_batch(["甲"], lambda content: chat_app.chat_events(pool, content), include_steps=True)]
+
+    statuses = [event["status"] for event in asyncio.run(main())]
+    assert "片段" in statuses and "步骤" in statuses
+    assert statuses[-2:] == ["任务完成", "批量完成"]
@@ -0,0 +1,72 @@
+import asyncio
+
+from autogen_core.models import AssistantMessage, UserMessage
+
+from context_policy import ContextPolicy, PolicyChatCompletionContext, estimate_tokens
+
+TASK = UserMessage(content="题目：春天", source="user")
+HISTORY = [
+    TASK,
+    UserMessage(content="大纲", source="Planner"),
+    AssistantMessage(content="草稿一", source="Writer"),
+    UserMessage(content="二类文", source="Judge"),
+    UserMessage(content="修改意见", source="Reviewer"),
+    AssistantMessage(content="草稿二", source="Writer"),
+    UserMessage(content="一类文", source="Judge"),
+]
+
+
+def _visible(policy: ContextPolicy, history=HISTORY, agent: str = "Writer"):
+    async def main():
+        context = PolicyChatCompletionContext(policy, agent)
+        for message in history:
+            await context.add_message(message)
+        return await context.get_messages()
+
+    return [(message.source, message.content) for message in asyncio.run(main())]
+
+
+def test_sources_keep_task_and_own_messages():
+    assert _visible(ContextPolicy(sources=("Judge",))) == [
+        ("user", "题目：春天"), ("Writer", "草稿一"), ("Judge", "二类文"), ("Writer", "草稿二"), ("Judge", "一类文"),
+    ]
+
+
+def test_latest_per_source():
+    assert _visible(ContextPolicy(sources=("Planner", "Judge"), latest_per_source=True)) == [
+        ("user", "题目：春天"), ("Planner", "大纲"), ("Writer", "草稿二"), ("Judge", "一类文"),
+    ]
+
+
+def test_keep_last_with_summary_of_dropped_messages():
+    visible = _visible(ContextPolicy(keep_last=2, summary_chars=2))
+    assert visible[0] == ("user", "题目：春天")
+    assert visible[1][0] == "context_summary"
+    assert "- Planner: 大纲" in visible[1][1] and "- Reviewer: 修改" in visible[1][1]
+    assert visible[2:] == [("Writer", "草稿二"), ("Judge", "一类文")]
+    # keep_last = 0 时只剩任务消息
+    assert _visible(ContextPolicy(keep_last=0)) == [("user", "题目：春天")]
+
+
+def test_token_budget_drops_oldest_and_always_keeps_task():
+    task_tokens = estimate_tokens(TASK.content)
+    visible = _visible(ContextPolicy(max_tokens=task_tokens + estimate_tokens("一类文") + estimate_tokens("草稿二")))
+    assert visible == [("user", "题目：春天"), ("Writer", "草稿二"), ("Judge", "一类文")]
+
+    # 预算只够任务时，最新的一条被截断，任务仍然保留
+    long_history = [TASK, UserMessage(content="很长的评语" * 50, source="Judge")]
+    visible = _visible(ContextPolicy(max_tokens=task_tokens + 5), long_history)
+    assert visible[0] == ("user", "题目：春天")
+    assert len(visible) == 2 and len(visible[1][1]) < len(long_history[1].content)
+    assert sum(estimate_tokens(content) for _, content in visible) <= task_tokens + 5
+
+
+def test_full_history_is_kept_in_the_context():
+    async def main():
+        context = PolicyChatCompletionContext(ContextPolicy(keep_last=1), "Writer")
+        for message in HISTORY:
+            await context.add_message(message)
+        await context.get_messages()
+        return context._messages
+
+    assert asyncio.run(main()) == HISTORY  # 只在读取时裁剪，不修改保存的消息
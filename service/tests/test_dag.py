@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+from autogen_agentchat.base import Response
+from autogen_agentchat.messages import TextMessage
+
+from dag import DagNode, DagTeam
+
+
+class FakeAgent:
+    """DAG 节点使用的假代理：等待 delay 秒后回复或抛出异常；结束时异步清理 (如关闭模型请求的连接) 后记录已结束。"""
+
+    def __init__(self, name: str, delay: float, fail: bool = False):
+        self.name = name
+        self.delay = delay
+        self.fail = fail
+        self.finished = False
+
+    async def on_messages_stream(self, messages, cancellation_token):
+        try:
+            await asyncio.sleep(self.delay)
+            if self.fail:
+                raise RuntimeError(f"{self.name} 调用失败")
+            yield Response(chat_message=TextMessage(content=f"{self.name} 的输出", source=self.name))
+        finally:
+            await asyncio.sleep(0.01)
+            self.finished = True
+
+    async def on_reset(self, cancellation_token):
+        pass
+
+
+def test_failed_node_cancels_and_awaits_running_siblings():
+    agents = {"fast": FakeAgent("Fast", 0.01, fail=True), "slow": FakeAgent("Slow", 10)}
+    team = DagTeam([DagNode("fast"), DagNode("slow")], agents.__getitem__)
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            async for _ in team.run_stream(task="题目"):
+                pass
+        # run_stream 抛出异常时，被取消的兄弟节点已经结束
+        return agents["slow"].finished
+
+    assert asyncio.run(main())
+
+
+def test_nodes_run_after_their_dependencies():
+    agents = {"a": FakeAgent("A", 0.01), "b": FakeAgent("B", 0.01), "c": FakeAgent("C", 0)}
+    team = DagTeam([DagNode("a"), DagNode("b"), DagNode("c", depends_on=("a", "b"))], agents.__getitem__)
+
+    result = asyncio.run(team.run(task="题目"))
+
+    assert [message.source for message in result.messages] == ["user", "A", "B", "C"]
@@ -0,0 +1,57 @@
+import asyncio
+
+from fakes import BlockingTeam
+from jobs import JobManager, JobStore, JOB_CANCELLED
+from team_pool import TeamPool
+
+
+async def _wait_released(pool: TeamPool, timeout: float = 2.0) -> float:
+    """等待团队实例归还团队池，返回耗时秒数。"""
+    started = asyncio.get_running_loop().time()
+    while pool.stats()["in_use"]:
+        if asyncio.get_running_loop().time() - started > timeout:
+            raise AssertionError(f"团队在 {timeout} 秒内没有归还: {pool.stats()}")
+        await asyncio.sleep(0.01)
+    return asyncio.get_running_loop().time() - started
+
+
+def test_last_subscriber_disconnect_releases_team_promptly(chat_app):
+    team = BlockingTeam()
+    pool = TeamPool("chinese_writing", lambda: team)
+
+    async def main():
+        async def consume():
+            async for _ in chat_app.chat_events(pool, "题目", cache_key="k"):
+                pass
+
+        stream = asyncio.create_task(consume())
+        await team.started.wait()
+        stream.cancel()  # EventSourceResponse 收到 http.disconnect 时同样取消生成器
+        return await _wait_released(pool)
+
+    assert asyncio.run(main()) < 1.0
+    assert not chat_app.in_flight_runs
+
+
+def test_cancelling_job_releases_team_promptly(chat_app, tmp_path):
+    team = BlockingTeam()
+    pool = TeamPool("chinese_writing", lambda: team)
+
+    def runner(job_type, payload, tenant):
+        return chat_app.chat_events(pool, payload["topic"], tenant)
+
+    async def main():
+        manager = JobManager(JobStore(str(tmp_path / "jobs.sqlite")), runner, workers=1)
+        manager.start()
+        try:
+            job_id = manager.submit("write_chinese", {"topic": "题目"}, "default")
+            await team.started.wait()
+            assert manager.cancel(job_id)
+            elapsed = await _wait_released(pool)
+            while manager.store.get(job_id)["status"] != JOB_CANCELLED:
+                await asyncio.sleep(0.01)
+            return elapsed
+        finally:
+            await manager.stop()
+
+    assert asyncio.run(main()) < 1.0
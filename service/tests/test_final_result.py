@@ -0,0 +1,51 @@
+import asyncio
+import json
+
+from autogen_agentchat.base import TaskResult
+from autogen_agentchat.messages import ModelClientStreamingChunkEvent, StructuredMessage, TextMessage
+
+from final_result import FinalEssay, FINAL_ESSAY_FORMAT
+from team_pool import TeamPool
+
+ESSAY = FinalEssay(title="标题", essay="最终作文", score="一类文", changes=["修改"])
+
+
+class StructuredTeam:
+    """Polisher 先以片段输出原始 JSON，再产出结构化的最终消息 (模型开启流式输出时的情形)。"""
+
+    async def run_stream(self, *, task: str, cancellation_token=None):
+        yield TextMessage(content=task, source="user")
+        raw = ESSAY.model_dump_json()
+        for start in range(0, len(raw), 8):
+            yield ModelClientStreamingChunkEvent(content=raw[start:start + 8], source="Polisher")
+        message = StructuredMessage[FinalEssay](content=ESSAY, source="Polisher", format_string=FINAL_ESSAY_FORMAT)
+        yield message
+        yield TaskResult(messages=[message], stop_reason="done")
+
+    async def reset(self) -> None:
+        pass
+
+
+def test_structured_step_keeps_content_in_delta_mode(chat_app):
+    pool = TeamPool("chinese_writing", StructuredTeam)
+
+    async def main():
+        return [event async for event in chat_app.delta_events(chat_app.chat_events(pool, "题目"))]
+
+    events = [json.loads(event) for event in asyncio.run(main())]
+
+    # 片段是原始 JSON，无法拼出作文；"步骤" 必须携带渲染后的作文
+    step = next(event["data"] for event in events if event["status"] == "步骤" and event["data"]["sender"] == "Polisher")
+    assert step["content"] == "最终作文"
+    assert not step.get("streamed")
+    assert events[-1]["final"]["structured"] and events[-1]["result"] == "最终作文"
+
+
+def test_structured_final_agent_does_not_stream():
+    import agents
+
+    polisher = agents.create_agent("polisher")
+    writer = agents.create_agent("writer")
+    assert polisher._output_content_type is FinalEssay
+    assert not polisher._model_client_stream
+    assert writer._model_client_stream == agents.STREAM_MODEL_OUTPUT
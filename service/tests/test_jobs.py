@@ -0,0 +1,123 @@
+import asyncio
+import json
+
+import pytest
+
+from fakes import ScriptedTeam
+from jobs import JobManager, JobStore, JOB_SUCCEEDED
+from team_pool import TeamPool
+
+SCRIPT = [("Writer", "草稿"), ("Polisher", "最终作文")]
+
+
+def _status(data: str) -> str:
+    return json.loads(data)["status"]
+
+
+@pytest.fixture
+def make_manager(chat_app, tmp_path):
+    """创建使用 ScriptedTeam 运行任务的 JobManager (需在事件循环中调用 start)。"""
+
+    def make(team: ScriptedTeam) -> JobManager:
+        pool = TeamPool("chinese_writing", lambda: team)
+
+        def runner(job_type, payload, tenant):
+            return chat_app.chat_events(pool, payload["topic"], tenant)
+
+        return JobManager(JobStore(str(tmp_path / "jobs.sqlite")), runner, workers=1)
+
+    return make
+
+
+async def _collect(manager: JobManager, job_id: str, last_event_id: int = 0):
+    return [item async for item in manager.follow(job_id, last_event_id)]
+
+
+def test_live_follow_and_resume_from_last_event_id(make_manager):
+    manager = make_manager(ScriptedTeam(SCRIPT, delay=0.01))
+
+    async def main():
+        manager.start()
+        try:
+            job_id = manager.submit("write_chinese", {"topic": "题目"}, "default")
+            first = []
+            async for seq, data in manager.follow(job_id):
+                first.append((seq, data))
+                if _status(data) == "片段":
+                    break  # 客户端在流式输出中途断开
+            resumed = await _collect(manager, job_id, last_event_id=first[-1][0])
+            return first, resumed
+        finally:
+            await manager.stop()
+
+    first, resumed = asyncio.run(main())
+
+    seqs = [seq for seq, _ in first + resumed]
+    assert seqs == list(range(1, len(seqs) + 1))  # 运行中重连：从断点继续，没有遗漏和重复
+    assert "片段" in [_status(data) for _, data in resumed]
+    assert _status(resumed[-1][1]) == "任务完成"
+
+
+def test_finished_job_replays_persisted_events_without_chunks(make_manager):
+    manager = make_manager(ScriptedTeam(SCRIPT))
+
+    async def main():
+        manager.start()
+        try:
+            job_id = manager.submit("write_chinese", {"topic": "题目"}, "default")
+            live = await _collect(manager, job_id)
+            while manager.store.get(job_id)["status"] != JOB_SUCCEEDED:
+                await asyncio.sleep(0.01)
+            replayed = await _collect(manager, job_id)
+            # 从某个 "片段" 的序号重连：之后的完整消息都在 "步骤" 事件中
+            chunk_seq = next(seq for seq, data in live if _status(data) == "片段")
+            resumed = await _collect(manager, job_id, last_event_id=chunk_seq)
+            return job_id, live, replayed, resumed, chunk_seq
+        finally:
+            await manager.stop()
+
+    job_id, live, replayed, resumed, chunk_seq = asyncio.run(main())
+
+    assert replayed == [(seq, data) for seq, data in live if _status(data) != "片段"]
+    assert manager.store.get(job_id)["events"] == len(replayed)
+    assert [seq for seq, _ in resumed] == [seq for seq, _ in replayed if seq > chunk_seq]
+    steps = [json.loads(data)["data"]["content"] for _, data in resumed if _status(data) == "步骤"]
+    assert steps == ["草稿", "最终作文"]
+    assert manager.store.get(job_id)["result"] == "最终作文"
+
+
+def test_follow_sees_events_of_a_job_that_finishes_between_reads(tmp_path):
+    class RacingStore(JobStore):
+        """第一次读取之后，任务立即开始并结束 (如命中结果缓存的回放)。"""
+
+        def __init__(self, path):
+            super().__init__(path)
+            self.finish_after_read = None
+
+        def _read(self, method, *args):
+            result = method(*args)
+            finish, self.finish_after_read = self.finish_after_read, None
+            if finish is not None:
+                finish()
+            return result
+
+        def get(self, job_id):
+            return self._read(super().get, job_id)
+
+        def events_after(self, job_id, seq):
+            return self._read(super().events_after, job_id, seq)
+
+    store = RacingStore(str(tmp_path / "jobs.sqlite"))
+    manager = JobManager(store, runner=None, workers=1)
+    job_id = store.create("write_chinese", {"topic": "题目"}, "default")
+    done = json.dumps({"status": "任务完成", "result": "最终作文"}, ensure_ascii=False)
+
+    def finish():
+        store.append_event(job_id, 1, done)
+        store.update(job_id, JOB_SUCCEEDED, "最终作文")
+
+    store.finish_after_read = finish
+
+    events = asyncio.run(_collect(manager, job_id))
+
+    assert events == [(1, done)]
@@ -0,0 +1,24 @@
+import pytest
+
+from llm_cache import CountingCacheStore, LRUCacheStore
+
+
+def test_cache_store_without_overrides_fails_on_creation():
+    class Incomplete(CountingCacheStore):
+        def _get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_lru_store_counts_hits_and_evicts_oldest():
+    store = LRUCacheStore(ttl=0, max_entries=2)
+    store.set("a", "1")
+    store.set("b", "2")
+    assert store.get("a") == "1"  # a 成为最近使用
+    store.set("c", "3")
+    assert store.get("b") is None
+    assert store.stats() | {"hit_rate": None} == {
+        "backend": "LRUCacheStore", "entries": 2, "hits": 1, "misses": 1, "evictions": 1, "hit_rate": None,
+    }
@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+from autogen_core.models import UserMessage
+from autogen_ext.models.replay import ReplayChatCompletionClient
+
+from rate_limit import ProviderRateLimiter, RateLimitedChatCompletionClient, TokenBucket, _estimate_prompt_tokens
+
+
+def test_rpm_allows_a_burst_up_to_the_minute_quota_then_paces():
+    limiter = ProviderRateLimiter("p", rpm=1200)  # 每秒补充 20 个请求
+
+    async def main():
+        started = time.monotonic()
+        for _ in range(1200):
+            await limiter.acquire(0)
+        burst = time.monotonic() - started
+        await limiter.acquire(0)
+        return burst, time.monotonic() - started - burst
+
+    burst, paced = asyncio.run(main())
+    assert burst < 0.5
+    assert 0.03 <= paced < 0.5
+
+
+def test_tpm_debits_actual_usage_after_the_call():
+    limiter = ProviderRateLimiter("p", tpm=6000)
+    inner = ReplayChatCompletionClient(["回复"])
+    client = RateLimitedChatCompletionClient(inner, limiter)
+    messages = [UserMessage(content="题目" * 50, source="user")]
+    estimated = _estimate_prompt_tokens(messages)
+
+    result = asyncio.run(client.create(messages))
+
+    used = result.usage.prompt_tokens + result.usage.completion_tokens
+    # 先按估算扣除，响应后按实际用量修正 (允许少量补充的误差)
+    assert abs(limiter.tokens.tokens - (6000 - used)) < 5
+    assert estimated != used
+
+
+def test_bucket_waits_for_overdraft_and_caps_oversized_requests():
+    bucket = TokenBucket(6000)  # 每秒补充 100
+
+    async def main():
+        bucket.debit(6010)  # 实际用量超过剩余额度
+        started = time.monotonic()
+        await bucket.acquire(1)  # 需要等透支补齐
+        overdraft_wait = time.monotonic() - started
+        bucket.tokens = bucket.capacity
+        started = time.monotonic()
+        await bucket.acquire(10**9)  # 超过容量的请求在桶满时放行
+        return overdraft_wait, time.monotonic() - started
+
+    overdraft_wait, oversized_wait = asyncio.run(main())
+    assert 0.08 <= overdraft_wait < 0.5
+    assert oversized_wait < 0.05
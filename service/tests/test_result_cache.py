@@ -0,0 +1,39 @@
+import asyncio
+import json
+
+from fakes import ScriptedTeam
+from team_pool import TeamPool
+
+SCRIPT = [("Writer", "草稿"), ("Polisher", "最终作文")]
+
+
+def _statuses(events):
+    return [json.loads(event)["status"] for event in events]
+
+
+def test_cached_replay_drops_chunks_and_keeps_step_content(chat_app):
+    team = ScriptedTeam(SCRIPT)
+    pool = TeamPool("chinese_writing", lambda: team)
+
+    async def collect(delta=False):
+        events = chat_app.chat_events(pool, "题目", cache_key="k")
+        if delta:
+            events = chat_app.delta_events(events)
+        return [event async for event in events]
+
+    async def main():
+        live = await collect()
+        replayed = await collect(delta=True)
+        return live, replayed
+
+    live, replayed = asyncio.run(main())
+
+    assert team.runs == 1  # 第二次请求命中结果缓存
+    assert "片段" in _statuses(live)
+    assert "片段" not in _statuses(replayed)
+    assert _statuses(replayed) == [status for status in _statuses(live) if status != "片段"]
+    # 回放时没有 "片段"，增量模式下 "步骤" 仍然携带完整内容
+    steps = [json.loads(event)["data"] for event in replayed if json.loads(event)["status"] == "步骤"]
+    assert [step["content"] for step in steps] == ["题目", "草稿", "最终作文"]
+    assert not any(step.get("streamed") for step in steps)
+    assert json.loads(replayed[-1])["result"] == "最终作文"
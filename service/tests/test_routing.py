@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+import pytest
+from autogen_core.models import CreateResult, RequestUsage, UserMessage
+from autogen_ext.models.replay import ReplayChatCompletionClient
+
+import routing
+from routing import CircuitBreaker, RouteCandidate, RoutingChatCompletionClient
+
+RESET_TIMEOUT = 0.05
+MESSAGES = [UserMessage(content="题目", source="user")]
+
+
+class FlakyClient(ReplayChatCompletionClient):
+    """按 fail 标记成功或失败的模型客户端，记录调用次数。"""
+
+    def __init__(self, fail: bool = False):
+        super().__init__(["ok"])
+        self.fail = fail
+        self.calls = 0
+
+    async def create(self, messages, **kwargs) -> CreateResult:
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError("模拟的提供商故障")
+        return CreateResult(finish_reason="stop", content="ok", usage=RequestUsage(prompt_tokens=1, completion_tokens=1), cached=False)
+
+
+@pytest.fixture
+def breakers(monkeypatch):
+    """每个测试使用独立的熔断器表：失败一次即熔断，RESET_TIMEOUT 秒后放行试探请求。"""
+    monkeypatch.setattr(routing, "circuit_breakers", {})
+
+    def make(*providers):
+        for provider in providers:
+            routing.circuit_breakers[provider] = CircuitBreaker(provider, failure_threshold=1, reset_timeout=RESET_TIMEOUT)
+        return routing.circuit_breakers
+
+    return make
+
+
+def _router(*candidates):
+    return RoutingChatCompletionClient([RouteCandidate(provider, "model", client) for provider, client in candidates])
+
+
+def test_is_available_has_no_side_effects():
+    breaker = CircuitBreaker("p", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.is_available() and breaker.is_available()
+    assert breaker.allow()  # 占用唯一的试探名额
+    assert not breaker.is_available() and not breaker.allow()
+    breaker.release_probe()
+    assert breaker.allow()
+
+
+def test_open_breaker_recovers_after_reset_timeout(breakers):
+    breakers("primary", "backup")
+    primary, backup = FlakyClient(fail=True), FlakyClient()
+    client = _router(("primary", primary), ("backup", backup))
+
+    async def main():
+        await client.create(MESSAGES)  # primary 失败，熔断；backup 完成调用
+        assert routing.circuit_breakers["primary"].opened_at is not None
+        primary.fail = False
+        await client.create(MESSAGES)  # 熔断期间直接使用 backup
+        assert primary.calls == 1
+        await asyncio.sleep(RESET_TIMEOUT * 2)
+        result = await client.create(MESSAGES)  # 试探请求发往 primary，成功后恢复
+        return result
+
+    assert asyncio.run(main()).content == "ok"
+    assert primary.calls == 2
+    assert routing.circuit_breakers["primary"].opened_at is None
+
+
+def test_ordering_does_not_consume_probe_of_undispatched_candidate(breakers):
+    # 两个代理共享 flaky 提供商的熔断器：一个把它作为后备，一个作为首选
+    breakers("healthy", "flaky", "other")
+    flaky = FlakyClient(fail=True)
+    as_fallback = _router(("healthy", FlakyClient()), ("flaky", flaky))
+    as_primary = _router(("flaky", flaky), ("other", FlakyClient()))
+
+    async def main():
+        await as_primary.create(MESSAGES)  # flaky 熔断
+        flaky.fail = False
+        await asyncio.sleep(RESET_TIMEOUT * 2)
+        # 首选健康，flaky 不会被调用；排序时不能占用它的试探名额
+        await as_fallback.create(MESSAGES)
+        await as_primary.create(MESSAGES)
+
+    asyncio.run(main())
+
+    assert flaky.calls == 2
+    assert routing.circuit_breakers["flaky"].opened_at is None
+
+
+def test_cancelled_probe_returns_its_slot(breakers):
+    breakers("slow", "fast")
+
+    class SlowClient(FlakyClient):
+        async def create(self, messages, **kwargs):
+            await asyncio.sleep(10)
+
+    client = RoutingChatCompletionClient(
+        [RouteCandidate("slow", "model", SlowClient()), RouteCandidate("fast", "model", FlakyClient())],
+        hedge_after=0.01,
+    )
+    breaker = routing.circuit_breakers["slow"]
+    breaker.record_failure()
+    breaker.opened_at = time.monotonic() - RESET_TIMEOUT  # 已到恢复时间
+
+    async def main():
+        # 试探请求迟迟没有响应，对冲到 fast 后被取消
+        return await client.create(MESSAGES)
+
+    assert asyncio.run(main()).content == "ok"
+    assert breaker.is_available()
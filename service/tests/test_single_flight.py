@@ -0,0 +1,54 @@
+import asyncio
+
+from fakes import ScriptedTeam
+from team_pool import TeamPool
+
+SCRIPT = [("Writer", "草稿"), ("Polisher", "最终作文")]
+
+
+def test_concurrent_identical_requests_share_one_run(chat_app):
+    team = ScriptedTeam(SCRIPT, delay=0.01)
+    pool = TeamPool("chinese_writing", lambda: team)
+
+    async def collect(delay):
+        await asyncio.sleep(delay)
+        return [event async for event in chat_app.chat_events(pool, "题目", cache_key="k")]
+
+    async def main():
+        # 第二、三个请求在运行进行中加入，会先收到已产生的事件
+        return await asyncio.gather(collect(0), collect(0.02), collect(0.05))
+
+    first, second, third = asyncio.run(main())
+
+    assert team.runs == 1
+    assert first == second == third
+    assert not chat_app.in_flight_runs
+
+
+def test_run_continues_while_other_subscribers_remain(chat_app):
+    team = ScriptedTeam(SCRIPT, delay=0.01)
+    pool = TeamPool("chinese_writing", lambda: team)
+
+    async def main():
+        async def consume():
+            async for _ in chat_app.chat_events(pool, "题目", cache_key="k"):
+                pass
+
+        async def leave_early():
+            await asyncio.sleep(0.03)
+            leaving.cancel()
+
+        leaving = asyncio.create_task(consume())
+        await asyncio.sleep(0.01)
+        canceller = asyncio.create_task(leave_early())
+        # 第一个订阅者中途断开，运行不应被取消
+        staying = [event async for event in chat_app.chat_events(pool, "题目", cache_key="k")]
+        await canceller
+        return leaving, staying
+
+    leaving, staying = asyncio.run(main())
+
+    assert leaving.cancelled()
+    assert team.runs == 1
+    assert '"status":"任务完成"' in staying[-1]
+    assert not team.tokens[0].is_cancelled()
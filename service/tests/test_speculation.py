@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+from autogen_agentchat.agents import AssistantAgent
+from autogen_agentchat.conditions import MaxMessageTermination
+from autogen_agentchat.teams import RoundRobinGroupChat
+from autogen_ext.models.replay import ReplayChatCompletionClient
+
+import speculation
+from speculation import KEEP, PATCH, REGENERATE, UNUSED, SpeculationStats, SpeculativeWriterAgent, parse_verdict, with_speculation
+
+
+class RecordingClient(ReplayChatCompletionClient):
+    """按脚本回复并记录每次调用收到的消息，可选地在回复前等待 delay 秒。"""
+
+    def __init__(self, replies, delay: float = 0.0):
+        super().__init__(list(replies))
+        self.delay = delay
+        self.requests = []
+
+    async def create(self, messages, **kwargs):
+        self.requests.append(list(messages))
+        await asyncio.sleep(self.delay)
+        return await super().create(messages, **kwargs)
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    stats = SpeculationStats()
+    monkeypatch.setattr(speculation, "speculation_stats", stats)
+    return stats
+
+
+def _team(verdict: str, draft_delay: float = 0.0, turns: int = 3):
+    writer = RecordingClient(["正式作文"])
+    drafter = RecordingClient(["推测草稿"], delay=draft_delay)
+    speculative = SpeculativeWriterAgent(
+        AssistantAgent("Writer", model_client=writer),
+        AssistantAgent("Writer", model_client=drafter),
+        AssistantAgent("DraftReconciler", model_client=RecordingClient([verdict])),
+        "team",
+    )
+    agents = [AssistantAgent("Planner", model_client=RecordingClient(["大纲"])), speculative]
+    team = with_speculation(RoundRobinGroupChat(agents, termination_condition=MaxMessageTermination(turns)), agents)
+    return team, writer
+
+
+def _run(team):
+    async def main():
+        result = await team.run(task="题目")
+        await team.reset()
+        return result
+
+    return asyncio.run(main())
+
+
+def test_parse_verdict():
+    assert parse_verdict("结论：保留") == KEEP
+    assert parse_verdict("Verdict: PATCH\n1. add x") == PATCH
+    assert parse_verdict("结论：保留\n……\n结论：重写") == REGENERATE  # 取最后一个
+    assert parse_verdict("没有结论") == REGENERATE
+
+
+def test_keep_uses_the_draft_without_calling_the_writer(stats):
+    team, writer = _team("结论：保留")
+    result = _run(team)
+    assert result.messages[-1].source == "Writer" and result.messages[-1].content == "推测草稿"
+    assert writer.requests == []
+    assert stats.stats()["teams"]["team"][KEEP] == 1
+
+
+def test_patch_sends_draft_and_notes_to_the_writer(stats):
+    team, writer = _team("结论：修补\n修补意见：紧扣大纲")
+    result = _run(team)
+    assert result.messages[-1].content == "正式作文"
+    prompt = writer.requests[0][-1].content
+    assert "推测草稿" in prompt and "紧扣大纲" in prompt
+    assert stats.stats()["teams"]["team"][PATCH] == 1
+
+
+def test_regenerate_writes_from_the_original_messages(stats):
+    team, writer = _team("结论：重写")
+    result = _run(team)
+    assert result.messages[-1].content == "正式作文"
+    assert all("推测草稿" not in str(message.content) for message in writer.requests[0])
+    assert stats.stats()["teams"]["team"][REGENERATE] == 1
+
+
+def test_draft_is_discarded_when_the_writer_never_speaks(stats):
+    # 只运行 Planner 一轮就结束，草稿仍在生成中
+    team, writer = _team("结论：保留", draft_delay=10, turns=2)
+    result = _run(team)
+    assert [message.source for message in result.messages] == ["user", "Planner"]
+    assert team.writers[0]._draft is None
+    assert stats.stats()["teams"]["team"][UNUSED] == 1
@@ -0,0 +1,87 @@
+import asyncio
+import json
+import zlib
+
+import pytest
+
+import sse
+from sse import CompressedEventSourceResponse, _BrotliEncoder, _GzipEncoder, delta_events, encode_event
+
+EVENTS = [
+    {"status": "任务开始"},
+    {"status": "片段", "agent": "Writer", "delta": "草"},
+    {"status": "步骤", "data": {"sender": "Writer", "content": "草稿", "streamed": True}},
+    # 内容中恰好包含 "streamed":true 的文本，不是增量模式要处理的事件
+    {"status": "步骤", "data": {"sender": "Judge", "content": '{"streamed":true}'}},
+    {"status": "任务完成", "result": '"streamed":true'},
+]
+
+
+async def _iterate(items):
+    for item in items:
+        yield item
+
+
+def test_delta_events_strips_only_streamed_steps():
+    async def main():
+        return [json.loads(item) async for item in delta_events(_iterate([encode_event(event) for event in EVENTS]))]
+
+    events = asyncio.run(main())
+
+    assert events[2] == {"status": "步骤", "data": {"sender": "Writer", "streamed": True}}
+    assert events[:2] + events[3:] == EVENTS[:2] + EVENTS[3:]
+
+
+class _GzipDecoder:
+    def __init__(self):
+        self._decompressor = zlib.decompressobj(31)
+
+    def decode(self, chunk: bytes) -> bytes:
+        return self._decompressor.decompress(chunk)
+
+
+class _BrotliDecoder:
+    def __init__(self):
+        import brotli
+
+        self._decompressor = brotli.Decompressor()
+
+    def decode(self, chunk: bytes) -> bytes:
+        return self._decompressor.process(chunk)
+
+
+CODECS = [
+    pytest.param(_GzipEncoder, _GzipDecoder, id="gzip"),
+    pytest.param(_BrotliEncoder, _BrotliDecoder, id="br", marks=pytest.mark.skipif(sse.brotli is None, reason="brotli 未安装")),
+]
+
+
+@pytest.mark.parametrize("encoder_class, decoder_class", CODECS)
+def test_compressed_stream_decodes_event_by_event(encoder_class, decoder_class):
+    payloads = [encode_event(event) for event in EVENTS]
+    decoder = decoder_class()
+    decoded = []  # 每个响应体分块到达后立即解压出的文本
+
+    async def main():
+        response = CompressedEventSourceResponse(_iterate(payloads), encoder=encoder_class(), ping=600)
+        disconnected = asyncio.Event()
+
+        async def receive():
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                headers = dict(message["headers"])
+                assert headers[b"content-encoding"] == encoder_class.name.encode()
+            elif message["type"] == "http.response.body":
+                decoded.append(decoder.decode(message.get("body", b"")).decode("utf-8"))
+
+        scope = {"type": "http", "method": "GET", "path": "/", "headers": [], "query_string": b""}
+        await response(scope, receive, send)
+
+    asyncio.run(main())
+
+    # 同步刷新：每个事件在自己的分块中完整可读，不需要等待后续数据
+    per_chunk = [[line[len("data: "):] for line in chunk.splitlines() if line.startswith("data: ")] for chunk in decoded]
+    assert [lines for lines in per_chunk if lines] == [[payload] for payload in payloads]
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+from autogen_agentchat.agents import AssistantAgent
+from autogen_agentchat.messages import TextMessage
+from autogen_agentchat.teams import SelectorGroupChat
+from autogen_ext.models.replay import ReplayChatCompletionClient
+
+from state_machine import END, USER_KEY, Transition, TransitionStateMachine, TransitionTermination
+
+# Writer -> Judge；评分达到一类文 (9 分) 结束，否则交给 Polisher 修改后再评分
+TRANSITIONS = {
+    USER_KEY: Transition("Writer"),
+    "Writer": Transition("Judge"),
+    "Judge": Transition(END, score_at_least=8, otherwise="Polisher"),
+    "Polisher": Transition("Judge"),
+}
+
+
+def _messages(*turns):
+    return [TextMessage(content=content, source=source) for source, content in turns]
+
+
+def test_score_branches_and_loops_until_passing():
+    machine = TransitionStateMachine(TRANSITIONS, max_iterations=3)
+    history = _messages(("user", "题目"), ("Writer", "草稿"), ("Judge", "二类文"))
+    assert machine.next_speaker(history[:1]) == "Writer"
+    assert machine.next_speaker(history) == "Polisher"
+    history += _messages(("Polisher", "修改稿"), ("Judge", "综合评分：一类文"))
+    assert machine.next_speaker(history[:-1]) == "Judge"
+    assert machine.next_speaker(history) == END
+    assert machine.selector(history) is None  # 结束时交给终止条件
+
+
+def test_max_iterations_ends_the_revision_loop():
+    machine = TransitionStateMachine(TRANSITIONS, max_iterations=1)
+    history = _messages(("user", "题目"), ("Writer", "草稿"), ("Judge", "二类文"), ("Polisher", "修改稿"))
+    # Judge 已发言一次，不能再进入评分
+    assert machine.next_speaker(history) == END
+
+
+def test_user_proxy_and_unknown_speakers():
+    machine = TransitionStateMachine(TRANSITIONS, user_names=("UserProxy",))
+    assert machine.next_speaker(_messages(("UserProxy", "题目"))) == "Writer"
+    assert machine.next_speaker(_messages(("user", "题目"), ("Other", "..."))) is None
+    with pytest.raises(ValueError):
+        TransitionStateMachine(TRANSITIONS, max_iterations=0)
+
+
+def test_termination_and_selector_drive_a_selector_team():
+    machine = TransitionStateMachine(TRANSITIONS, max_iterations=2)
+
+    def agent(name: str, *replies: str) -> AssistantAgent:
+        return AssistantAgent(name, model_client=ReplayChatCompletionClient(list(replies)))
+
+    termination = TransitionTermination(machine)
+    team = SelectorGroupChat(
+        [agent("Writer", "草稿"), agent("Judge", "二类文", "一类文"), agent("Polisher", "修改稿")],
+        # 转移表覆盖所有发言者，选择器模型不会被调用
+        model_client=ReplayChatCompletionClient([]),
+        termination_condition=termination,
+        selector_func=machine.selector,
+    )
+
+    async def main():
+        first = await team.run(task="题目")
+        await team.reset()
+        return first, termination.terminated
+
+    result, terminated = asyncio.run(main())
+
+    assert [message.source for message in result.messages] == ["user", "Writer", "Judge", "Polisher", "Judge"]
+    assert "Judge" in result.stop_reason
+    assert not terminated  # reset 后可以再次运行
@@ -0,0 +1,83 @@
+import asyncio
+
+from autogen_agentchat.agents import AssistantAgent
+from autogen_agentchat.conditions import MaxMessageTermination
+from autogen_agentchat.messages import TextMessage
+from autogen_agentchat.teams import RoundRobinGroupChat
+from autogen_core.models import RequestUsage
+from autogen_ext.models.replay import ReplayChatCompletionClient
+
+from termination import RunLimits, RunTermination, resolve_run_limits
+
+
+def _message(source: str, content: str, tokens: int = 0) -> TextMessage:
+    usage = RequestUsage(prompt_tokens=tokens, completion_tokens=0) if tokens else None
+    return TextMessage(content=content, source=source, models_usage=usage)
+
+
+def _condition(**limits) -> RunTermination:
+    condition = RunTermination("team", scorers=["Judge"], drafts=["Writer"])
+    condition.configure(resolve_run_limits(RunLimits(**limits)))
+    return condition
+
+
+async def _feed(condition: RunTermination, *messages):
+    """逐条送入消息，返回第一个 StopMessage 及其位置。"""
+    for index, message in enumerate(messages):
+        stop = await condition([message])
+        if stop is not None:
+            return index, stop
+    return None, None
+
+
+def test_score_needs_a_draft_before_stopping():
+    condition = _condition(score_threshold=8)
+    index, stop = asyncio.run(_feed(
+        condition,
+        _message("user", "题目"),
+        _message("Judge", "综合评分：一类文"),  # 还没有作文，评分不算数
+        _message("Writer", "草稿"),
+        _message("Judge", "综合评分：二类文"),
+        _message("Judge", "综合评分：一类文"),
+    ))
+    assert index == 4 and stop.content.startswith("score")
+    assert condition.terminated
+
+
+def test_budget_conditions():
+    index, stop = asyncio.run(_feed(_condition(max_turns=2), _message("user", "题目"), _message("Writer", "a"), _message("Judge", "b")))
+    assert index == 2 and stop.content.startswith("max_turns")
+
+    index, stop = asyncio.run(_feed(_condition(max_tokens=100), _message("Writer", "a", tokens=60), _message("Judge", "b", tokens=60)))
+    assert index == 1 and stop.content.startswith("max_tokens")
+
+
+def test_unchanged_draft_stops_and_reset_restores_defaults():
+    condition = _condition(min_change=0.1)
+
+    async def main():
+        first = await _feed(condition, _message("Writer", "今天天气很好，我们去公园散步。"), _message("Writer", "今天天气很好，我们去公园散步！"))
+        await condition.reset()
+        return first
+
+    index, stop = asyncio.run(main())
+    assert index == 1 and stop.content.startswith("no_change")
+    assert not condition.terminated
+    assert condition.limits == resolve_run_limits()
+
+
+def test_run_termination_stops_a_team_early():
+    def agent(name: str, reply: str) -> AssistantAgent:
+        return AssistantAgent(name, model_client=ReplayChatCompletionClient([reply] * 3))
+
+    condition = _condition(score_threshold=8)
+    team = RoundRobinGroupChat(
+        [agent("Writer", "草稿"), agent("Judge", "综合评分：一类文"), agent("Polisher", "最终作文")],
+        termination_condition=MaxMessageTermination(10) | condition,
+    )
+
+    result = asyncio.run(team.run(task="题目"))
+
+    # Judge 评分达标后跳过 Polisher
+    assert [message.source for message in result.messages] == ["user", "Writer", "Judge"]
+    assert result.stop_reason.startswith("score")
@@ -0,0 +1,43 @@
+import dataclasses
+
+import pytest
+
+import teams
+from agent_config import agent_config
+
+
+@pytest.fixture
+def config(monkeypatch):
+    """在当前配置的副本上修改代理层级和团队模式 (全局分层模式为 remote)。"""
+    monkeypatch.setattr(teams, "LLM_TIER_MODE", "remote")
+    monkeypatch.setattr(teams, "TEAM_MODE", "pipeline")
+    current = agent_config.config
+
+    def apply(local_agents=(), team_mode=None):
+        agents = {key: dataclasses.replace(spec, tier="local" if key in local_agents else "remote") for key, spec in current.agents.items()}
+        team_specs = {name: dataclasses.replace(spec, mode=team_mode) for name, spec in current.teams.items()}
+        monkeypatch.setattr(agent_config, "_config", dataclasses.replace(current, agents=agents, teams=team_specs))
+
+    return apply
+
+
+def test_remote_mode_without_local_agents_does_not_warm(config):
+    config()
+    assert not teams.uses_local_tier()
+
+
+def test_agent_declared_local_starts_keep_warm_in_remote_mode(config):
+    # 全局 remote 模式下，请求仍可按代理声明的层级执行 (RoutingRules.mode = tiered)
+    config(local_agents={"writer"})
+    assert teams.uses_local_tier()
+
+
+def test_selector_team_uses_local_tier(config):
+    config(team_mode="selector")
+    assert teams.uses_local_tier()
+
+
+def test_tiered_mode_uses_local_tier(config, monkeypatch):
+    config()
+    monkeypatch.setattr(teams, "LLM_TIER_MODE", "tiered")
+    assert teams.uses_local_tier()
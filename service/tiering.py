@@ -0,0 +1,372 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, Callable, Deque, Dict, Literal, Mapping, Optional, Sequence, Tuple, Union
+
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage, SystemMessage, UserMessage
+from autogen_core.tools import Tool, ToolSchema
+from pydantic import BaseModel, Field
+
+from model_clients import DelegatingChatCompletionClient
+from metrics import LLM_TIER_LATENCY, LOCAL_TIER_QUEUE_WAIT, REQUEST_SCORE
+
+logger = logging.getLogger(__name__)
+
+# --- 分层执行 ---
+# 输出短、结构固定的代理 (题目分析、标题设计、评分、选择发言者等) 可以交给本地模型 (Ollama / llama.cpp 的 OpenAI 兼容端点)，
+# 只有写作和润色代理调用远程提供商。每个代理在 agent_config.toml 中声明 tier = "local" / "remote"。
+# LLM_TIER_MODE: remote (全部使用代理自身的候选模型，默认)、tiered (按代理声明的层级)、local (所有代理优先使用本地模型)
+# LOCAL_TIER_PROVIDER / LOCAL_TIER_MODEL: 本地层使用的提供商和模型 (base_url 见 agents.py 中的 OLLAMA_BASE_URL)
+# LOCAL_TIER_PARALLEL: 本地服务器的并行槽位 (Ollama 的 OLLAMA_NUM_PARALLEL / llama.cpp 的 --parallel)，
+#   并发请求由服务器在槽位内连续批处理，超出的请求在本进程排队，避免挤占服务器队列导致远程回退
+# LOCAL_TIER_WARM_INTERVAL: 本地模型空闲多少秒后发一个 1 token 的请求保持模型常驻 (Ollama 默认 5 分钟卸载)，0 表示不预热
+LLM_TIER_MODE = os.getenv("LLM_TIER_MODE", "remote").lower()
+LOCAL_TIER_PROVIDER = os.getenv("LOCAL_TIER_PROVIDER", "ollama").lower()
+LOCAL_TIER_MODEL = os.getenv("LOCAL_TIER_MODEL", "qwen3:14b")
+LOCAL_TIER_PARALLEL = int(os.getenv("LOCAL_TIER_PARALLEL", "4"))
+LOCAL_TIER_WARM_INTERVAL = float(os.getenv("LOCAL_TIER_WARM_INTERVAL", "240"))
+
+TIER_LOCAL = "local"
+TIER_REMOTE = "remote"
+TIERS = (TIER_LOCAL, TIER_REMOTE)
+TIER_MODES = ("remote", "tiered", "local")
+# 选择器模型在路由规则中使用的键
+SELECTOR_KEY = "selector"
+
+if LLM_TIER_MODE not in TIER_MODES:
+    raise ValueError(f"不支持的 LLM_TIER_MODE: {LLM_TIER_MODE}，可选值: {TIER_MODES}")
+
+# 延迟样本窗口 (用于报告中的分位数)
+_SAMPLE_WINDOW = 1000
+
+
+class RoutingRules(BaseModel):
+    """单次请求的分层路由规则，未设置时使用 LLM_TIER_MODE 和代理声明的层级。"""
+    mode: Literal["remote", "tiered", "local"] | None = Field(default=None, description="本次请求的分层模式")
+    agents: Dict[str, Literal["local", "remote"]] = Field(default_factory=dict, description="按智能体键 (或 selector) 指定层级，优先于 mode")
+
+    @property
+    def label(self) -> str:
+        """用于报告和指标的路由标签：有按代理覆盖的规则时为 custom。"""
+        return "custom" if self.agents else (self.mode or LLM_TIER_MODE)
+
+
+# 当前请求的路由规则，随 asyncio 任务的上下文传递到团队运行时中的模型调用
+_request_routing: ContextVar[RoutingRules | None] = ContextVar("request_routing", default=None)
+
+
+def set_request_routing(rules: RoutingRules | None) -> None:
+    """在请求的运行任务中设置路由规则 (只影响该任务及其派生的任务)。"""
+    _request_routing.set(rules)
+
+
+def resolve_tier(key: str, declared: str) -> str:
+    """按请求规则、全局模式和代理声明的层级决定本次调用使用的层级。"""
+    rules = _request_routing.get()
+    if rules is not None and key in rules.agents:
+        return rules.agents[key]
+    mode = (rules.mode if rules is not None else None) or LLM_TIER_MODE
+    if mode == "remote":
+        return TIER_REMOTE
+    if mode == "local":
+        return TIER_LOCAL
+    return declared
+
+
+def _percentile(samples: Sequence[float], q: float) -> float | None:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+
+
+class LocalTier:
+    """
+    本地层的共享状态：并行槽位 (请求批处理)、模型预热，以及各层级的质量 / 延迟统计。
+
+    OpenAI 兼容端点没有批量接口，Ollama / llama.cpp 会把同时到达的请求放进各自的槽位连续批处理 (continuous batching)。
+    因此这里的批处理是把本地调用限制在 parallel 个并发内同时发出，让服务器每一步解码都填满槽位；
+    多余的请求在进程内排队，而不是在服务器端排队直到超时再回退到远程。
+    """
+
+    def __init__(self, parallel: int = LOCAL_TIER_PARALLEL):
+        self.parallel = parallel
+        self._semaphore: asyncio.Semaphore | None = None
+        self.waiting = 0
+        self.in_use = 0
+        self.last_used: float | None = None
+        self.warmed_at: float | None = None
+        self._client_factory: Callable[[], ChatCompletionClient] | None = None
+        self._warm_client: ChatCompletionClient | None = None
+        self._calls: Dict[str, int] = {tier: 0 for tier in TIERS}
+        self._errors: Dict[str, int] = {tier: 0 for tier in TIERS}
+        self._fallbacks = 0
+        self._latencies: Dict[str, Deque[float]] = {tier: deque(maxlen=_SAMPLE_WINDOW) for tier in TIERS}
+        self._queue_waits: Deque[float] = deque(maxlen=_SAMPLE_WINDOW)
+        self._scores: Dict[str, Deque[float]] = {}
+        self._runs: Dict[str, int] = {}
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # 在首次使用时创建，保证绑定到服务运行的事件循环
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.parallel)
+        return self._semaphore
+
+    def set_client_factory(self, factory: Callable[[], ChatCompletionClient]) -> None:
+        """设置预热使用的本地模型客户端工厂 (由 agents.py 注册，不经过补全缓存，否则预热请求到不了服务器)。"""
+        self._client_factory = factory
+
+    async def acquire(self) -> float:
+        """占用一个槽位，返回排队等待的秒数。"""
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_use += 1
+        wait = time.monotonic() - started
+        self._queue_waits.append(wait)
+        LOCAL_TIER_QUEUE_WAIT.observe(wait)
+        self.last_used = time.monotonic()
+        return wait
+
+    def release(self) -> None:
+        self.in_use -= 1
+        self.last_used = time.monotonic()
+        self.semaphore.release()
+
+    def record_call(self, tier: str, latency: float, ok: bool) -> None:
+        self._calls[tier] += 1
+        if ok:
+            self._latencies[tier].append(latency)
+            LLM_TIER_LATENCY.labels(tier).observe(latency)
+        else:
+            self._errors[tier] += 1
+
+    def record_fallback(self, candidate: Any = None) -> None:
+        """本地模型失败 (或熔断) 后由远程候选完成了调用 (作为本地层路由客户端的 on_failover 回调)。"""
+        self._fallbacks += 1
+
+    def record_run(self, team: str, routing: str, score: float | None) -> None:
+        """记录一次运行的路由标签和评分代理给出的最后一个分数，用于比较各模式的质量。"""
+        self._runs[routing] = self._runs.get(routing, 0) + 1
+        if score is not None:
+            self._scores.setdefault(routing, deque(maxlen=_SAMPLE_WINDOW)).append(score)
+            REQUEST_SCORE.labels(team, routing).observe(score)
+
+    async def warm_up(self) -> bool:
+        """发一个 1 token 的请求，让本地服务器加载模型 (或重置空闲卸载计时)。"""
+        if self._client_factory is None:
+            return False
+        started = time.monotonic()
+        try:
+            if self._warm_client is None:
+                self._warm_client = self._client_factory()
+            await self._warm_client.create(
+                [SystemMessage(content="ping"), UserMessage(content="ping", source="warmup")],
+                extra_create_args={"max_tokens": 1},
+            )
+        except Exception as e:
+            logger.warning(f"本地模型 {LOCAL_TIER_PROVIDER}/{LOCAL_TIER_MODEL} 预热失败: {type(e).__name__}: {e}")
+            return False
+        self.last_used = time.monotonic()
+        self.warmed_at = time.time()
+        logger.info(f"本地模型 {LOCAL_TIER_PROVIDER}/{LOCAL_TIER_MODEL} 已预热，耗时 {self.last_used - started:.2f} 秒。")
+        return True
+
+    async def keep_warm(self, interval: float = LOCAL_TIER_WARM_INTERVAL) -> None:
+        """服务启动时预热，之后在本地模型空闲超过 interval 秒时再次预热 (在服务启动时创建任务)。"""
+        attempted = 0.0
+        while True:
+            idle = time.monotonic() - max(self.last_used or 0, attempted)
+            if idle >= interval:
+                await self.warm_up()
+                attempted = time.monotonic()
+                continue
+            await asyncio.sleep(interval - idle)
+
+    def stats(self) -> Dict[str, Any]:
+        """各层级的调用次数、错误、延迟分位数，本地槽位状态以及各路由模式的评分。"""
+        tiers = {
+            tier: {
+                "calls": self._calls[tier],
+                "errors": self._errors[tier],
+                "latency_p50": _percentile(self._latencies[tier], 0.5),
+                "latency_p95": _percentile(self._latencies[tier], 0.95),
+            }
+            for tier in TIERS
+        }
+        tiers[TIER_LOCAL].update({
+            "fallbacks": self._fallbacks,
+            "queue_wait_p95": _percentile(self._queue_waits, 0.95),
+        })
+        quality = {
+            routing: {
+                "runs": runs,
+                "scored": len(self._scores.get(routing, ())),
+                "mean_score": round(sum(self._scores[routing]) / len(self._scores[routing]), 2) if self._scores.get(routing) else None,
+            }
+            for routing, runs in self._runs.items()
+        }
+        return {
+            "mode": LLM_TIER_MODE,
+            "local": {
+                "provider": LOCAL_TIER_PROVIDER,
+                "model": LOCAL_TIER_MODEL,
+                "parallel": self.parallel,
+                "in_use": self.in_use,
+                "waiting": self.waiting,
+                "warmed_at": self.warmed_at,
+            },
+            "tiers": tiers,
+            "quality": quality,
+        }
+
+
+local_tier = LocalTier()
+
+
+class LocalTierClient(DelegatingChatCompletionClient):
+    """本地模型客户端：每次调用 (流式调用直到结束) 占用本地服务器的一个并行槽位。"""
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        await local_tier.acquire()
+        try:
+            return await self.inner.create(
+                messages,
+                tools=tools,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token,
+            )
+        finally:
+            local_tier.release()
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        await local_tier.acquire()
+        try:
+            async for item in self.inner.create_stream(
+                messages,
+                tools=tools,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token,
+            ):
+                yield item
+        finally:
+            local_tier.release()
+
+
+class TieredChatCompletionClient(DelegatingChatCompletionClient):
+    """
+    按层级选择模型客户端：远程层使用代理自身的候选模型 (inner)，本地层使用本地模型在前、
+    代理候选模型在后的路由客户端，本地模型失败、超时或熔断时自动回退到远程 (见 routing.py)。
+
+    层级在每次调用时按当前请求的路由规则决定，同一个代理实例可以服务不同规则的请求。
+    本地客户端在首次需要时才创建；本地提供商未配置时记录一次警告并一直使用远程层。
+    """
+
+    def __init__(self, remote: ChatCompletionClient, key: str, tier: str, local_factory: Callable[[], ChatCompletionClient]):
+        """
+        Args:
+            remote: 代理自身的 (路由) 模型客户端
+            key: 智能体键 (选择器为 SELECTOR_KEY)，用于匹配请求的路由规则
+            tier: 代理声明的层级
+            local_factory: 创建本地层客户端的工厂
+        """
+        super().__init__(remote)
+        self.key = key
+        self.tier = tier
+        self._local_factory = local_factory
+        self._local: ChatCompletionClient | None = None
+        self._local_unavailable = False
+
+    def _local_client(self) -> ChatCompletionClient | None:
+        if self._local is None and not self._local_unavailable:
+            try:
+                self._local = self._local_factory()
+            except ValueError as e:
+                self._local_unavailable = True
+                logger.warning(f"{self.key} 无法使用本地模型 {LOCAL_TIER_PROVIDER}/{LOCAL_TIER_MODEL}，改用远程模型: {e}")
+        return self._local
+
+    def _select(self, json_output: Optional[bool | type[BaseModel]]) -> Tuple[str, ChatCompletionClient]:
+        if resolve_tier(self.key, self.tier) == TIER_LOCAL:
+            local = self._local_client()
+            # 需要结构化输出而本地模型不支持时 (如输出最终作文的代理被路由到本地) 直接使用远程层
+            structured = isinstance(json_output, type)
+            if local is not None and not (structured and not local.model_info.get("structured_output")):
+                return TIER_LOCAL, local
+        return TIER_REMOTE, self.inner
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        tier, client = self._select(json_output)
+        started = time.monotonic()
+        try:
+            result = await client.create(
+                messages,
+                tools=tools,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token,
+            )
+        except Exception:
+            local_tier.record_call(tier, time.monotonic() - started, ok=False)
+            raise
+        local_tier.record_call(tier, time.monotonic() - started, ok=True)
+        return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        tier, client = self._select(json_output)
+        started = time.monotonic()
+        try:
+            async for item in client.create_stream(
+                messages,
+                tools=tools,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token,
+            ):
+                yield item
+        except Exception:
+            local_tier.record_call(tier, time.monotonic() - started, ok=False)
+            raise
+        local_tier.record_call(tier, time.monotonic() - started, ok=True)
@@ -0,0 +1,243 @@
+import os
+import logging
+import threading
+from typing import Any, AsyncGenerator, AsyncIterator, Mapping, Optional, Sequence, Union
+
+import httpx
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage
+from autogen_core.tools import Tool, ToolSchema
+from opentelemetry import context as otel_context
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+from opentelemetry.trace import Span, SpanKind, Status, StatusCode
+from pydantic import BaseModel
+
+from model_clients import DelegatingChatCompletionClient
+
+logger = logging.getLogger(__name__)
+
+# --- 链路追踪配置 ---
+# TRACING_EXPORTER: 'none' (默认，不导出)、'otlp' (发送到本地 collector，地址由 OTEL_EXPORTER_OTLP_ENDPOINT 指定)
+# 或 'json' (每行一个 span 写入 TRACING_JSON_PATH)
+# 每个 /write/* 与 /revise/* 请求对应一条 trace：
+#   请求根 span -> 每个代理发言 (一次模型调用) 的子 span -> 每次 HTTP 请求 (含 SDK 重试) 的孙 span
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower()
+TRACING_JSON_PATH = os.getenv("TRACING_JSON_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "traces.jsonl"))
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "essay-service")
+
+# 未调用 setup_tracing 时使用 OpenTelemetry 的空实现，所有 span 操作几乎没有开销
+tracer = trace.get_tracer("essay")
+
+
+class JsonFileSpanExporter(SpanExporter):
+    """把结束的 span 以 JSON Lines 格式追加到本地文件，便于离线分析。"""
+
+    def __init__(self, path: str = TRACING_JSON_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, spans) -> SpanExportResult:
+        with self._lock:
+            for span in spans:
+                self._file.write(span.to_json(indent=None) + "\n")
+            self._file.flush()
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def _create_exporter() -> SpanExporter | None:
+    if TRACING_EXPORTER == "none":
+        return None
+    if TRACING_EXPORTER == "json":
+        logger.info(f"链路追踪写入 JSON 文件: {TRACING_JSON_PATH}")
+        return JsonFileSpanExporter(TRACING_JSON_PATH)
+    if TRACING_EXPORTER == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            logger.error("未安装 opentelemetry-exporter-otlp-proto-http，无法导出到 collector。")
+            return None
+        logger.info("链路追踪导出到 OTLP collector。")
+        return OTLPSpanExporter()
+    raise ValueError(f"不支持的链路追踪导出方式: {TRACING_EXPORTER}")
+
+
+_tracer_provider: TracerProvider | None = None
+
+
+def setup_tracing() -> None:
+    """按 TRACING_EXPORTER 安装全局 TracerProvider (服务启动时调用一次)。"""
+    global _tracer_provider
+    exporter = _create_exporter()
+    if exporter is None or _tracer_provider is not None:
+        return
+    _tracer_provider = TracerProvider(resource=Resource.create({"service.name": TRACING_SERVICE_NAME}))
+    _tracer_provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(_tracer_provider)
+
+
+def shutdown_tracing() -> None:
+    """导出剩余的 span 并关闭导出器 (服务关闭时调用)。"""
+    if _tracer_provider is not None:
+        _tracer_provider.shutdown()
+
+
+def start_request_span(name: str, **attributes: Any) -> Span:
+    """在端点中创建请求的根 span，由 run_autogen_chat_stream 在流结束时结束。"""
+    return tracer.start_span(name, kind=SpanKind.SERVER, attributes=attributes, context=otel_context.Context())
+
+
+def end_request_span(span: Span, error: str | None = None) -> None:
+    if error:
+        span.set_status(Status(StatusCode.ERROR, error))
+    span.end()
+
+
+class TracingChatCompletionClient(DelegatingChatCompletionClient):
+    """
+    每次模型调用 (即代理的一次发言) 创建一个 span，
+    调用期间该 span 是当前上下文，传输层的 HTTP span 会挂在它下面。
+    """
+
+    def __init__(self, inner: ChatCompletionClient, agent: str, provider: str, model: str):
+        super().__init__(inner)
+        self.span_name = f"agent.turn {agent}"
+        self.attributes = {"essay.agent": agent, "gen_ai.system": provider, "gen_ai.request.model": model}
+
+    @staticmethod
+    def _annotate(span: Span, result: CreateResult) -> None:
+        span.set_attribute("essay.cached", bool(result.cached))
+        span.set_attribute("gen_ai.usage.input_tokens", result.usage.prompt_tokens)
+        span.set_attribute("gen_ai.usage.output_tokens", result.usage.completion_tokens)
+        span.set_attribute("gen_ai.response.finish_reasons", [str(result.finish_reason)])
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        with tracer.start_as_current_span(self.span_name, attributes=self.attributes) as span:
+            result = await super().create(
+                messages,
+                tools=tools,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token,
+            )
+            self._annotate(span, result)
+            return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        span = tracer.start_span(self.span_name, attributes=self.attributes)
+        span_context = trace.set_span_in_context(span)
+        stream = super().create_stream(
+            messages,
+            tools=tools,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        )
+        chunks = 0
+        try:
+            while True:
+                # 生成器在 yield 之间可能切换上下文，只在取下一个分片时挂上本 span
+                token = otel_context.attach(span_context)
+                try:
+                    item = await stream.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    otel_context.detach(token)
+                if isinstance(item, CreateResult):
+                    self._annotate(span, item)
+                elif chunks == 0:
+                    span.add_event("first_token")
+                chunks += 1
+                yield item
+        except BaseException as e:
+            span.record_exception(e)
+            span.set_status(Status(StatusCode.ERROR, str(e) or type(e).__name__))
+            raise
+        finally:
+            span.set_attribute("essay.stream_chunks", chunks)
+            span.end()
+            await stream.aclose()
+
+
+class _SpanClosingStream(httpx.AsyncByteStream):
+    """流式响应读完或关闭时结束 HTTP span，使 span 覆盖完整的响应传输时间。"""
+
+    def __init__(self, inner: httpx.AsyncByteStream, span: Span):
+        self._inner = inner
+        self._span = span
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        received = 0
+        try:
+            async for chunk in self._inner:
+                received += len(chunk)
+                yield chunk
+        finally:
+            self._span.set_attribute("http.response.body.size", received)
+
+    async def aclose(self) -> None:
+        try:
+            await self._inner.aclose()
+        finally:
+            self._span.end()
+
+
+class TracingTransport(httpx.AsyncBaseTransport):
+    """为每次 HTTP 请求创建 span；OpenAI SDK 的每次重试都会单独经过传输层，因此各自对应一个 span。"""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, provider: str):
+        self._inner = inner
+        self._provider = provider
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        span = tracer.start_span(
+            f"HTTP {request.method}",
+            kind=SpanKind.CLIENT,
+            attributes={
+                "http.request.method": request.method,
+                "url.full": str(request.url),
+                "server.address": request.url.host,
+                "gen_ai.system": self._provider,
+                # OpenAI SDK 在每次请求的头中带上已重试次数
+                "http.request.resend_count": int(request.headers.get("x-stainless-retry-count", "0") or 0),
+            },
+        )
+        try:
+            response = await self._inner.handle_async_request(request)
+        except BaseException as e:
+            span.record_exception(e)
+            span.set_status(Status(StatusCode.ERROR, str(e) or type(e).__name__))
+            span.end()
+            raise
+        span.set_attribute("http.response.status_code", response.status_code)
+        if response.status_code >= 400:
+            span.set_status(Status(StatusCode.ERROR, f"HTTP {response.status_code}"))
+        response.stream = _SpanClosingStream(response.stream, span)
+        return response
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()